@@ -0,0 +1,136 @@
+"""Benchmark of word -> line assembly in pdf_extraction.word_df_to_line_df.
+
+Compares the previous groupby/apply + merge/drop_duplicates implementation with the vectorized one on the
+word table of a 50-page manuscript, and checks that both produce the same lines.
+
+Usage:
+    python benchmarks/bench_pdf_extraction.py [path/to/manuscript.pdf] [--repeat N]
+
+Without a path, a synthetic word table laid out like a 50-page preprint (60 lines of 12 words per page, with
+line numbers in the margin) is used.
+"""
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+import pdfplumber
+
+from paperview.retrieval.pdf_extraction import (
+    extract_page,
+    identify_line_numbers,
+    word_df_to_line_df,
+)
+
+
+def make_word_df(n_pages: int = 50, lines_per_page: int = 60, words_per_line: int = 12):
+    rng = np.random.default_rng(0)
+    page_height = 792.0
+    words = []
+    for page_number in range(1, n_pages + 1):
+        for line in range(lines_per_page):
+            top = 40.0 + 12 * line
+            # margin line number, then the words of the line in shuffled order
+            xs = [30.0] + list(rng.permutation(np.arange(words_per_line)) * 40 + 70.0)
+            for x0 in xs:
+                text = str(line + 1) if x0 == 30.0 else f'w{int(x0)}'
+                words.append(
+                    {
+                        'text': text,
+                        'x0': x0,
+                        'x1': x0 + 30,
+                        'top': top,
+                        'bottom': top + 10,
+                        'doctop': top + page_height * (page_number - 1),
+                        'upright': True,
+                        'direction': 1,
+                        'page_number': page_number,
+                        'page_height': page_height,
+                        'top_abs': top + page_height * (page_number - 1),
+                        'bottom_abs': top + 10 + page_height * (page_number - 1),
+                    }
+                )
+    return identify_line_numbers(pd.DataFrame(words))
+
+
+def load_word_df(pdf_path: str):
+    with pdfplumber.open(pdf_path) as pdf:
+        words = [
+            word
+            for page in pdf.pages
+            for word in extract_page(
+                page, extract_images=False, extract_text=False, extract_tables=False
+            )['words']
+        ]
+    return identify_line_numbers(pd.DataFrame(words))
+
+
+def previous_word_df_to_line_df(word_df: pd.DataFrame) -> pd.DataFrame:
+    line_df = (
+        word_df[~word_df['is_line_number']]
+        .groupby(['top_abs', 'bottom_abs'], group_keys=True)
+        .apply(lambda x: x.sort_values('x0'))
+        .reset_index(drop=True)
+        .groupby(['top_abs', 'bottom_abs'], group_keys=True)
+        .apply(lambda x: ' '.join(x['text']))
+        .rename('text')
+        .reset_index()
+        .reset_index()
+        .rename(columns={'index': 'line_number'})
+        .merge(
+            word_df[
+                [
+                    'top_abs',
+                    'bottom_abs',
+                    'top',
+                    'bottom',
+                    'upright',
+                    'direction',
+                    'page_height',
+                    'doctop',
+                    'page_number',
+                ]
+            ],
+            on=['top_abs', 'bottom_abs'],
+            how='left',
+        )
+        .drop_duplicates()
+        .reset_index(drop=True)
+    )
+    line_df['num_words'] = line_df['text'].str.split().str.len()
+    line_df['line_number_by_page'] = (
+        line_df.groupby('page_number')['line_number'].rank(method='first').astype(int)
+    )
+    line_df['dist_to_next_line'] = (line_df['top_abs'].shift(-1) - line_df['bottom_abs']).round(2)
+    line_df['is_biorxiv_watermark_line'] = (line_df['line_number_by_page'] < 4) & (
+        line_df['top'] < 50
+    )
+    return line_df
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', default=None)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    word_df = load_word_df(args.path) if args.path else make_word_df()
+    print(f'words: {len(word_df)}, pages: {word_df["page_number"].nunique()}')
+
+    pd.testing.assert_frame_equal(
+        previous_word_df_to_line_df(word_df), word_df_to_line_df(word_df), check_dtype=False
+    )
+
+    results = {}
+    for name, func in [
+        ('previous', previous_word_df_to_line_df),
+        ('vectorized', word_df_to_line_df),
+    ]:
+        best = min(timeit.repeat(lambda: func(word_df), number=1, repeat=args.repeat))
+        results[name] = best
+        print(f'{name:>12}: {best * 1e3:8.1f} ms')
+    print(f'{"speedup":>12}: {results["previous"] / results["vectorized"]:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark of JATS XML parsing in process_xml.extract_all.
+
+Compares the previous pipeline, which cleaned up and parsed the document twice (once for the
+section parser and once more for the figure slug lookup), with the single-parse pipeline.
+
+Usage:
+    python benchmarks/bench_process_xml.py [path/to/source.xml] [--repeat N]
+
+Without a path, a synthetic bioRxiv-style document with 300 sections and 12 figures is used.
+"""
+import argparse
+import timeit
+
+from lxml import etree
+
+from paperview.retrieval import process_xml
+
+
+def make_jats_xml(n_sections: int = 300, n_figures: int = 12) -> str:
+    sections = ''.join(
+        f'<sec id="s{ii}"><title>Result {ii}</title>'
+        + ''.join(f'<p>Paragraph {jj} of <italic>result</italic> {ii}.</p>' for jj in range(10))
+        + '</sec>'
+        for ii in range(n_sections)
+    )
+    figures = ''.join(
+        f'<fig id="F{ii}"><object-id pub-id-type="other" hwp:sub-type="slug">F{ii}</object-id>'
+        f'<label>Figure {ii}.</label><caption><p>Caption {ii}.</p></caption></fig>'
+        for ii in range(1, n_figures + 1)
+    )
+    return (
+        '<article xmlns:hwp="http://schema.highwire.org/Journal" article-type="article">'
+        '<front><article-meta><title-group><article-title>Benchmark</article-title></title-group>'
+        '<abstract><p>Abstract.</p></abstract></article-meta></front>'
+        f'<body><sec><title>Results</title>{sections}{figures}</sec></body></article>'
+    )
+
+
+def previous_parse(xmlstr: str):
+    # xmlstr_to_dict: clean up + parse, then parse_PMC_XML_core cleaned up the string again
+    xmlstr_clean = process_xml.cleanup_input_xml(xmlstr)
+    root = etree.fromstring(xmlstr_clean)
+    process_xml.cleanup_input_xml(xmlstr_clean)
+    process_xml.parse_PMC_XML_core(xmlstr_clean, root, None)
+    # extract_all: parsed the raw string once more for the figure slug lookup
+    return etree.fromstring(xmlstr)
+
+
+def single_parse(xmlstr: str):
+    root = process_xml.xmlstr_to_root(xmlstr)
+    process_xml.parse_PMC_XML_core(xmlstr, root, None)
+    return root
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', default=None)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.path:
+        xmlstr = process_xml.get_file_content(args.path)
+    else:
+        xmlstr = make_jats_xml()
+    print(f'document size: {len(xmlstr) / 1e6:.2f} MB, repeat: {args.repeat}')
+
+    results = {}
+    for name, func in [
+        ('previous (two parses)', previous_parse),
+        ('single parse', single_parse),
+        ('extract_all', process_xml.extract_all),
+    ]:
+        best = min(timeit.repeat(lambda: func(xmlstr), number=1, repeat=args.repeat))
+        results[name] = best
+        print(f'{name:>24}: {best * 1e3:8.1f} ms')
+    speedup = results['previous (two parses)'] / results['single parse']
+    print(f'{"speedup":>24}: {speedup:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
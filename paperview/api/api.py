@@ -1,23 +1,141 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
 from pathlib import Path
+from typing import AsyncIterator
 
 import fastapi
 import fastapi.staticfiles
-import modal
-from fastapi.responses import HTMLResponse
+import requests
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from pydantic import BaseModel
 from pyparsing import html_comment
-
-from paperview.modal_image import image
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from paperview.api.inflight_jobs import InflightJobs
+from paperview.api.job_backends import LocalJobBackend
+from paperview.api.overview_jobs import (
+    ARTICLE_STORE_DIR,
+    INFLIGHT_JOBS_DIR,
+    JOB_BACKEND_ENV_VAR,
+    MODAL_VOLUME_DIR,
+    get_job_backend,
+    get_latest_article_detail,
+    has_modal,
+    stored_image_url,
+)
+from paperview.retrieval.article_store import ArticleStore
 from paperview.retrieval.biorxiv_api import (
+    OVERVIEW_FOOTER_HTML,
     ArticleDetail,
     get_content_detail_by_doi,
     get_content_detail_for_page,
+    iter_image_html,
+    overview_header_html,
 )
+from paperview.retrieval.version_index import article_key
 
 web_app = fastapi.FastAPI()
-stub = modal.Stub("paperview_api", image=image)
 
-get_overview = modal.lookup("paperview_overview_jobs", "get_overview")
+logger = logging.getLogger(__name__)
+
+# a stored figure never changes: a new version of an article gets a new URL
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# how long an event stream waits on a job before sending a progress event, which also keeps the
+# connection open through proxies
+EVENT_WAIT_SECONDS = 15
+# how long /overview_result waits on a job before falling back to the page that polls its status
+RESULT_WAIT_SECONDS = 20
+# interval between checks on a job that is being waited on
+JOB_POLL_SECONDS = 0.5
+# how long a streamed overview waits for its article to be processed before giving up on the figures
+STREAM_WAIT_SECONDS = 300
+
+
+# The calls to the job backend block (on Modal's client, or on a local future), so the handlers below
+# never make them on the event loop: one slow job would otherwise stall every other request served by
+# this worker. Nor do they wait on a job in the threadpool, see `wait_for_job_result`.
+
+
+async def get_job_result(call_id: str, timeout: float):
+    """
+    Wait (in the threadpool) up to `timeout` seconds for the result of a job
+
+    Raises:
+      TimeoutError: if the job is not done within `timeout` seconds
+    """
+    return await run_in_threadpool(get_job_backend().get, call_id, timeout=timeout)
+
+
+async def wait_for_job_result(call_id: str, timeout: float):
+    """
+    Wait up to `timeout` seconds for the result of a job, checking on it every `JOB_POLL_SECONDS`
+
+    Only the checks run in the threadpool, without waiting on the job, so waiting requests (e.g. open
+    event streams) don't hold threads: the threadpool is shared with every sync route and would
+    otherwise run out once a few dozen clients wait.
+
+    Raises:
+      TimeoutError: if the job is not done within `timeout` seconds
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await get_job_result(call_id, timeout=0)
+        except TimeoutError:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise
+            await asyncio.sleep(min(JOB_POLL_SECONDS, remaining))
+
+
+@functools.lru_cache(maxsize=None)
+def get_inflight_jobs() -> InflightJobs:
+    return InflightJobs(INFLIGHT_JOBS_DIR)
+
+
+def job_is_alive(call_id: str) -> bool:
+    """Whether a job is worth attaching to: it is running or has succeeded"""
+    return get_job_backend().status(call_id) != 'failed'
+
+
+def start_job(name: str, article_detail: ArticleDetail) -> str:
+    """
+    Spawn job `name` for an article, unless one is already running for the same server, DOI and
+    version, in which case the request attaches to it
+
+    Returns:
+      The call id of the job
+    """
+    return get_inflight_jobs().get_or_spawn(
+        (name,) + article_key(article_detail),
+        spawn=lambda: get_job_backend().spawn(name, doi=article_detail.doi),
+        is_alive=job_is_alive,
+    )
+
+
+async def resolve_article_detail(doi: str = None, url: str = None) -> ArticleDetail:
+    """
+    The latest version of the article with `doi`, or of the article page at `url`, from the index of
+    latest versions (so this rarely hits the network)
+
+    Raises:
+      fastapi.HTTPException: 404 if there is no such article, 502 if the lookup failed
+    """
+    try:
+        return await run_in_threadpool(get_latest_article_detail, doi=doi, page=url)
+    except requests.RequestException as e:
+        logger.warning(f"Failed to get the metadata of {doi or url}: {e}")
+        if e.response is not None and e.response.status_code == 404:
+            raise fastapi.HTTPException(status_code=404, detail="Article not found")
+        raise fastapi.HTTPException(status_code=502, detail="Failed to get the article")
+    except (ValueError, KeyError, AttributeError) as e:
+        # no posts for the DOI, or no DOI on the page
+        logger.info(f"No article found for {doi or url}: {e}")
+        raise fastapi.HTTPException(status_code=404, detail="Article not found")
 
 
 # @web_app.get("/metadata/", response_model=ArticleDetail)
@@ -111,7 +229,52 @@ def get_loading_screen(call_object_id):
     <html>
         <head>
             <title>Overview Result</title>
-            <meta http-equiv="refresh" content="1;URL='/overview_result/{call_object_id}'" />
+            <noscript>
+                <meta http-equiv="refresh" content="2;URL='/overview_result/{call_object_id}'" />
+            </noscript>
+            <script>
+                // the server pushes a 'done' event when the overview is ready, polling the status
+                // is only a fallback for browsers (or proxies) without server-sent events
+                var resultUrl = '/overview_result/{call_object_id}';
+
+                function pollStatus() {{
+                    var xhr = new XMLHttpRequest();
+                    xhr.onreadystatechange = function() {{
+                        if (this.readyState != 4) {{
+                            return;
+                        }}
+                        if (this.status != 200) {{
+                            // e.g. a restarting server: keep trying, more slowly
+                            setTimeout(pollStatus, 5000);
+                        }} else if (JSON.parse(this.responseText).status == 'pending') {{
+                            setTimeout(pollStatus, 2000);
+                        }} else {{
+                            // completed, or failed: the result page shows the error
+                            window.location.href = resultUrl;
+                        }}
+                    }};
+                    xhr.open("GET", '/overview_result_status/{call_object_id}', true);
+                    xhr.send();
+                }}
+
+                if (window.EventSource) {{
+                    var source = new EventSource('/overview_events/{call_object_id}');
+                    source.addEventListener('done', function(event) {{
+                        source.close();
+                        window.location.href = JSON.parse(event.data).url;
+                    }});
+                    source.addEventListener('failed', function(event) {{
+                        source.close();
+                        window.location.href = resultUrl;
+                    }});
+                    source.onerror = function() {{
+                        source.close();
+                        pollStatus();
+                    }};
+                }} else {{
+                    setTimeout(pollStatus, 2000);
+                }}
+            </script>
             <style>
                 .loader {{
                     border: 16px solid #f3f3f3; /* Light grey */
@@ -163,56 +326,142 @@ async def form_start_overview(request: fastapi.Request):
     form = await request.form()
     doi = form.get("doi")
     url = form.get("url")
-    if doi:
-        call = get_overview.spawn(doi=doi)
-    elif url:
-        call = get_overview.spawn(page=url)
-    else:
+    if not doi and not url:
         return fastapi.responses.JSONResponse(content="", status_code=400)
 
+    article_detail = await resolve_article_detail(doi=doi, url=url)
+    # identical requests (e.g. a trending article) share one job, instead of each processing it
+    call_id = await run_in_threadpool(start_job, "get_overview", article_detail)
+
     # Redirect user to results when the job is complete
-    html_content = get_loading_screen(call.object_id)
+    html_content = get_loading_screen(call_id)
 
     return HTMLResponse(content=html_content, status_code=200)
 
 
-# this is lazy, should refactor
-@web_app.get("/request-overview/", response_class=HTMLResponse)
-async def request_overview(doi: str = None, url: str = None):
+async def iter_streamed_overview(article_detail: ArticleDetail) -> AsyncIterator[str]:
+    """
+    Generate the overview page of an article piece by piece: the title, authors and abstract right
+    away, then the figures once the article has been processed (right away if it was processed
+    before). Figures are referenced by URL, so each block is small.
+
+    Identical requests share one job processing the article, which is waited on without holding a
+    thread (see `wait_for_job_result`). Reading the store runs in the threadpool.
+    """
+    yield overview_header_html(article_detail)
 
-    if doi:
-        call = get_overview.spawn(doi=doi)
-    elif url:
-        call = get_overview.spawn(page=url)
+    article_store = ArticleStore(ARTICLE_STORE_DIR)
+
+    def load_images():
+        stored_article = article_store.load(article_detail.doi, article_detail.version)
+        if stored_article is None or not stored_article.has_thumbnails():
+            return None
+        return stored_article.data['images']
+
+    try:
+        images = await run_in_threadpool(load_images)
+        if images is None:
+            call_id = await run_in_threadpool(start_job, "retrieve_article", article_detail)
+            await wait_for_job_result(call_id, timeout=STREAM_WAIT_SECONDS)
+            images = await run_in_threadpool(load_images)
+            if images is None:
+                raise RuntimeError("The processed article is not in the store")
+    except TimeoutError:
+        # the response has already started, so errors can only be reported in the page
+        yield "<p>The figures of this article are still being processed, reload the page later.</p>"
+    except Exception as e:
+        logger.exception(f"Failed to retrieve the figures of {article_detail.doi}: {e}")
+        yield "<p>The figures of this article could not be retrieved.</p>"
     else:
+        image_url = stored_image_url(article_detail)
+        async for output in iterate_in_threadpool(iter_image_html(images, image_url=image_url)):
+            yield output['html']
+    yield OVERVIEW_FOOTER_HTML
+
+
+@web_app.get("/request-overview/", response_class=StreamingResponse)
+async def request_overview(doi: str = None, url: str = None):
+    if not doi and not url:
         return fastapi.responses.JSONResponse(content="", status_code=400)
 
-    # Redirect user to results when the job is complete
-    html_content = get_loading_screen(call.object_id)
+    # resolved before the response starts, so that a bad DOI or URL, or a failing API, gets an error
+    # status instead of an aborted page
+    article_detail = await resolve_article_detail(doi=doi, url=url)
 
-    return HTMLResponse(content=html_content, status_code=200)
+    return StreamingResponse(iter_streamed_overview(article_detail), media_type="text/html")
 
 
 @web_app.get("/overview_result_status/{call_id}")
 async def overview_result_status(call_id: str):
-    from modal.functions import FunctionCall
-
-    function_call = FunctionCall.from_id(call_id)
     try:
-        function_call.get(timeout=0)
+        await get_job_result(call_id, timeout=0)
         status = 'completed'
     except TimeoutError:
         status = 'pending'
+    except Exception as e:
+        logger.info(f"Overview job {call_id} failed: {e}")
+        status = 'failed'
 
     return {"status": status}
 
 
+def get_failed_job_page() -> str:
+    return f"""
+    <html>
+        <head>
+            <title>Overview Result</title>
+        </head>
+        <body>
+            <p>Sorry, the overview of this article could not be generated.</p>
+            <p><a href="/">Try again</a></p>
+        </body>
+    </html>
+    """
+
+
+def server_sent_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@web_app.get("/overview_events/{call_id}")
+async def overview_events(call_id: str, request: fastapi.Request):
+    """
+    Server-sent events for an overview job: 'progress' events while it runs, then a single 'done'
+    (or 'failed') event carrying the URL of the result. One connection replaces a status request per
+    second.
+    """
+
+    async def events():
+        start = time.monotonic()
+        while not await request.is_disconnected():
+            try:
+                # a bounded wait on the event loop, which keeps serving other requests meanwhile
+                await wait_for_job_result(call_id, timeout=EVENT_WAIT_SECONDS)
+            except TimeoutError:
+                elapsed = round(time.monotonic() - start)
+                yield server_sent_event('progress', {'status': 'pending', 'elapsed': elapsed})
+                continue
+            except Exception as e:
+                logger.exception(f"Overview job {call_id} failed: {e}")
+                yield server_sent_event('failed', {'status': 'failed'})
+                return
+            url = f'/overview_result/{call_id}'
+            yield server_sent_event('done', {'status': 'completed', 'url': url})
+            return
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
 @web_app.get("/overview_result/{call_id}", response_class=HTMLResponse)
 async def poll_results(call_id: str):
-    from modal.functions import FunctionCall
-
-    function_call = FunctionCall.from_id(call_id)
-    result = function_call.get()
+    try:
+        result = await wait_for_job_result(call_id, timeout=RESULT_WAIT_SECONDS)
+    except TimeoutError:
+        result = None
+    except Exception as e:
+        logger.exception(f"Overview job {call_id} failed: {e}")
+        return HTMLResponse(content=get_failed_job_page(), status_code=500)
     if result is None:
         # Return a page with a JavaScript function that periodically checks the status
         # of the get_overview call and redirects the user to the results URL when the
@@ -225,13 +474,16 @@ async def poll_results(call_id: str):
                     function checkStatus() {{
                         var xhr = new XMLHttpRequest();
                         xhr.onreadystatechange = function() {{
-                            if (this.readyState == 4 && this.status == 200) {{
-                                var response = JSON.parse(this.responseText);
-                                if (response.status == 'completed') {{
-                                    window.location.href = '/overview_result/{call_id}';
-                                }} else {{
-                                    setTimeout(checkStatus, 1000);
-                                }}
+                            if (this.readyState != 4) {{
+                                return;
+                            }}
+                            if (this.status != 200) {{
+                                setTimeout(checkStatus, 5000);
+                            }} else if (JSON.parse(this.responseText).status == 'pending') {{
+                                setTimeout(checkStatus, 1000);
+                            }} else {{
+                                // completed, or failed: reloading shows the result or the error
+                                window.location.href = '/overview_result/{call_id}';
                             }}
                         }};
                         xhr.open("GET", '/overview_result_status/{call_id}', true);
@@ -251,13 +503,51 @@ async def poll_results(call_id: str):
         return result
 
 
+# a plain def, so that reading the manifest from the shared volume happens in the threadpool
+@web_app.get("/images/{doi:path}/v{version}/{slug}")
+def get_image(request: fastapi.Request, doi: str, version: str, slug: str, width: int = None):
+    """Serve a figure of a stored article, or one of its thumbnails with `width`"""
+    stored_article = ArticleStore(ARTICLE_STORE_DIR).load(doi, version)
+    image_file = stored_article.get_image_file(slug, width) if stored_article else None
+    if image_file is None:
+        raise fastapi.HTTPException(status_code=404, detail="Image not found")
+
+    path, media_type = image_file
+    headers = {"Cache-Control": IMAGE_CACHE_CONTROL}
+    response = FileResponse(path, media_type=media_type, headers=headers, stat_result=os.stat(path))
+    if request.headers.get("if-none-match") == response.headers["etag"]:
+        headers["ETag"] = response.headers["etag"]
+        return fastapi.Response(status_code=304, headers=headers)
+    return response
+
+
 # assets_path = Path(__file__).parent / "assets"
 
 
-@stub.asgi()
-def fastapi_app():
-    return web_app
+if has_modal:
+    import modal
+
+    from paperview.api.overview_jobs import volume
+    from paperview.modal_image import image
+
+    stub = modal.Stub("paperview_api", image=image)
+
+    @stub.asgi(shared_volumes={MODAL_VOLUME_DIR: volume})
+    def fastapi_app():
+        return web_app
 
 
 if __name__ == "__main__":
-    stub.serve()
+    if isinstance(get_job_backend(), LocalJobBackend):
+        # PAPERVIEW_JOB_BACKEND=local: serve the app and run its jobs on this machine, e.g. to
+        # benchmark it
+        import uvicorn
+
+        uvicorn.run(web_app, host="0.0.0.0", port=8000)
+    elif has_modal:
+        stub.serve()
+    else:
+        raise SystemExit(
+            "modal is not installed: install it to serve the app on Modal, or set "
+            f"{JOB_BACKEND_ENV_VAR}=local to serve it and run its jobs on this machine"
+        )
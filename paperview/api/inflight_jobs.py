@@ -0,0 +1,72 @@
+from typing import Callable, Hashable
+
+import diskcache as dc
+
+# a registered job is forgotten after this long even if nothing cleared it, e.g. the job's timeout
+DEFAULT_EXPIRE_SECONDS = 3000
+# longest time a replica may hold the lock of a key while it checks and spawns the job
+DEFAULT_LOCK_EXPIRE_SECONDS = 60
+
+
+class InflightJobs(object):
+    """Registry of the running job for each key, for single-flight deduplication of identical requests.
+
+    The registry is a diskcache on a shared directory (e.g. the shared volume), so API replicas see
+    each other's jobs: the first request for a key spawns the job, later ones attach to its call id.
+    Checking and spawning happen under a lock per key, so concurrent requests never spawn twice.
+
+    Args:
+        directory: directory of the registry, shared by all replicas.
+        expire: seconds after which a registered job is forgotten.
+        lock_expire: seconds after which the lock of a key is released, if its holder died.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        expire: float = DEFAULT_EXPIRE_SECONDS,
+        lock_expire: float = DEFAULT_LOCK_EXPIRE_SECONDS,
+    ):
+        self.cache = dc.Cache(directory)
+        self.expire = expire
+        self.lock_expire = lock_expire
+
+    def get_or_spawn(
+        self,
+        key: Hashable,
+        spawn: Callable[[], str],
+        is_alive: Callable[[str], bool] = lambda call_id: True,
+    ) -> str:
+        """
+        Return the call id of the job registered for `key`, spawning and registering one if there is
+        none
+
+        Args:
+          key (Hashable): identifies identical requests, e.g. (normalized DOI, version)
+          spawn (Callable[[], str]): starts the job and returns its call id
+          is_alive (Callable[[str], bool]): whether a registered call is still worth attaching to,
+            i.e. it is running or has succeeded. A failed job is replaced by a new one
+
+        Returns:
+          The call id of the job
+        """
+        with dc.Lock(self.cache, ('lock', key), expire=self.lock_expire):
+            call_id = self.cache.get(('job', key))
+            if call_id is not None and is_alive(call_id):
+                return call_id
+            call_id = spawn()
+            self.cache.set(('job', key), call_id, expire=self.expire)
+            return call_id
+
+    def get(self, key: Hashable):
+        """Return the call id registered for `key`, or None"""
+        return self.cache.get(('job', key))
+
+    def close(self):
+        self.cache.close()
+
+    def __enter__(self) -> 'InflightJobs':
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
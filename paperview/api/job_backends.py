@@ -0,0 +1,149 @@
+import concurrent.futures
+import threading
+import uuid
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List
+
+# Where the overview jobs run, behind one interface, so that the web app doesn't depend on Modal:
+#   ModalJobBackend  functions of a deployed Modal app, as in production
+#   LocalJobBackend  plain functions in a local process pool, to run (and benchmark) everything on
+#                    one machine
+
+
+class JobBackend(object):
+    """Runs named jobs in the background, identifying each run by a job id.
+
+    `get` raises the builtin `TimeoutError` when a job is not done in time, and re-raises the exception
+    of a failed job.
+    """
+
+    def spawn(self, name: str, **kwargs) -> str:
+        """Start job `name` with `kwargs`, returning its job id without waiting for it"""
+        raise NotImplementedError
+
+    def get(self, job_id: str, timeout: float = None) -> Any:
+        """
+        Wait for a job and return its result
+
+        Args:
+          job_id (str): id returned by `spawn`
+          timeout (float): seconds to wait, None to wait until the job is done
+
+        Raises:
+          TimeoutError: if the job is not done within `timeout` seconds
+          KeyError: if there is no job with this id
+        """
+        raise NotImplementedError
+
+    def call(self, name: str, **kwargs) -> Any:
+        """Run job `name` with `kwargs` and wait for its result"""
+        return self.get(self.spawn(name, **kwargs))
+
+    def status(self, job_id: str) -> str:
+        """'pending', 'completed' or 'failed'"""
+        try:
+            self.get(job_id, timeout=0)
+        except TimeoutError:
+            return 'pending'
+        except Exception:
+            return 'failed'
+        return 'completed'
+
+
+class ModalJobBackend(JobBackend):
+    """Jobs are the functions of a deployed Modal app, and job ids are Modal call ids.
+
+    Args:
+        app_name: name of the deployed app, e.g. "paperview_overview_jobs".
+    """
+
+    def __init__(self, app_name: str):
+        self.app_name = app_name
+        self.functions = {}
+
+    def lookup(self, name: str):
+        """The Modal function of job `name`, looked up on first use"""
+        if name not in self.functions:
+            import modal
+
+            self.functions[name] = modal.lookup(self.app_name, name)
+        return self.functions[name]
+
+    def spawn(self, name: str, **kwargs) -> str:
+        return self.lookup(name).spawn(**kwargs).object_id
+
+    def get(self, job_id: str, timeout: float = None) -> Any:
+        from modal.functions import FunctionCall
+
+        return FunctionCall.from_id(job_id).get(timeout=timeout)
+
+    def call(self, name: str, **kwargs) -> Any:
+        return self.lookup(name).call(**kwargs)
+
+    def get_call_graph(self, job_id: str) -> List:
+        """The inputs of a call, with their status, as Modal reports them"""
+        from modal.functions import FunctionCall
+
+        return FunctionCall.from_id(job_id).get_call_graph()
+
+    def status(self, job_id: str) -> str:
+        # from the status of the inputs of the call, rather than `get`, which would transfer the result
+        statuses = {input_info.status.name for input_info in self.get_call_graph(job_id)}
+        if statuses & {'FAILURE', 'TIMEOUT'}:
+            return 'failed'
+        if statuses and statuses <= {'SUCCESS'}:
+            return 'completed'
+        return 'pending'
+
+
+class LocalJobBackend(JobBackend):
+    """Jobs are plain functions run by a `concurrent.futures` executor in this process.
+
+    Job ids are only known to this process, and finished jobs keep their result until
+    `max_finished_jobs` newer jobs have finished.
+
+    Args:
+        functions: the functions to run, by job name. With a process pool they must be picklable, i.e.
+            defined at the top level of a module.
+        executor: the executor to run them in. Defaults to a process pool of `max_workers` processes.
+        max_workers: number of worker processes of the default executor, None for one per CPU.
+        max_finished_jobs: number of finished jobs to keep the results of.
+    """
+
+    def __init__(
+        self,
+        functions: Dict[str, Callable],
+        executor: Executor = None,
+        max_workers: int = None,
+        max_finished_jobs: int = 1000,
+    ):
+        self.functions = functions
+        self.executor = executor or ProcessPoolExecutor(max_workers=max_workers)
+        self.max_finished_jobs = max_finished_jobs
+        self.futures: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def spawn(self, name: str, **kwargs) -> str:
+        future = self.executor.submit(self.functions[name], **kwargs)
+        job_id = f'local-{uuid.uuid4().hex}'
+        with self.lock:
+            self.forget_finished_jobs()
+            self.futures[job_id] = future
+        return job_id
+
+    def forget_finished_jobs(self):
+        finished = [job_id for job_id, future in self.futures.items() if future.done()]
+        for job_id in finished[: max(0, len(finished) - self.max_finished_jobs)]:
+            del self.futures[job_id]  # the oldest first, since dicts keep insertion order
+
+    def get(self, job_id: str, timeout: float = None) -> Any:
+        with self.lock:
+            future = self.futures[job_id]
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # a different class than the builtin before Python 3.11
+            raise TimeoutError(f"Job {job_id} is not done after {timeout} seconds") from None
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
@@ -1,45 +1,172 @@
+import functools
+import os
+import urllib.parse
+from typing import Callable, Dict, Optional, Tuple
+
 import diskcache as dc
-import modal
 
-from paperview.modal_image import image
-from paperview.retrieval.biorxiv_api import Article, get_doi_from_page
+from paperview.api.job_backends import JobBackend, LocalJobBackend, ModalJobBackend
+from paperview.retrieval import pdf_extraction
+from paperview.retrieval.article_store import ArticleStore, StoredArticle
+from paperview.retrieval.artifact_cache import ArtifactCache
+from paperview.retrieval.biorxiv_api import (
+    Article,
+    ArticleDetail,
+    get_doi_from_page,
+    image_slug,
+)
+from paperview.retrieval.version_index import LatestVersionIndex, article_key
 
-stub = modal.Stub("paperview_overview_jobs")
+try:
+    import modal
 
-volume = modal.SharedVolume().persist("cached_paperview_vol")
+    has_modal = True
+except ImportError:
+    has_modal = False
 
+APP_NAME = "paperview_overview_jobs"
+# 'modal' or 'local', see get_job_backend
+JOB_BACKEND_ENV_VAR = "PAPERVIEW_JOB_BACKEND"
 
-@stub.function(
-    image=image, retries=3, timeout=3000, shared_volumes={"/root/cached_paperview_vol": volume}
-)
-def retrieve_article(doi: str = None, page: str = None):
-    if page:
-        doi = get_doi_from_page(page)
+MODAL_VOLUME_DIR = "/root/cached_paperview_vol"
+# the shared volume on Modal, any directory when the jobs run locally
+VOLUME_DIR = os.environ.get("PAPERVIEW_VOLUME_DIR", MODAL_VOLUME_DIR)
 
-    # Check if the article is already in the cache
-    article_cache = dc.Cache("/root/cached_paperview_vol/cached_articles")
-    cached_article = article_cache.get(doi)
-    if cached_article is not None:
-        return cached_article
-    else:
-        article = Article.from_doi(doi)
-        article_cache[doi] = article
-        return article
+# raw downloads (XML, PDFs, figures), so that reprocessing an article doesn't hit the network
+ARTIFACT_CACHE_DIR = f"{VOLUME_DIR}/cached_artifacts"
+# processed articles, one directory per DOI and version
+ARTICLE_STORE_DIR = f"{VOLUME_DIR}/stored_articles"
+# call ids of the running overview jobs, by DOI and version, shared by the API replicas
+INFLIGHT_JOBS_DIR = f"{VOLUME_DIR}/inflight_jobs"
+# latest version of each DOI, see LatestVersionIndex
+LATEST_VERSIONS_DIR = f"{VOLUME_DIR}/latest_versions"
+# overview HTML, by (server, DOI, version)
+OVERVIEW_CACHE_DIR = f"{VOLUME_DIR}/cached_overviews"
 
+# figures and their thumbnails are served by the web app from the article store, see api.py
+IMAGE_URL = "/images/{doi}/v{version}/{slug}"
 
-@stub.function(
-    image=image, retries=3, timeout=3000, shared_volumes={"/root/cached_paperview_vol": volume}
-)
-def get_overview(doi: str = None, page: str = None):
+
+def stored_image_url(article_detail: ArticleDetail) -> Callable[[Dict, Optional[int]], str]:
+    """Make the `image_url` of an overview whose figures are served from the article store"""
+
+    def image_url(image: Dict, width: int = None) -> str:
+        url = IMAGE_URL.format(
+            doi=urllib.parse.quote(article_detail.doi, safe='/'),
+            version=article_detail.version,
+            slug=urllib.parse.quote(image_slug(image)),
+        )
+        return url if width is None else f"{url}?width={width}"
+
+    return image_url
+
+
+@functools.lru_cache(maxsize=None)
+def _open_caches(pid: int) -> Tuple[ArtifactCache, LatestVersionIndex, dc.Cache]:
+    return (
+        ArtifactCache(ARTIFACT_CACHE_DIR),
+        LatestVersionIndex(LATEST_VERSIONS_DIR),
+        dc.Cache(OVERVIEW_CACHE_DIR),
+    )
+
+
+def get_caches() -> Tuple[ArtifactCache, LatestVersionIndex, dc.Cache]:
+    """
+    The artifact cache, the index of latest versions and the overview cache, opened once per process
+    and shared by its requests and jobs
+
+    Keyed by process id, so the workers of a local process pool don't reuse the database connections
+    of the process they were forked from.
+
+    Returns:
+      Tuple[ArtifactCache, LatestVersionIndex, dc.Cache]
+    """
+    return _open_caches(os.getpid())
+
+
+def get_latest_article_detail(doi: str = None, page: str = None) -> ArticleDetail:
+    """The metadata of the latest version of an article, from the index of latest versions unless it
+    is due for a refresh"""
     if page:
         doi = get_doi_from_page(page)
+    artifact_cache, index, _ = get_caches()
+    return index.get_latest(doi, cache=artifact_cache)
 
-    overview_cache = dc.Cache("/root/cached_paperview_vol/cached_overviews")
-    cached_overview_html = overview_cache.get(doi)
+
+def load_or_process_article(article_detail: ArticleDetail) -> StoredArticle:
+    """Open the stored article for a version of an article, processing and storing it if needed"""
+    artifact_cache, _, _ = get_caches()
+    article_store = ArticleStore(ARTICLE_STORE_DIR)
+
+    stored_article = article_store.load(article_detail.doi, article_detail.version)
+    if stored_article is None:
+        # figures of a PDF are rendered while the article is saved, then the PDF is removed
+        # logos and other decorative fragments of a PDF are left out of the overview
+        with Article(
+            article_detail, cache=artifact_cache, min_image_area=pdf_extraction.MIN_FIGURE_AREA
+        ) as article:
+            stored_article = article_store.save(article)
+    if not stored_article.has_thumbnails():
+        stored_article.save_thumbnails()
+    return stored_article
+
+
+def process_article(doi: str = None, page: str = None) -> StoredArticle:
+    # parts of the stored article are read from the shared volume on first access
+    return load_or_process_article(get_latest_article_detail(doi=doi, page=page))
+
+
+def make_overview(doi: str = None, page: str = None) -> str:
+    # keyed by version, so a DOI and the page URL of an article share an entry, and a new version
+    # gets a new one instead of replacing the overview of the previous version
+    article_detail = get_latest_article_detail(doi=doi, page=page)
+    key = article_key(article_detail)
+
+    _, _, overview_cache = get_caches()
+    cached_overview_html = overview_cache.get(key)
     if cached_overview_html is not None:
         return cached_overview_html
     else:
-        article = Article.from_doi(doi)
-        overview = article.get_overview(save_images_to_tempfiles=False)
-        overview_cache[doi] = overview.html
+        article = load_or_process_article(article_detail)
+        # figures are referenced by URL, so the cached HTML stays small and browsers cache the images
+        overview = article.get_overview(image_url=stored_image_url(article.article_detail))
+        overview_cache[key] = overview.html
         return overview.html
+
+
+# the jobs that the web app can run, by name
+JOBS = {"retrieve_article": process_article, "get_overview": make_overview}
+
+
+@functools.lru_cache(maxsize=None)
+def get_job_backend() -> JobBackend:
+    """
+    The backend running the jobs of the web app: the functions of the deployed Modal app below, or,
+    with PAPERVIEW_JOB_BACKEND=local (the default when modal is not installed), a local process pool
+
+    Returns:
+      JobBackend
+    """
+    backend = os.environ.get(JOB_BACKEND_ENV_VAR, "modal" if has_modal else "local")
+    if backend == "modal":
+        return ModalJobBackend(APP_NAME)
+    if backend == "local":
+        return LocalJobBackend(JOBS)
+    raise ValueError(f"Unknown job backend '{backend}', expected 'modal' or 'local'")
+
+
+if has_modal:
+    from paperview.modal_image import image
+
+    stub = modal.Stub(APP_NAME)
+    volume = modal.SharedVolume().persist("cached_paperview_vol")
+
+    # the Modal functions are named after the jobs, which is how ModalJobBackend looks them up
+
+    @stub.function(image=image, retries=3, timeout=3000, shared_volumes={MODAL_VOLUME_DIR: volume})
+    def retrieve_article(doi: str = None, page: str = None):
+        return process_article(doi=doi, page=page)
+
+    @stub.function(image=image, retries=3, timeout=3000, shared_volumes={MODAL_VOLUME_DIR: volume})
+    def get_overview(doi: str = None, page: str = None):
+        return make_overview(doi=doi, page=page)
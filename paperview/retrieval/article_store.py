@@ -0,0 +1,380 @@
+import json
+import logging
+import os
+import shutil
+import urllib.parse
+import uuid
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pdfplumber
+import pyarrow as pa
+
+from paperview.retrieval import pdf_extraction, thumbnails
+from paperview.retrieval.biorxiv_api import (
+    Article,
+    ArticleDetail,
+    OverviewHtml,
+    image_slug,
+)
+from paperview.retrieval.encoded_image import EncodedImage
+
+SCHEMA_VERSION = 2  # bump when the layout below changes, older articles are then reprocessed
+MANIFEST_FILE_NAME = 'manifest.json'
+
+logger = logging.getLogger(__name__)
+
+# Layout of a saved article, one directory per article version:
+#   manifest.json        schema version, article detail, and how each part of `Article.data` is stored
+#   <part>.parquet       DataFrames, with the columns Arrow can't encode in <part>.columns.pkl
+#   <part>.json          other JSON-serializable values, e.g. the text extracted from a PDF
+#   images/<n>.<ext>     the encoded figures, with their other fields in the manifest
+#   images/<n>-<w>.<ext> thumbnails of the figures, <w> pixels wide, once `save_thumbnails` was called
+# The raw XML is not kept, it is in the artifact cache.
+
+
+def save_article(article: Article, path: str) -> str:
+    """
+    Save a processed article to a directory, replacing it if it exists
+
+    The article is written to a temporary directory next to `path` which is then renamed, so readers
+    never see a partly written article. A previous copy is renamed aside before and deleted after the
+    new one is in place. If another process saved the same article first, its copy is kept.
+
+    Args:
+      article (Article): the processed article
+      path (str): directory to save the article to
+
+    Returns:
+      The path of the saved article
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    temp_path = os.path.join(parent, f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+    old_path = os.path.join(parent, f'.{os.path.basename(path)}.{uuid.uuid4().hex}.old')
+    os.makedirs(temp_path)
+    try:
+        parts = {}
+        images = []
+        for key, value in article.data.items():
+            if key == 'images':
+                images = write_images(temp_path, value)
+                parts[key] = {'type': 'images'}
+            elif isinstance(value, pd.DataFrame):
+                parts[key] = write_table(temp_path, key, value)
+            else:
+                try:
+                    parts[key] = write_json(temp_path, key, value)
+                except TypeError:
+                    logger.warning(f"Not saving '{key}' of {article.article_detail.doi}")
+
+        manifest = {
+            'schema_version': SCHEMA_VERSION,
+            'article_detail': article.article_detail.dict(),
+            'full_xml_retrieved': bool(article.full_xml_retrieved),
+            'parts': parts,
+            'images': images,
+        }
+        with open(os.path.join(temp_path, MANIFEST_FILE_NAME), 'w') as f:
+            json.dump(manifest, f)
+
+        # the previous copy is moved aside rather than deleted, and only deleted once the new one is
+        # in place
+        try:
+            os.rename(path, old_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            if not os.path.exists(os.path.join(path, MANIFEST_FILE_NAME)):
+                raise
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+
+def write_table(directory: str, name: str, df: pd.DataFrame) -> dict:
+    """
+    Write a DataFrame as Parquet, except for the columns Arrow can't encode faithfully (e.g. the lists of
+    dicts in all_text), which are pickled next to it
+
+    Returns:
+      The entry of the table in the manifest
+    """
+    pickled_columns = [column for column in df.columns if not is_arrow_column(df[column])]
+    part = {'type': 'table', 'format': 'parquet', 'columns': list(df.columns)}
+    if len(pickled_columns) < len(df.columns):
+        df.drop(columns=pickled_columns).to_parquet(os.path.join(directory, f'{name}.parquet'))
+        part['path'] = f'{name}.parquet'
+    if pickled_columns:
+        df[pickled_columns].to_pickle(os.path.join(directory, f'{name}.columns.pkl'))
+        part['pickled_columns'] = {'columns': pickled_columns, 'path': f'{name}.columns.pkl'}
+    return part
+
+
+def is_arrow_column(column: pd.Series) -> bool:
+    """Whether a column round-trips through Parquet. Object columns must hold scalars of a single type:
+    Arrow would turn lists into arrays and dicts into structs, and rejects mixed types"""
+    if column.dtype == object:
+        types = {
+            type(value)
+            for value in column
+            if value is not None and not (isinstance(value, float) and np.isnan(value))
+        }
+        if len(types) > 1 or not types <= {str, bytes, bool, int, float}:
+            return False
+    try:
+        pa.array(column, from_pandas=True)
+    except (pa.ArrowException, TypeError, ValueError):
+        return False
+    return True
+
+
+def read_table(directory: str, part: dict) -> pd.DataFrame:
+    tables = []
+    if 'path' in part:
+        tables.append(pd.read_parquet(os.path.join(directory, part['path'])))
+    if 'pickled_columns' in part:
+        tables.append(pd.read_pickle(os.path.join(directory, part['pickled_columns']['path'])))
+    return pd.concat(tables, axis=1)[part['columns']]
+
+
+def write_json(directory: str, name: str, value: Any) -> dict:
+    with open(os.path.join(directory, f'{name}.json'), 'w') as f:
+        json.dump(value, f, default=to_json_value)
+    return {'type': 'json', 'path': f'{name}.json'}
+
+
+def to_json_value(value: Any) -> Any:
+    """`default` for json.dump, converting numpy scalars and arrays"""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def write_images(directory: str, images: List[Dict]) -> List[dict]:
+    """Write the images of an article, rendering the render handles that read from the same PDF under
+    a single open document"""
+    pdf_paths = {pdf_extraction.get_pdf_path(image['image']) for image in images} - {None}
+    if len(pdf_paths) != 1:
+        return [write_image(directory, ii, image) for ii, image in enumerate(images)]
+    with pdfplumber.open(pdf_paths.pop()) as pdf:
+        return [write_image(directory, ii, image, pdf=pdf) for ii, image in enumerate(images)]
+
+
+def write_image(directory: str, index: int, image: Dict, pdf: pdfplumber.PDF = None) -> dict:
+    """Write the encoded image of an image record, returning its entry in the manifest. A render handle
+    is rendered from `pdf` if it is given, and the PDF is opened by path otherwise"""
+    encoded_image = encode_image(image['image'], pdf=pdf)
+    extension = 'jpg' if encoded_image.format == 'JPEG' else encoded_image.format.lower()
+    path = f'images/{index}.{extension}'
+    os.makedirs(os.path.join(directory, 'images'), exist_ok=True)
+    with open(os.path.join(directory, path), 'wb') as f:
+        f.write(encoded_image.content)
+
+    fields, tables = {}, {}
+    for key, value in image.items():
+        if key == 'image':
+            continue
+        if isinstance(value, pd.DataFrame):
+            tables[key] = write_table(directory, f'images/{index}.{key}', value)
+            continue
+        try:
+            fields[key] = json.loads(json.dumps(value, default=to_json_value))
+        except (TypeError, ValueError):
+            pass  # e.g. the PDF stream of an image extracted by pdfplumber
+    return {
+        'path': path,
+        'media_type': encoded_image.media_type,
+        'fields': fields,
+        'tables': tables,
+    }
+
+
+def encode_image(image, pdf: pdfplumber.PDF = None) -> EncodedImage:
+    """Return an image as is if it is already encoded. Otherwise (pixels or a render handle, rendered
+    from `pdf` if it is open already) encode it as JPEG if it was decoded from a JPEG, PNG otherwise"""
+    if isinstance(image, EncodedImage):
+        return image
+    pil_image = pdf_extraction.render_image(image, pdf)
+    if pil_image.format == 'JPEG':
+        # re-use the quantization tables of the original, instead of compressing it further
+        return EncodedImage.from_pil(pil_image, format='JPEG', quality='keep')
+    return EncodedImage.from_pil(pil_image, format='PNG')
+
+
+class StoredArticle(object):
+    """Article saved with `save_article`, loading each part of its data on first access.
+
+    Only the manifest is read when the article is opened. `data` behaves like `Article.data`, but a table,
+    list or the images are only read from disk when the corresponding key is accessed, so e.g. generating
+    an overview doesn't read any of the text tables. Images are loaded as `EncodedImage`s, without decoding.
+
+    Raises:
+        ValueError: if the article was saved with a different schema version.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE_NAME)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('schema_version') != SCHEMA_VERSION:
+            raise ValueError(
+                f"Article at {path} has schema version {self.manifest.get('schema_version')}, "
+                f"expected {SCHEMA_VERSION}"
+            )
+        self.article_detail = ArticleDetail(**self.manifest['article_detail'])
+        self.full_xml_retrieved = self.manifest['full_xml_retrieved']
+        self.data = LazyArticleData(self)
+
+    def load_part(self, key: str) -> Any:
+        part = self.manifest['parts'][key]
+        if part['type'] == 'images':
+            return self.load_images()
+        if part['type'] == 'table':
+            return read_table(self.path, part)
+        with open(os.path.join(self.path, part['path'])) as f:
+            return json.load(f)
+
+    def load_images(self) -> List[Dict]:
+        images = []
+        for ii, entry in enumerate(self.manifest['images']):
+            image = dict(entry['fields'])
+            for key, part in entry['tables'].items():
+                image[key] = read_table(self.path, part)
+            image['image'] = EncodedImage(self.get_image_bytes(ii))
+            images.append(image)
+        return images
+
+    def get_image_bytes(self, index: int) -> bytes:
+        """Return the encoded bytes of an image, without decoding it"""
+        with open(os.path.join(self.path, self.manifest['images'][index]['path']), 'rb') as f:
+            return f.read()
+
+    def get_image_media_type(self, index: int) -> str:
+        return self.manifest['images'][index]['media_type']
+
+    def find_image(self, slug: str) -> Optional[int]:
+        """Return the index of the image with the given `image_slug`, or None"""
+        for ii, entry in enumerate(self.manifest['images']):
+            if image_slug(entry['fields']) == slug:
+                return ii
+        return None
+
+    def get_image_file(self, slug: str, width: int = None) -> Optional[tuple]:
+        """
+        Locate an image, or one of its thumbnails, on disk
+
+        Args:
+          slug (str): `image_slug` of the image
+          width (int): width of the thumbnail, or None for the image itself
+
+        Returns:
+          A (path, media type) tuple, or None if there is no such image or thumbnail
+        """
+        index = self.find_image(slug)
+        if index is None:
+            return None
+        entry = self.manifest['images'][index]
+        if width is not None:
+            entry = entry.get('thumbnails', {}).get(str(width))
+            if entry is None:
+                return None
+        return os.path.join(self.path, entry['path']), entry['media_type']
+
+    def has_thumbnails(self) -> bool:
+        return all('thumbnails' in entry for entry in self.manifest['images'])
+
+    def save_thumbnails(
+        self,
+        widths: Sequence[int] = thumbnails.DEFAULT_THUMBNAIL_WIDTHS,
+        format: str = thumbnails.DEFAULT_THUMBNAIL_FORMAT,
+        quality: int = thumbnails.DEFAULT_THUMBNAIL_QUALITY,
+        max_workers: int = 8,
+    ):
+        """Make the thumbnails of all images in parallel and save them next to the images"""
+        images = [image['image'] for image in self.data['images']]
+        all_thumbnails = thumbnails.make_all_thumbnails(
+            images, widths=widths, format=format, quality=quality, max_workers=max_workers
+        )
+        for index, image_thumbnails in enumerate(all_thumbnails):
+            entries = {}
+            for width, thumbnail in image_thumbnails.items():
+                extension = 'jpg' if thumbnail.format == 'JPEG' else thumbnail.format.lower()
+                path = f'images/{index}-{width}.{extension}'
+                with open(os.path.join(self.path, path), 'wb') as f:
+                    f.write(thumbnail.content)
+                entries[str(width)] = {'path': path, 'media_type': thumbnail.media_type}
+            self.manifest['images'][index]['thumbnails'] = entries
+        self.write_manifest()
+
+    def write_manifest(self):
+        # written next to the manifest then renamed, so readers always see a complete manifest
+        temp_path = os.path.join(self.path, f'.{MANIFEST_FILE_NAME}.{uuid.uuid4().hex}.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(temp_path, os.path.join(self.path, MANIFEST_FILE_NAME))
+
+    def get_overview(self, **kwargs) -> OverviewHtml:
+        return OverviewHtml.from_article(self, **kwargs)
+
+    def __repr__(self):
+        return f"StoredArticle(path='{self.path}', doi='{self.article_detail.doi}')"
+
+
+class LazyArticleData(Mapping):
+    """Read-only mapping over the parts of a stored article, each loaded (once) when accessed"""
+
+    def __init__(self, article: StoredArticle):
+        self.article = article
+        self.loaded = {}
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.loaded:
+            if key not in self.article.manifest['parts']:
+                raise KeyError(key)
+            self.loaded[key] = self.article.load_part(key)
+        return self.loaded[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.article.manifest['parts'])
+
+    def __len__(self) -> int:
+        return len(self.article.manifest['parts'])
+
+
+def load_article(path: str) -> Optional[StoredArticle]:
+    """Open a saved article, or return None if there is none at `path` or it has an older schema"""
+    try:
+        return StoredArticle(path)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.info(str(e))
+        return None
+
+
+class ArticleStore(object):
+    """Directory of saved articles, one subdirectory per DOI and version.
+
+    Args:
+        root: directory to keep the articles in.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path_for(self, doi: str, version: str) -> str:
+        return os.path.join(self.root, urllib.parse.quote(doi, safe=''), f'v{version}')
+
+    def save(self, article: Article) -> StoredArticle:
+        detail = article.article_detail
+        return StoredArticle(save_article(article, self.path_for(detail.doi, detail.version)))
+
+    def load(self, doi: str, version: str) -> Optional[StoredArticle]:
+        return load_article(self.path_for(doi, version))
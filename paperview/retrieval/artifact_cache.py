@@ -0,0 +1,260 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+import diskcache as dc
+
+from paperview.retrieval.http_client import HttpClient, get_default_client
+
+DEFAULT_SIZE_LIMIT = 2**32  # 4 GiB, least recently used artifacts are evicted beyond this
+CACHE_DIR_ENV_VAR = 'PAPERVIEW_CACHE_DIR'  # enables the default cache when set
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# kinds of artifacts
+METADATA = 'metadata'
+XML = 'xml'
+PDF = 'pdf'
+FIGURE = 'figure'
+
+# seconds a cached artifact is used without asking the server, None for never. Versioned XML, PDFs and
+# figures don't change, but the metadata of a DOI does when a new version is posted.
+DEFAULT_TTLS = {METADATA: 60 * 60, XML: None, PDF: None, FIGURE: None}
+
+
+class ArtifactCache(object):
+    """Content-addressed on-disk cache for downloaded artifacts (JATS XML, PDFs and figures).
+
+    The content of each artifact is stored once under its sha256 digest, and found through a reference
+    keyed by the kind of artifact, its URL and, where known, the DOI and version of the article. Both
+    live in a single `diskcache.Cache`, which can be shared by threads and processes (e.g. on a shared
+    volume), and which evicts the least recently used entries once it holds more than `size_limit` bytes.
+    A reference whose content has been evicted is a miss.
+
+    References also hold the `ETag` and `Last-Modified` validators of the response and the time it was
+    fetched. Once an artifact is older than the TTL of its kind it is stale, and `cached_get` revalidates
+    it with a conditional request instead of downloading it again.
+
+    Args:
+        directory: directory to keep the cache in.
+        size_limit: maximum size of the cache in bytes.
+        ttls: TTL in seconds per kind of artifact (None for never stale), overriding `DEFAULT_TTLS`.
+        **settings: further settings of the `diskcache.Cache`, e.g. `cull_limit`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        size_limit: int = DEFAULT_SIZE_LIMIT,
+        ttls: Dict[str, Optional[float]] = None,
+        **settings,
+    ):
+        self.directory = directory
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.cache = dc.Cache(
+            directory, size_limit=size_limit, eviction_policy='least-recently-used', **settings
+        )
+
+    @staticmethod
+    def reference_key(kind: str, url: str, doi: str = None, version: str = None) -> tuple:
+        return ('reference', kind, url, doi, None if version is None else str(version))
+
+    @staticmethod
+    def content_key(digest: str) -> tuple:
+        return ('content', digest)
+
+    def get_reference(
+        self, kind: str, url: str, doi: str = None, version: str = None
+    ) -> Optional[dict]:
+        """Return the digest, validators and fetch time of a cached artifact, or None"""
+        return self.cache.get(self.reference_key(kind, url, doi, version))
+
+    def set_reference(
+        self,
+        kind: str,
+        url: str,
+        digest: str,
+        doi: str = None,
+        version: str = None,
+        headers: Dict[str, str] = None,
+    ):
+        """Point an artifact at cached content, keeping the validators found in the response `headers`"""
+        headers = headers or {}
+        reference = {
+            'digest': digest,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }
+        self.cache.set(self.reference_key(kind, url, doi, version), reference)
+
+    def get_digest(
+        self, kind: str, url: str, doi: str = None, version: str = None
+    ) -> Optional[str]:
+        reference = self.get_reference(kind, url, doi, version)
+        return None if reference is None else reference['digest']
+
+    def is_fresh(self, kind: str, url: str, doi: str = None, version: str = None) -> bool:
+        """Whether an artifact is cached and younger than the TTL of its kind"""
+        reference = self.get_reference(kind, url, doi, version)
+        return reference is not None and self.reference_is_fresh(kind, reference)
+
+    def reference_is_fresh(self, kind: str, reference: dict) -> bool:
+        ttl = self.ttls.get(kind)
+        return ttl is None or time.time() - reference.get('fetched_at', 0) < ttl
+
+    def get_content(self, digest: str) -> Optional[bytes]:
+        return self.cache.get(self.content_key(digest))
+
+    def get(self, kind: str, url: str, doi: str = None, version: str = None) -> Optional[bytes]:
+        """Return the cached content of an artifact, fresh or not, or None if it isn't cached"""
+        digest = self.get_digest(kind, url, doi, version)
+        if digest is None:
+            return None
+        return self.get_content(digest)
+
+    def set(
+        self,
+        kind: str,
+        url: str,
+        content: bytes,
+        doi: str = None,
+        version: str = None,
+        headers: Dict[str, str] = None,
+    ) -> str:
+        """Cache the content of an artifact and return its digest"""
+        digest = hashlib.sha256(content).hexdigest()
+        # add is a no-op if another artifact (or process) already stored the same content
+        self.cache.add(self.content_key(digest), content)
+        self.set_reference(kind, url, digest, doi, version, headers)
+        return digest
+
+    def get_file(
+        self, kind: str, url: str, path: str, doi: str = None, version: str = None
+    ) -> bool:
+        """Copy the cached content of an artifact to `path`, without loading it in memory.
+
+        Returns:
+            True if the artifact was cached, False otherwise.
+        """
+        digest = self.get_digest(kind, url, doi, version)
+        if digest is None:
+            return False
+        f = self.cache.get(self.content_key(digest), read=True)
+        if f is None:
+            return False
+        with f, open(path, 'wb') as out:
+            shutil.copyfileobj(f, out, HASH_CHUNK_SIZE)
+        return True
+
+    def set_file(
+        self,
+        kind: str,
+        url: str,
+        path: str,
+        doi: str = None,
+        version: str = None,
+        headers: Dict[str, str] = None,
+    ) -> str:
+        """Cache the content of the file at `path` as an artifact and return its digest"""
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+            digest = sha256.hexdigest()
+            f.seek(0)
+            self.cache.add(self.content_key(digest), f, read=True)
+        self.set_reference(kind, url, digest, doi, version, headers)
+        return digest
+
+    def close(self):
+        self.cache.close()
+
+    def __enter__(self) -> 'ArtifactCache':
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def cached_get(
+    url: str,
+    kind: str,
+    doi: str = None,
+    version: str = None,
+    client: HttpClient = None,
+    cache: ArtifactCache = None,
+) -> bytes:
+    """
+    Return the content at `url`, from the artifact cache if it is there, downloading and caching it otherwise
+
+    A stale artifact is revalidated with `If-None-Match` / `If-Modified-Since`, and served from the cache
+    if the server answers 304 Not Modified.
+
+    Args:
+      url (str): URL of the artifact
+      kind (str): kind of artifact, e.g. `XML` or `FIGURE`
+      doi (str): DOI of the article the artifact belongs to, if known
+      version (str): version of the article the artifact belongs to, if known
+      client (HttpClient): client to send the request with. Defaults to the shared client
+      cache (ArtifactCache): cache to use. Defaults to the shared cache, if there is one
+
+    Returns:
+      The content of the response as bytes
+    """
+    cache = cache if cache is not None else get_default_cache()
+    reference, content = None, None
+    if cache is not None:
+        reference = cache.get_reference(kind, url, doi, version)
+        if reference is not None:
+            content = cache.get_content(reference['digest'])
+        if content is not None and cache.reference_is_fresh(kind, reference):
+            return content
+
+    client = client or get_default_client()
+    headers = conditional_headers(reference) if content is not None else {}
+    response = client.get(url, headers=headers) if headers else client.get(url)
+    if response.status_code == 304 and content is not None:
+        cache.set_reference(kind, url, reference['digest'], doi, version, response.headers)
+        return content
+
+    response.raise_for_status()  # error pages must not end up in the cache
+    if cache is not None:
+        cache.set(kind, url, response.content, doi, version, response.headers)
+    return response.content
+
+
+def conditional_headers(reference: dict) -> Dict[str, str]:
+    """Build the headers asking the server to only send an artifact if it changed"""
+    headers = {}
+    if reference.get('etag'):
+        headers['If-None-Match'] = reference['etag']
+    if reference.get('last_modified'):
+        headers['If-Modified-Since'] = reference['last_modified']
+    return headers
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[ArtifactCache]:
+    """Return the process-wide cache, or None if caching is not enabled.
+
+    The cache is enabled either by `set_default_cache`, or by pointing the `PAPERVIEW_CACHE_DIR`
+    environment variable at a directory.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None and os.environ.get(CACHE_DIR_ENV_VAR):
+            _default_cache = ArtifactCache(os.environ[CACHE_DIR_ENV_VAR])
+        return _default_cache
+
+
+def set_default_cache(cache: Optional[ArtifactCache]):
+    """Replace the process-wide cache, or disable it with None."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
@@ -1,25 +1,32 @@
-import base64
 import datetime
+import json
+import logging
 import os
 import re
 import tempfile
 import time
 import urllib
+import weakref
 import webbrowser
-from io import BytesIO
-from typing import Dict, List
-from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
 
 import requests
 from bs4 import BeautifulSoup
 from IPython.core.display import HTML
 from IPython.display import display
-from PIL import Image
 from pydantic import BaseModel, Field
 
-from paperview.retrieval import pdf_extraction, process_xml
+from paperview.retrieval import artifact_cache, pdf_extraction, process_xml
+from paperview.retrieval.artifact_cache import ArtifactCache, get_default_cache
+from paperview.retrieval.encoded_image import EncodedImage
+from paperview.retrieval.http_client import HttpClient, get_default_client
+from paperview.retrieval.thumbnails import DEFAULT_THUMBNAIL_WIDTHS, srcset_widths
 
 BASE_URL = "https://api.biorxiv.org"
+PAGE_SIZE = 100  # number of records returned per page by the details endpoint
+
+logger = logging.getLogger(__name__)
 
 
 class Message(BaseModel):
@@ -83,9 +90,12 @@ ArticleDetail(
 
     @classmethod
     def from_response(cls, response):
-        data = response.json()["collection"]
-        # assert len(data) == 1, f"Expected 1 item in response['collection'], got {len(data)}"
-        data = data[0]
+        return cls.from_json(response.json())
+
+    @classmethod
+    def from_json(cls, data: dict):
+        # the collection has an item per version of the article, oldest first
+        data = max(data["collection"], key=lambda item: int(item["version"]))
         return cls.from_collection_dict(data)
 
     @classmethod
@@ -93,14 +103,26 @@ ArticleDetail(
         collection_dict['authors'] = collection_dict['authors'].split('; ')
         return cls(**collection_dict)
 
-    def retrieve_jats_xml(self) -> str:
+    def retrieve_jats_xml(self, client: HttpClient = None, cache: ArtifactCache = None) -> str:
         """
         It takes an ArticleDetail object and returns the JATS XML for the article
 
+        Args:
+          client (HttpClient): client to send the request with. Defaults to the shared client
+          cache (ArtifactCache): cache to use. Defaults to the shared cache, if there is one
+
         Returns:
           A string of JATS XML
         """
-        return requests.get(self.jatsxml).text
+        content = artifact_cache.cached_get(
+            self.jatsxml,
+            artifact_cache.XML,
+            doi=self.doi,
+            version=self.version,
+            client=client,
+            cache=cache,
+        )
+        return content.decode('utf-8')
 
     @property
     def base_xml_url(self):
@@ -109,34 +131,116 @@ ArticleDetail(
     def get_image_url(self, slug: str):
         return f'{self.base_xml_url}/{slug}.large.jpg'
 
-    def get_image(self, slug: str):
-        url = self.get_image_url(slug)
-        with urlopen(url) as response:
-            with BytesIO(response.read()) as file:
-                img = Image.open(file)
-                img_data = img.tobytes()  # shenanigans to get it in memory while file is open
-                return Image.frombytes(img.mode, img.size, img_data)
+    def get_image(
+        self, slug: str, client: HttpClient = None, cache: ArtifactCache = None
+    ) -> EncodedImage:
+        """
+        Download a figure, keeping it as the JPEG it was served as
+
+        Returns:
+          An EncodedImage, whose pixels are only decoded if `decode` is called
+        """
+        content = artifact_cache.cached_get(
+            self.get_image_url(slug),
+            artifact_cache.FIGURE,
+            doi=self.doi,
+            version=self.version,
+            client=client,
+            cache=cache,
+        )
+        return EncodedImage(content)
+
+    def get_images(
+        self,
+        slugs: List[str],
+        client: HttpClient = None,
+        max_workers: int = 8,
+        cache: ArtifactCache = None,
+    ) -> List[Optional[EncodedImage]]:
+        """
+        Download several figures concurrently through a bounded thread pool
+
+        Args:
+          slugs (List[str]): figure slugs, e.g. ['F1', 'F2']
+          client (HttpClient): client to send the requests with. Defaults to the shared client
+          max_workers (int): maximum number of figures downloaded at once. Defaults to 8
+          cache (ArtifactCache): cache to use. Defaults to the shared cache, if there is one
+
+        Returns:
+          A list of images in the same order as `slugs`, with None for figures that failed
+        """
+        client = client or get_default_client()
+        cache = cache if cache is not None else get_default_cache()
+
+        def _get_image(slug):
+            try:
+                return self.get_image(slug, client=client, cache=cache)
+            except Exception as e:
+                logger.warning(f"Failed to retrieve figure {slug} for {self.doi}: {e}")
+                return None
+
+        if max_workers <= 1 or len(slugs) <= 1:
+            return [_get_image(slug) for slug in slugs]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(slugs))) as executor:
+            return list(executor.map(_get_image, slugs))
+
+
+DOI_PREFIXES = ("https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "doi.org/", "doi:")
+
+
+def normalize_doi(doi: str) -> str:
+    """
+    Canonical form of a DOI, so that the same article entered differently gets the same key:
+    surrounding whitespace and a resolver URL or "doi:" prefix are stripped, and it is lowercased
+    (DOIs are case-insensitive)
+
+    Args:
+        doi (str): a DOI, e.g. "10.1101/339747" or "https://doi.org/10.1101/339747"
+
+    Returns:
+        The normalized DOI, e.g. "10.1101/339747"
+    """
+    doi = doi.strip()
+    for prefix in DOI_PREFIXES:
+        if doi.lower().startswith(prefix):
+            doi = doi[len(prefix) :]
+            break
+    return doi.strip().lower()
 
 
 def _query_content_detail_by_doi(
     doi: str,
     server: str = "biorxiv",  # biorxiv or medRxiv
     format: str = "JSON",  # JSON or XML
+    client: HttpClient = None,
 ) -> requests.models.Response:
     """https://api.biorxiv.org/details/[server]/[DOI]/na/[format] returns detail for a single manuscript.
     For instance, https://api.biorxiv.org/details/biorxiv/10.1101/339747 will output metadata for the biorxiv paper with DOI 10.1101/339747."""
-    url = f"{BASE_URL}/details/{server}/{doi}/na/{format}"
-    response = requests.get(url)
+    client = client or get_default_client()
+    response = client.get(content_detail_by_doi_url(doi, server, format))
     return response
 
 
+def content_detail_by_doi_url(doi: str, server: str = "biorxiv", format: str = "JSON") -> str:
+    return f"{BASE_URL}/details/{server}/{doi}/na/{format}"
+
+
 def get_content_detail_by_doi(
     doi: str,
     server: str = "biorxiv",  # biorxiv or medRxiv
     format: str = "JSON",  # JSON or XML
+    client: HttpClient = None,
+    cache: ArtifactCache = None,
 ) -> ArticleDetail:
-    response = _query_content_detail_by_doi(doi, server, format)
-    return ArticleDetail.from_response(response)
+    # the metadata is cached with a short TTL, since it changes when a new version is posted
+    content = artifact_cache.cached_get(
+        content_detail_by_doi_url(doi, server, format),
+        artifact_cache.METADATA,
+        doi=doi,
+        client=client,
+        cache=cache,
+    )
+    return ArticleDetail.from_json(json.loads(content))
 
 
 def validate_interval(interval: str) -> bool:
@@ -178,6 +282,7 @@ def query_content_detail_by_interval(
     cursor: int = 0,
     server: str = "biorxiv",  # biorxiv or medRxiv
     format: str = "JSON",  # JSON or XML
+    client: HttpClient = None,
 ):
     """
     > This function returns a dictionary with two keys: `messages` and `collections`. The `messages` key
@@ -190,6 +295,7 @@ def query_content_detail_by_interval(
       cursor (int): The starting point for the query. Defaults to 0. Defaults to 0
       server (str): biorxiv or medRxiv. Defaults to biorxiv
       format (str): JSON or XML. Defaults to JSON
+      client (HttpClient): client to send the request with. Defaults to the shared client
 
     Returns:
       A dictionary with two keys: messages and collections.
@@ -201,8 +307,9 @@ def query_content_detail_by_interval(
     """
     if not validate_interval(interval):
         raise ValueError(f"Invalid interval: {interval}")
+    client = client or get_default_client()
     url = f"{BASE_URL}/details/{server}/{interval}/{cursor}/{format}"
-    response = requests.get(url)
+    response = client.get(url)
     # Parse the messages output
     messages = response.json()["messages"]
     parsed_messages = [Message(**message) for message in messages]
@@ -218,53 +325,157 @@ def query_content_detail_by_interval(
 
 
 def get_all_content_details_by_interval(
-    interval: str, server: str = "bioRxiv", format: str = "json"
+    interval: str,
+    server: str = "bioRxiv",
+    format: str = "json",
+    client: HttpClient = None,
+    max_workers: int = 1,
 ) -> List[ArticleDetail]:
     """
     It takes a date interval, and returns a list of all the articles in that interval
 
+    With `max_workers` > 1, the first page is fetched on its own to read `Message.total`, and the
+    remaining cursors are then fetched concurrently with at most `max_workers` requests in flight.
+    Pages are merged back in cursor order, so the result is the same as a sequential walk.
+
     Args:
         interval (str): The interval of time to query. This can be one of the following:
         server (str): The server to query. This can be either "bioRxiv" or "medRxiv". Defaults to bioRxiv
         format (str): The format of the response. Can be json or xml. Defaults to json
+        client (HttpClient): client to send the requests with. Defaults to the shared client
+        max_workers (int): maximum number of concurrent page requests. Defaults to 1 (sequential)
 
     Returns:
         A list of dictionaries.
     """
-    all_results = []
-    cursor = 0
-    while True:
-        results = query_content_detail_by_interval(
-            interval, cursor=cursor, server=server, format=format
+
+    def _query_page(cursor: int) -> dict:
+        return query_content_detail_by_interval(
+            interval, cursor=cursor, server=server, format=format, client=client
         )
-        collections = results["collections"]
+
+    results = _query_page(0)
+    all_results = list(results["collections"])
+    cursor = PAGE_SIZE
+
+    total = results["messages"][0].total if results["messages"] else None
+    if max_workers > 1 and total is not None and len(all_results) == PAGE_SIZE:
+        cursors = list(range(PAGE_SIZE, total, PAGE_SIZE))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # executor.map yields in submission order, i.e. cursor order
+            for page in executor.map(_query_page, cursors):
+                all_results.extend(page["collections"])
+        if not cursors or len(page["collections"]) < PAGE_SIZE:
+            return all_results
+        # the interval grew past the advertised total; finish the walk sequentially
+        cursor = cursors[-1] + PAGE_SIZE
+
+    collections = results["collections"]
+    while len(collections) == PAGE_SIZE:
+        collections = _query_page(cursor)["collections"]
         all_results.extend(collections)
-        if len(collections) < 100:
-            # There are no more pages of results
-            break
-        cursor += 100
+        cursor += PAGE_SIZE
     return all_results
 
 
-def query_article_by_doi(doi: str, server: str = "biorxiv", format: str = "JSON"):
+def iter_content_details_by_interval(
+    interval: str,
+    server: str = "bioRxiv",
+    format: str = "json",
+    client: HttpClient = None,
+    cursor: int = 0,
+    checkpoint_path: str = None,
+) -> Iterator[ArticleDetail]:
+    """
+    Yields the articles in a date interval page by page instead of building one big list
+
+    The next page is downloaded in the background while the current page is being consumed, so
+    only two pages are held in memory at a time. If `checkpoint_path` is given, the cursor of the
+    next page is saved there once a page has been fully consumed, and a later call with the same
+    interval and server resumes from it. The checkpoint is removed once the interval is exhausted.
+
+    Args:
+        interval (str): The interval of time to query.
+        server (str): The server to query. This can be either "bioRxiv" or "medRxiv". Defaults to bioRxiv
+        format (str): The format of the response. Can be json or xml. Defaults to json
+        client (HttpClient): client to send the requests with. Defaults to the shared client
+        cursor (int): The cursor to start from. Overridden by an existing checkpoint. Defaults to 0
+        checkpoint_path (str): Path of a JSON file used to save and resume the cursor. Optional
+
+    Yields:
+        ArticleDetail objects, in cursor order
+    """
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        cursor = load_cursor_checkpoint(checkpoint_path, interval, server)
+
+    def _query_page(cursor: int) -> list:
+        return query_content_detail_by_interval(
+            interval, cursor=cursor, server=server, format=format, client=client
+        )["collections"]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_page = executor.submit(_query_page, cursor)
+        while True:
+            collections = next_page.result()
+            if len(collections) == PAGE_SIZE:
+                # prefetch the following page while this one is consumed
+                next_page = executor.submit(_query_page, cursor + PAGE_SIZE)
+            yield from collections
+            if len(collections) < PAGE_SIZE:
+                # There are no more pages of results
+                break
+            cursor += PAGE_SIZE
+            if checkpoint_path is not None:
+                save_cursor_checkpoint(checkpoint_path, interval, server, cursor)
+
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def save_cursor_checkpoint(checkpoint_path: str, interval: str, server: str, cursor: int):
+    """Atomically writes the cursor of the next page to fetch for an interval harvest"""
+    temp_path = f"{checkpoint_path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"interval": interval, "server": server, "cursor": cursor}, f)
+    os.replace(temp_path, checkpoint_path)
+
+
+def load_cursor_checkpoint(checkpoint_path: str, interval: str, server: str) -> int:
+    """Reads a cursor saved by `save_cursor_checkpoint`, checking it belongs to the same harvest"""
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint["interval"] != interval or checkpoint["server"] != server:
+        raise ValueError(
+            f"Checkpoint {checkpoint_path} is for interval {checkpoint['interval']} on "
+            f"{checkpoint['server']}, not {interval} on {server}"
+        )
+    return checkpoint["cursor"]
+
+
+def query_article_by_doi(
+    doi: str, server: str = "biorxiv", format: str = "JSON", client: HttpClient = None
+):
     """https://api.biorxiv.org/pubs/[server]/[DOI]/na/[format] returns detail for a single manuscript.
     For instance, https://api.biorxiv.org/pubs/medrxiv/10.1101/2021.04.29.21256344 will output publication metadata for the biorxiv paper with DOI 10.1101/2021.04.29.21256344. Conversely, https://api.biorxiv.org/pubs/medrxiv/10.1371/journal.pone.0256482 will output publication metadata for the medRxiv paper with published DOI 10.1371/journal.pone.0256482.url = f"{BASE_URL}/details/{server}/{doi}/na/{format}"""
+    client = client or get_default_client()
     url = f"{BASE_URL}/pubs/{server}/{doi}/na/{format}"
-    response = requests.get(url)
+    response = client.get(url)
     return response
 
 
-def get_doi_from_page(url: str) -> str:
+def get_doi_from_page(url: str, client: HttpClient = None) -> str:
     """
     It takes a URL, finds the DOI, and then queries the API for the article details
 
     Args:
         url (str): The URL of the article you want to get the metadata for.
+        client (HttpClient): client to send the request with. Defaults to the shared client
 
     Returns:
         A DOI
     """
-    html = requests.get(url).text
+    client = client or get_default_client()
+    html = client.get(url).text
     soup = BeautifulSoup(html, 'html.parser')
 
     doi_element = soup.find(class_='highwire-cite-metadata-doi highwire-cite-metadata')
@@ -272,20 +483,40 @@ def get_doi_from_page(url: str) -> str:
     return doi_url.split("https://doi.org/")[-1].strip()
 
 
-def get_content_detail_for_page(url: str) -> ArticleDetail:
+def get_content_detail_for_page(
+    url: str, client: HttpClient = None, cache: ArtifactCache = None
+) -> ArticleDetail:
     """
     It takes a URL, finds the DOI, and then queries the API for the article details
 
     Args:
         url (str): The URL of the article you want to get the metadata for.
+        client (HttpClient): client to send the requests with. Defaults to the shared client
+        cache (ArtifactCache): cache for the metadata. Defaults to the shared cache, if there is one
 
     Returns:
         ArticleDetail
     """
-    return get_content_detail_by_doi(get_doi_from_page(url))
+    return get_content_detail_by_doi(
+        get_doi_from_page(url, client=client), client=client, cache=cache
+    )
 
 
 class Article(object):
+    """
+    A processed article: the text and figures of the full JATS XML, or of the PDF when the XML is only
+    the front matter.
+
+    Figures of a PDF are rendered lazily by default: `data['images']` holds render handles, and the PDF
+    is kept (in a temporary file) until the article is closed, which is when it is used as a context
+    manager, or when it is garbage collected. Images smaller than `min_image_area` square points (e.g.
+    `pdf_extraction.MIN_FIGURE_AREA`) are dropped without being rendered.
+    """
+
+    # the temporary PDF that lazily rendered figures are read from, removed on `close`
+    pdf = None
+    _pdf_finalizer = None
+
     def __init__(
         self,
         article_detail: ArticleDetail,
@@ -294,11 +525,18 @@ class Article(object):
         extract_words_from_pdf: bool = True,
         extract_tables_from_pdf: bool = None,
         resolution: int = 300,
+        client: HttpClient = None,
+        max_image_workers: int = 8,
+        cache: ArtifactCache = None,
+        render_images: bool = False,
+        min_image_area: float = 0,
         **kwargs,
     ):
         self.article_detail = article_detail
+        self.client = client or get_default_client()
+        self.cache = cache if cache is not None else get_default_cache()
 
-        self.xml = self.article_detail.retrieve_jats_xml()
+        self.xml = self.article_detail.retrieve_jats_xml(client=self.client, cache=self.cache)
         self.data = process_xml.extract_all(self.xml)
 
         self.full_xml_retrieved = (self.data['all_text']['title'] == 'Results').any()
@@ -306,24 +544,65 @@ class Article(object):
         if self.full_xml_retrieved:
             images = []
             for ii, row in self.data['figure_captions'].iterrows():
-                slug = f'F{ii + 1}'
                 image_data = row.to_dict()
-                image_data['slug'] = slug
-                image_data['image'] = self.article_detail.get_image(slug)
+                if not isinstance(image_data.get('slug'), str):
+                    # fall back to the usual bioRxiv naming if the slug was not found in the XML
+                    image_data['slug'] = f'F{ii + 1}'
+                image_data['image_number'] = ii + 1
                 images.append(image_data)
-            self.data['images'] = images
+
+            # figures are fetched concurrently; any that failed are dropped, order is preserved
+            pil_images = self.article_detail.get_images(
+                [image_data['slug'] for image_data in images],
+                client=self.client,
+                max_workers=max_image_workers,
+                cache=self.cache,
+            )
+            for image_data, pil_image in zip(images, pil_images):
+                image_data['image'] = pil_image
+            self.data['images'] = [
+                image_data for image_data in images if image_data['image'] is not None
+            ]
         else:
-            with pdf_extraction.NamedTemporaryPDF(self.article_detail.pdf_url) as f:
+            self.pdf = pdf_extraction.NamedTemporaryPDF(
+                self.article_detail.pdf_url,
+                client=self.client,
+                cache=self.cache,
+                doi=self.article_detail.doi,
+                version=self.article_detail.version,
+            )
+            pdf_path = self.pdf.__enter__()
+            self._pdf_finalizer = weakref.finalize(self, self.pdf.cleanup)
+            try:
                 _data = pdf_extraction.extract_all(
-                    f,
+                    pdf_path,
                     extract_images=extract_images,
                     extract_text=extract_text_from_pdf,
                     extract_words=extract_words_from_pdf,
                     extract_tables=extract_tables_from_pdf,
                     resolution=resolution,
+                    render_images=render_images,
+                    min_image_area=min_image_area,
                     **kwargs,
                 )
-                self.data.update(_data)
+            except BaseException:
+                self.close()
+                raise
+            self.data.update(_data)
+            if render_images or not _data['images']:
+                self.close()  # nothing left to read from the PDF
+
+    def close(self):
+        """Remove the temporary PDF. Figures that were not rendered can't be rendered afterwards"""
+        if self._pdf_finalizer is not None:
+            self._pdf_finalizer()
+        self.pdf = None
+
+    def __enter__(self) -> 'Article':
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
 
     def __repr__(self):
         return f"""
@@ -342,14 +621,23 @@ Article(
     server='{self.article_detail.server}')"""
 
     @classmethod
-    def from_doi(cls, doi: str, server: str = "biorxiv", **kwargs):
-        article_detail = get_content_detail_by_doi(doi, server=server)
-        return cls(article_detail, **kwargs)
+    def from_doi(
+        cls,
+        doi: str,
+        server: str = "biorxiv",
+        client: HttpClient = None,
+        cache: ArtifactCache = None,
+        **kwargs,
+    ):
+        article_detail = get_content_detail_by_doi(doi, server=server, client=client, cache=cache)
+        return cls(article_detail, client=client, cache=cache, **kwargs)
 
     @classmethod
-    def from_content_page_url(cls, url: str, **kwargs):
-        article_detail = get_content_detail_for_page(url)
-        return cls(article_detail, **kwargs)
+    def from_content_page_url(
+        cls, url: str, client: HttpClient = None, cache: ArtifactCache = None, **kwargs
+    ):
+        article_detail = get_content_detail_for_page(url, client=client, cache=cache)
+        return cls(article_detail, client=client, cache=cache, **kwargs)
 
     def display_html(self):
         display(HTML(self.html))
@@ -364,29 +652,44 @@ Article(
 
 
 class OverviewHtml:
+    """
+    HTML page with the metadata and figures of an article
+
+    By default the figures are embedded in the page (or saved to temporary files). If `image_url` is
+    given, figures are referenced by URL instead: `image_url(image, width)` gives the URL of the
+    thumbnail of `image` that is `width` pixels wide, or of the full figure for `width=None`. Each figure
+    is then a lazy-loading `<img>` with a `srcset` of the `thumbnail_widths` narrower than it, linking
+    to the full figure, so that it is only downloaded when clicked.
+
+    The page is assembled from `iter_overview_html`, which can also be used to stream it.
+    """
+
     def __init__(
-        self, images: list, article_detail: ArticleDetail, save_images_to_tempfiles: bool = True
+        self,
+        images: list,
+        article_detail: ArticleDetail,
+        save_images_to_tempfiles: bool = True,
+        image_url: Callable[[Dict, Optional[int]], str] = None,
+        thumbnail_widths: Sequence[int] = DEFAULT_THUMBNAIL_WIDTHS,
+        max_workers: int = 1,
     ):
         self.images = images
         self.article_detail = article_detail
         self.save_images_to_tempfiles = save_images_to_tempfiles
 
         # Generate the HTML that will display the images
-        html = '<html><body>'
-        html += generate_metadata_html(article_detail)
-
         temp_files = []
-        for image in images:
-            output = generate_image_html(image, save_images_to_tempfiles=save_images_to_tempfiles)
-            temp_file_name = output.get('temp_file_name')
-            if temp_file_name:
-                temp_files.append(temp_file_name)
-            html += output.get('html')
-        html += """
-            </body>
-        </html>
-        """
-        self.html = html
+        self.html = ''.join(
+            iter_overview_html(
+                images,
+                article_detail,
+                save_images_to_tempfiles=save_images_to_tempfiles,
+                image_url=image_url,
+                thumbnail_widths=thumbnail_widths,
+                max_workers=max_workers,
+                temp_files=temp_files,
+            )
+        )
         self.temp_files = temp_files
 
     @classmethod
@@ -417,23 +720,88 @@ def get_overview_html(
 ):
 
     # Generate the HTML that will display the images
-    html = '<html><body>'
-    html += generate_metadata_html(article_detail)
-
     temp_files = []
-    for image in images:
-        output = generate_image_html(image, save_images_to_tempfiles=save_images_to_tempfiles)
-        temp_file_name = output.get('temp_file_name')
-        if temp_file_name:
-            temp_files.append(temp_file_name)
-        html += output.get('html')
-    html += """
-        </body>
-    </html>
-    """
+    html = ''.join(
+        iter_overview_html(
+            images,
+            article_detail,
+            save_images_to_tempfiles=save_images_to_tempfiles,
+            temp_files=temp_files,
+        )
+    )
     return html, temp_files
 
 
+OVERVIEW_FOOTER_HTML = """
+    </body>
+</html>
+"""
+
+
+def overview_header_html(article_detail: ArticleDetail) -> str:
+    return '<html><body>' + generate_metadata_html(article_detail)
+
+
+def iter_overview_html(
+    images: list,
+    article_detail: ArticleDetail,
+    save_images_to_tempfiles: bool = True,
+    image_url: Callable[[Dict, Optional[int]], str] = None,
+    thumbnail_widths: Sequence[int] = DEFAULT_THUMBNAIL_WIDTHS,
+    max_workers: int = 1,
+    temp_files: list = None,
+) -> Iterator[str]:
+    """
+    Generate the overview page piece by piece: the metadata block first, then one block per figure as
+    soon as it is ready, then the end of the page. See `OverviewHtml` for the arguments
+
+    Args:
+      max_workers (int): number of figures encoded at once. Defaults to 1
+      temp_files (list): if given, the names of the temporary files images are saved to are appended to it
+
+    Yields:
+      Consecutive pieces of the HTML page
+    """
+    yield overview_header_html(article_detail)
+    for output in iter_image_html(
+        images,
+        save_images_to_tempfiles=save_images_to_tempfiles,
+        image_url=image_url,
+        thumbnail_widths=thumbnail_widths,
+        max_workers=max_workers,
+    ):
+        if temp_files is not None and output.get('temp_file_name'):
+            temp_files.append(output['temp_file_name'])
+        yield output['html']
+    yield OVERVIEW_FOOTER_HTML
+
+
+def iter_image_html(
+    images: list,
+    save_images_to_tempfiles: bool = True,
+    image_url: Callable[[Dict, Optional[int]], str] = None,
+    thumbnail_widths: Sequence[int] = DEFAULT_THUMBNAIL_WIDTHS,
+    max_workers: int = 1,
+) -> Iterator[dict]:
+    """Yield the output of `generate_image_html` for each image, in order. With `max_workers` > 1 the
+    images are encoded in a thread pool, and each is yielded as soon as it and the ones before it are done"""
+
+    def _generate_image_html(image):
+        return generate_image_html(
+            image,
+            save_images_to_tempfiles=save_images_to_tempfiles,
+            image_url=image_url,
+            thumbnail_widths=thumbnail_widths,
+        )
+
+    if max_workers <= 1 or len(images) <= 1:
+        for image in images:
+            yield _generate_image_html(image)
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(images))) as executor:
+        yield from executor.map(_generate_image_html, images)
+
+
 def generate_metadata_html(detail: ArticleDetail) -> str:
     """
     It takes an ArticleDetail object and returns a string of HTML
@@ -500,9 +868,10 @@ def image_html_template(
     temp_file_name: str = None,
     caption: str = None,
     image_number: int = None,
+    media_type: str = 'image/jpeg',
 ) -> str:
     if bytes_str:
-        src = f'data:image/jpeg;base64,{urllib.parse.quote(bytes_str)}'
+        src = f'data:{media_type};base64,{urllib.parse.quote(bytes_str)}'
     else:
         src = temp_file_name
     return f"""
@@ -520,7 +889,46 @@ def image_html_template(
     """
 
 
-def generate_image_html(image: Dict, save_images_to_tempfiles: bool) -> dict:
+def responsive_image_html_template(
+    width,
+    height,
+    src: str,
+    srcset: str,
+    full_src: str,
+    caption: str = None,
+    image_number: int = None,
+) -> str:
+    # an image narrower than all thumbnails has no srcset, its src is the full image
+    srcset = f'srcset="{srcset}" sizes="75vw" ' if srcset else ''
+    return f"""
+    <table>
+        <tr>
+            <td>
+                <p><font size="+2">Image {image_number}</font></p>
+                <a href="{full_src}" target="_blank">
+                    <img src="{src}" {srcset}width="{width}" height="{height}" loading="lazy" decoding="async" style="max-width: 75%; height: auto;"/>
+                </a><br>
+            </td>
+            <td>
+                <p>{caption}</p>
+            </td>
+        </tr>
+    </table>
+    """
+
+
+def image_slug(image: Dict) -> str:
+    """Identifies an image within its article: the figure slug from the XML, or its number in the PDF"""
+    slug = image.get('slug')
+    return slug if isinstance(slug, str) else f"image{image['image_number']}"
+
+
+def generate_image_html(
+    image: Dict,
+    save_images_to_tempfiles: bool,
+    image_url: Callable[[Dict, Optional[int]], str] = None,
+    thumbnail_widths: Sequence[int] = DEFAULT_THUMBNAIL_WIDTHS,
+) -> dict:
     """
     It takes an image dictionary and a boolean indicating whether to save the image to a file, and
     returns a dictionary containing the HTML string and the file name of the temporary file where
@@ -529,18 +937,49 @@ def generate_image_html(image: Dict, save_images_to_tempfiles: bool) -> dict:
     Args:
         image (Dict): Dict
         save_images_to_tempfiles (bool): A boolean indicating whether to save the image to a file.
+        image_url (Callable): if given, the image is referenced by URL instead, see `OverviewHtml`.
+        thumbnail_widths (Sequence[int]): widths of the thumbnails in the srcset, when `image_url` is given.
 
     Returns:
         A dictionary containing the HTML string and the file name of the temporary file.
     """
+    if image_url is not None:
+        # only the size is needed, which all image types know without decoding or rendering
+        width, height = image['image'].width, image['image'].height
+        full_src = image_url(image, None)
+        # thumbnails only: with the full image as a candidate, high-DPR screens would pick it. It is
+        # linked to instead
+        widths = srcset_widths(width, thumbnail_widths)
+        srcset = [
+            f'{image_url(image, thumbnail_width)} {thumbnail_width}w' for thumbnail_width in widths
+        ]
+        html = responsive_image_html_template(
+            width,
+            height,
+            src=image_url(image, widths[0]) if widths else full_src,
+            srcset=', '.join(srcset),
+            full_src=full_src,
+            caption=image.get('caption', ''),
+            image_number=image['image_number'],
+        )
+        return {'html': html, 'temp_file_name': None}
+
+    encoded_image = image['image']
+    if not isinstance(encoded_image, EncodedImage):
+        # images extracted from PDFs are pixels or render handles, rasterize and encode them now.
+        # Downloaded figures are already encoded and are embedded as is
+        encoded_image = EncodedImage.from_pil(
+            pdf_extraction.render_image(encoded_image), format='JPEG'
+        )
     # If the 'save_images' parameter is True, save the image to a temporary file
-    width = image['image'].width
-    height = image['image'].height
+    width = encoded_image.width
+    height = encoded_image.height
     caption = image.get('caption', '')
     image_number = image['image_number']
     if save_images_to_tempfiles:
-        with tempfile.NamedTemporaryFile(mode='wb', suffix='.jpg', delete=False) as f:
-            image['image'].save(f, format='JPEG')
+        suffix = '.' + encoded_image.format.lower()
+        with tempfile.NamedTemporaryFile(mode='wb', suffix=suffix, delete=False) as f:
+            f.write(encoded_image.content)
             # Flush the file to ensure that it is written to disk
             f.flush()
             # Use the temporary file's name as the 'src' attribute of an '<img>' element
@@ -550,12 +989,15 @@ def generate_image_html(image: Dict, save_images_to_tempfiles: bool) -> dict:
         )
     else:
         # Encode the image as a base64 string
-        buffered = BytesIO()
-        image['image'].save(buffered, format="JPEG")
-        bytes_str = base64.b64encode(buffered.getvalue())
+        bytes_str = encoded_image.to_base64()
         temp_file_name = None
         html = image_html_template(
-            width, height, bytes_str=bytes_str, caption=caption, image_number=image_number
+            width,
+            height,
+            bytes_str=bytes_str,
+            caption=caption,
+            image_number=image_number,
+            media_type=encoded_image.media_type,
         )
 
     return {'html': html, 'temp_file_name': temp_file_name}
@@ -0,0 +1,56 @@
+import base64
+from io import BytesIO
+
+from PIL import Image
+
+MEDIA_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif', 'WEBP': 'image/webp'}
+
+
+class EncodedImage(object):
+    """An image kept as the encoded bytes it was downloaded as, e.g. a figure JPEG from bioRxiv.
+
+    Only the header is parsed to get the size and format. The pixels are decoded when `decode` is called,
+    so images that are only passed on (stored, embedded in HTML, served) never go through a codec.
+
+    Args:
+        content: the encoded image.
+    """
+
+    def __init__(self, content: bytes):
+        self.content = content
+        with Image.open(BytesIO(content)) as image:  # lazy, reads the header only
+            self.format = image.format
+            self.width, self.height = image.size
+
+    @classmethod
+    def from_pil(cls, image: Image.Image, format: str = 'PNG', **kwargs) -> 'EncodedImage':
+        """Encode a PIL image, passing `kwargs` (e.g. `quality`) to `Image.save`"""
+        buffered = BytesIO()
+        image.save(buffered, format=format, **kwargs)
+        return cls(buffered.getvalue())
+
+    @property
+    def size(self) -> tuple:
+        return (self.width, self.height)
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES.get(self.format, 'application/octet-stream')
+
+    def decode(self) -> Image.Image:
+        """Decode the pixels"""
+        with BytesIO(self.content) as file:
+            image = Image.open(file)
+            image.load()  # decode while the buffer is open
+            return image
+
+    def to_base64(self) -> bytes:
+        return base64.b64encode(self.content)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, EncodedImage) and self.content == other.content
+
+    def __repr__(self):
+        return (
+            f"EncodedImage(format='{self.format}', size={self.size}, n_bytes={len(self.content)})"
+        )
@@ -0,0 +1,89 @@
+import threading
+from typing import Dict, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (5, 60)  # (connect, read) in seconds
+DEFAULT_POOL_CONNECTIONS = 10  # number of hosts to keep pools for
+DEFAULT_POOL_MAXSIZE = 10  # number of keep-alive connections per host
+DEFAULT_MAX_RETRIES = 3
+
+
+class HttpClient(object):
+    """Pooled, keep-alive HTTP client shared by the retrieval functions.
+
+    Wraps a `requests.Session` with an `HTTPAdapter` so that connections are pooled per host and
+    reused across calls instead of paying a fresh TCP+TLS handshake for every request. Every
+    request gets a default timeout unless one is passed explicitly.
+
+    Args:
+        timeout: default timeout for each request, either a float or a (connect, read) tuple.
+        pool_connections: number of per-host connection pools to cache.
+        pool_maxsize: maximum number of connections kept alive in each pool.
+        max_retries: number of retries for connection errors and 429/5xx responses on GET.
+        headers: extra headers sent with every request.
+        session: an existing `requests.Session` to use instead of creating a new one.
+    """
+
+    def __init__(
+        self,
+        timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+        pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        headers: Dict[str, str] = None,
+        session: requests.Session = None,
+    ):
+        self.timeout = timeout
+        self.session = session if session is not None else requests.Session()
+
+        retries = Retry(
+            total=max_retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retries
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Send a GET request through the pooled session, applying the default timeout."""
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self) -> 'HttpClient':
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> HttpClient:
+    """Return the process-wide client, creating it on first use."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
+
+
+def set_default_client(client: HttpClient):
+    """Replace the process-wide client, e.g. to change timeouts or pool sizes."""
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
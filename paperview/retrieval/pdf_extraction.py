@@ -1,44 +1,143 @@
+import math
+import mmap
 import os
 import re
 import tempfile
-from typing import Any, Dict, List, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import pdfplumber
-import requests
 from PIL import Image
 from tqdm import tqdm
 
+from paperview.retrieval.artifact_cache import PDF, ArtifactCache, get_default_cache
+from paperview.retrieval.encoded_image import EncodedImage
+from paperview.retrieval.http_client import HttpClient, get_default_client
+
+DEFAULT_DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # bytes written to disk per read from the socket
+# square PDF points (about 1 x 1 cm), smaller images are logos, bullets and other decorative fragments.
+# Pass it as `min_image_area` to leave those out
+MIN_FIGURE_AREA = 30 * 30
+
 
 class NamedTemporaryPDF(object):
-    """class that downloads pdf and makes it available as a named tempfile in a context manager"""
+    """class that downloads pdf and makes it available as a named tempfile in a context manager
 
-    def __init__(self, url: str):
+    The response body is streamed to the temporary file in chunks of `chunk_size` bytes, so the PDF is
+    never held in memory as a whole, and the file is closed before its name is handed out. With an artifact
+    cache, a PDF that was downloaded before is copied from the cache instead.
+
+    Args:
+        url: URL of the PDF.
+        client: HTTP client to download with. Defaults to the shared client.
+        chunk_size: number of bytes read from the response and written to disk at a time.
+        max_size: maximum size of the PDF in bytes. Larger downloads raise a ValueError. Defaults to no limit.
+        memory_map: if True, the context manager gives a read-only memory map of the file instead of its
+            name, which `pdfplumber.open` (and `extract_all`) accept like any other file object.
+        cache: artifact cache to use. Defaults to the shared cache, if there is one.
+        doi: DOI of the article, used in the cache key if given.
+        version: version of the article, used in the cache key if given.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        client: HttpClient = None,
+        chunk_size: int = DEFAULT_DOWNLOAD_CHUNK_SIZE,
+        max_size: int = None,
+        memory_map: bool = False,
+        cache: ArtifactCache = None,
+        doi: str = None,
+        version: str = None,
+    ):
         self.url = url
+        self.client = client or get_default_client()
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.memory_map = memory_map
+        self.cache = cache if cache is not None else get_default_cache()
+        self.doi = doi
+        self.version = version
         self.temp_file_name = None
-
-    def __enter__(self) -> str:
-        response = requests.get(self.url)
-        assert response.status_code == 200, f"Failed to download PDF from {self.url}"
-        f = tempfile.NamedTemporaryFile(mode='wb', delete=False)
-        f.write(response.content)
-        self.temp_file_name = f.name
+        self.mapped_file = None
+
+    def __enter__(self) -> Union[str, mmap.mmap]:
+        try:
+            self.retrieve()
+            if self.memory_map:
+                with open(self.temp_file_name, 'rb') as f:
+                    self.mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                return self.mapped_file
+        except BaseException:
+            self.cleanup()
+            raise
         return self.temp_file_name
 
-    def __exit__(self, type, value, traceback):
+    def retrieve(self):
+        with tempfile.NamedTemporaryFile(mode='wb', suffix='.pdf', delete=False) as f:
+            self.temp_file_name = f.name
+        cache_key = dict(kind=PDF, url=self.url, doi=self.doi, version=self.version)
+        if (
+            self.cache is not None
+            and self.cache.is_fresh(**cache_key)
+            and self.cache.get_file(path=self.temp_file_name, **cache_key)
+        ):
+            self.check_size(os.path.getsize(self.temp_file_name))
+            return
+        headers = self.download()
+        if self.cache is not None:
+            self.cache.set_file(path=self.temp_file_name, headers=headers, **cache_key)
+
+    def download(self) -> Dict[str, str]:
+        response = self.client.get(self.url, stream=True)
+        try:
+            assert response.status_code == 200, f"Failed to download PDF from {self.url}"
+            content_length = response.headers.get('Content-Length')
+            if content_length is not None:
+                self.check_size(int(content_length))
+            with open(self.temp_file_name, 'wb') as f:
+                n_bytes = 0
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    n_bytes += len(chunk)
+                    # Content-Length can be missing or wrong, so the running total is checked too
+                    self.check_size(n_bytes)
+                    f.write(chunk)
+            return response.headers
+        finally:
+            response.close()
+
+    def check_size(self, n_bytes: int):
+        if self.max_size is not None and n_bytes > self.max_size:
+            raise ValueError(
+                f"PDF at {self.url} is larger than the maximum size of {self.max_size} bytes"
+            )
+
+    def cleanup(self):
+        if self.mapped_file is not None:
+            self.mapped_file.close()
+            self.mapped_file = None
         if self.temp_file_name:
             os.remove(self.temp_file_name)
+            self.temp_file_name = None
+
+    def __exit__(self, type, value, traceback):
+        self.cleanup()
 
 
-# bad format for passing arguments to subfunctions, should refactor
 def extract_all(
-    pdf_path: str,
+    pdf_path: Union[str, BinaryIO],
     prog_bar: bool = False,
     extract_images: bool = True,
     extract_text: bool = True,
     extract_words: bool = True,
     extract_tables: bool = True,
     resolution: int = 300,
+    n_workers: int = 1,
+    render_images: bool = True,
+    min_image_area: float = 0,
 ) -> Dict:
     """
     Extract data from a PDF file and return a dictionary with the extracted data.
@@ -47,6 +146,16 @@ def extract_all(
     The `PDF` object has a `pages` attribute, which is a list of `Page` objects. Each `Page` object has a number
     of methods for extracting data from the page.
 
+    With `n_workers` > 1, contiguous ranges of pages are extracted in a process pool, each worker opening the
+    PDF by path, and the per-page results are merged back in page order. If `pdf_path` is an open file object
+    (e.g. the memory map given by `NamedTemporaryPDF(..., memory_map=True)`) everything runs in this process.
+
+    Images are not rasterized while pages are extracted: each image record holds a `DeferredImage` render handle,
+    spliced images hold a `SplicedImage`, and images smaller than `min_image_area` (in square PDF points, after
+    splicing) are dropped without ever being rendered. With `render_images=True` the remaining images are rendered
+    before returning; otherwise the handles are returned as is and `render_image` gives the pixels on demand, as
+    long as the PDF still exists at `pdf_path`.
+
     The returned dictionary will contain the following keys, depending on the input arguments:
         - 'images': a list of dictionaries, each of which contains the image data and bounding box coordinates
         - 'text': a list of strings, each of which is a line of text
@@ -55,54 +164,70 @@ def extract_all(
         - 'lines': a pandas DataFrame, each row of which is a line of text and its bounding box coordinates
 
     Args:
-        pdf_path: The path to the PDF file you want to extract from.
+        pdf_path: The path to the PDF file you want to extract from, or a binary file object holding it.
         prog_bar: Whether to show a progress bar. Defaults to False.
         extract_images: Whether to extract image data. Defaults to True.
         extract_text: Whether to extract text data. Defaults to True.
         extract_words: Whether to extract word data. Defaults to True.
         extract_tables: Whether to extract table data. Defaults to True.
+        n_workers: Number of worker processes to extract pages with. Defaults to 1 (no process pool).
+        render_images: Whether to rasterize the images before returning. Defaults to True.
+        min_image_area: Minimum area of an image, in square PDF points, to keep it, e.g.
+            `MIN_FIGURE_AREA`. Defaults to 0, which keeps all images.
 
     Returns:
         A dictionary with the keys 'images', 'text', 'words', 'tables', and 'lines'.
     """
-    pdf = pdfplumber.open(pdf_path)
+    page_kwargs = dict(
+        extract_images=extract_images,
+        extract_text=extract_text,
+        extract_words=extract_words,
+        extract_tables=extract_tables,
+        resolution=resolution,
+    )
     images = []
     texts = []
     words = []
     tables = []
     lines = []
-    if prog_bar:
-        iterator = tqdm(pdf.pages)
-    else:
-        iterator = pdf.pages
-
-    for page in iterator:
-        if extract_images:
-            for image in page.images:
-                image_bbox = (image['x0'], image['top'], image['x1'], image['bottom'])
-                image['image'] = page.crop(image_bbox).to_image(resolution=resolution).annotated
-                images.append(image)
-
-        if extract_text:
-            texts += page.extract_text()
-
-        if extract_words:
-            _words = page.extract_words()
-            for word in _words:
-                word['page_number'] = page.page_number
-                word['page_height'] = page.height
-                # add absolute coordinates for top and bottom from start of doc
-                word['top_abs'] = word['top'] + page.height * (page.page_number - 1)
-                word['bottom_abs'] = word['bottom'] + page.height * (page.page_number - 1)
-
-            words += _words
 
-        if extract_tables:
-            tables += page.extract_tables()
+    if not isinstance(pdf_path, (str, os.PathLike)):
+        # file objects can't be handed to other processes
+        n_workers = 1
+
+    with pdfplumber.open(pdf_path) as pdf:
+        if n_workers > 1:
+            # a couple of shards per worker so that a slow page range doesn't leave workers idle
+            shards = shard_page_numbers(len(pdf.pages), n_workers * 2)
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                iterator = executor.map(
+                    partial(extract_page_range, pdf_path, **page_kwargs), shards
+                )
+                if prog_bar:
+                    iterator = tqdm(iterator, total=len(shards))
+                # executor.map yields in submission order, i.e. page order
+                page_results = [page_result for shard in iterator for page_result in shard]
+        else:
+            iterator = tqdm(pdf.pages) if prog_bar else pdf.pages
+            page_results = [
+                extract_page(page, pdf_path=pdf_path, **page_kwargs) for page in iterator
+            ]
+
+        for page_result in page_results:
+            images += page_result['images']
+            texts += page_result['text']
+            words += page_result['words']
+            tables += page_result['tables']
 
-    if extract_images:
-        images = splice_images(images)
-        images = order_images(images)
+        if extract_images:
+            images = splice_images(images)
+            # decorative fragments (logos, watermark glyphs...) are dropped before anything is rendered
+            images = [
+                image for image in images if image['width'] * image['height'] >= min_image_area
+            ]
+            images = order_images(images)
+            if render_images:
+                render_all_images(images, pdf, pdf_path, n_workers=n_workers)
 
     if extract_words:
         words = pd.DataFrame(words)
@@ -115,106 +240,332 @@ def extract_all(
     return {'images': images, 'text': texts, 'words': words, 'tables': tables, 'lines': lines}
 
 
-def identify_images_to_vertically_splice(image_list: List[dict]) -> List[Tuple[dict, dict]]:
-    """Identifies images to vertically splice.
-    Candidate images will be on the same page, have the same width, and the top of one image will be the bottom of the other image. Works for N images"""
-    candidates = []
-    for i, image1 in enumerate(image_list):
-        for j, image2 in enumerate(image_list):
-            if i == j:
-                continue
-            if image1['page_number'] == image2['page_number']:
-                if abs(image1['width'] - image2['width']) < 1:
-                    if abs(image1['top'] - image2['bottom']) < 1:
-                        candidates.append((image2, image1))
-
-    return candidates
-
-
-def identify_images_to_horizontally_splice(image_list: List[Dict]) -> List[Tuple[Dict, Dict]]:
-    """Identifies images to horizontally splice. Candidate images will be on the same page, have the same height, and the left of one image will be the right of the other image. Works for N images"""
-    candidates: List[Tuple[Dict, Dict]] = []
-    for i, image1 in enumerate(image_list):
-        for j, image2 in enumerate(image_list):
-            if i == j:
-                continue
-            if image1['page_number'] == image2['page_number']:
-                if abs(image1['height'] - image2['height']) < 1:
-                    if abs(image1['x1'] - image2['x0']) < 1:
-                        candidates.append((image1, image2))
-    return candidates
-
-
-def vertically_splice_image_pair(top_image: Dict, bottom_image: Dict) -> Dict:
-    """Vertically splices two images. Returns a single dictionary for the new image"""
+def extract_page(
+    page: pdfplumber.page.Page,
+    pdf_path: str = None,
+    extract_images: bool = True,
+    extract_text: bool = True,
+    extract_words: bool = True,
+    extract_tables: bool = True,
+    resolution: int = 300,
+) -> Dict:
+    """Extract the images, text, words and tables of a single page.
+
+    If `pdf_path` is given, images get a `DeferredImage` render handle instead of being rasterized right away.
+
+    Returns:
+        A dictionary with the keys 'images', 'text', 'words' and 'tables', each holding a list.
+    """
+    images = []
+    texts = []
+    words = []
+    tables = []
+
+    if extract_images:
+        for image in page.images:
+            image_bbox = (image['x0'], image['top'], image['x1'], image['bottom'])
+            if pdf_path is None:
+                image['image'] = page.crop(image_bbox).to_image(resolution=resolution).annotated
+            else:
+                image['image'] = DeferredImage(pdf_path, page.page_number, image_bbox, resolution)
+            images.append(image)
+
+    if extract_text:
+        texts += page.extract_text()
+
+    if extract_words:
+        words = page.extract_words()
+        for word in words:
+            word['page_number'] = page.page_number
+            word['page_height'] = page.height
+            # add absolute coordinates for top and bottom from start of doc
+            word['top_abs'] = word['top'] + page.height * (page.page_number - 1)
+            word['bottom_abs'] = word['bottom'] + page.height * (page.page_number - 1)
+
+    if extract_tables:
+        tables += page.extract_tables()
+
+    return {'images': images, 'text': texts, 'words': words, 'tables': tables}
+
+
+def extract_page_range(pdf_path: str, page_numbers: List[int], **kwargs) -> List[Dict]:
+    """Open the PDF by path and extract the given (1-indexed) pages. This is the process pool worker."""
+    with pdfplumber.open(pdf_path) as pdf:
+        page_results = [
+            extract_page(pdf.pages[n - 1], pdf_path=pdf_path, **kwargs) for n in page_numbers
+        ]
+    for page_result in page_results:
+        for image in page_result['images']:
+            # the raw pdf stream is not used downstream and is not worth sending back to the parent
+            image.pop('stream', None)
+    return page_results
+
+
+class DeferredImage(object):
+    """Render handle for the region of a PDF page covered by an image.
+
+    Only the location of the image is stored, so handles are cheap to keep around and to send between
+    processes. The pixels are rasterized when `render` is called, which needs the PDF to still exist at
+    `pdf_path`. `width` and `height` are the expected size in pixels, computed without rendering.
+    """
+
+    def __init__(self, pdf_path: str, page_number: int, bbox: Tuple, resolution: int = 300):
+        self.pdf_path = pdf_path
+        self.page_number = page_number
+        self.bbox = tuple(bbox)
+        self.resolution = resolution
+
+    @property
+    def width(self) -> int:
+        return int(round((self.bbox[2] - self.bbox[0]) * self.resolution / 72))
+
+    @property
+    def height(self) -> int:
+        return int(round((self.bbox[3] - self.bbox[1]) * self.resolution / 72))
+
+    def render(self, pdf: pdfplumber.PDF = None) -> Image.Image:
+        """Rasterize the image, using `pdf` if it is already open"""
+        if pdf is None:
+            with pdfplumber.open(self.pdf_path) as pdf:
+                return self.render(pdf)
+        page = pdf.pages[self.page_number - 1]
+        return page.crop(self.bbox).to_image(resolution=self.resolution).annotated
+
+    def __repr__(self):
+        return (
+            f"DeferredImage(pdf_path='{self.pdf_path}', page_number={self.page_number}, "
+            f"bbox={self.bbox}, resolution={self.resolution})"
+        )
+
+
+class SplicedImage(object):
+    """Render handle for images spliced top to bottom ('vertical') or left to right ('horizontal').
+
+    The parts are composited when `render` is called. Parts can be PIL images or render handles.
+    """
+
+    def __init__(self, parts: List, direction: str):
+        assert direction in ('vertical', 'horizontal'), f"Unknown splice direction {direction}"
+        self.parts = parts
+        self.direction = direction
+
+    @property
+    def width(self) -> int:
+        if self.direction == 'vertical':
+            return self.parts[0].width
+        return sum(part.width for part in self.parts)
+
+    @property
+    def height(self) -> int:
+        if self.direction == 'vertical':
+            return sum(part.height for part in self.parts)
+        return self.parts[0].height
+
+    def render(self, pdf: pdfplumber.PDF = None) -> Image.Image:
+        return composite_images([render_image(part, pdf) for part in self.parts], self.direction)
+
+
+def render_image(image, pdf: pdfplumber.PDF = None) -> Image.Image:
+    """Return the pixels for the 'image' of an image record, rasterizing it if it is a render handle
+    and decoding it if it is an encoded image"""
+    if isinstance(image, (DeferredImage, SplicedImage)):
+        return image.render(pdf)
+    if isinstance(image, EncodedImage):
+        return image.decode()
+    return image
+
+
+def get_pdf_path(image) -> Optional[str]:
+    """The path of the PDF that a render handle reads from, None if the image is not read from a PDF"""
+    if isinstance(image, DeferredImage):
+        return image.pdf_path
+    if isinstance(image, SplicedImage):
+        pdf_paths = [get_pdf_path(part) for part in image.parts]
+        return next((pdf_path for pdf_path in pdf_paths if pdf_path is not None), None)
+    return None
+
+
+def render_image_handles(pdf_path: str, handles: List) -> List[Image.Image]:
+    """Open the PDF by path once and render the given handles. This is the process pool worker."""
+    with pdfplumber.open(pdf_path) as pdf:
+        return [render_image(handle, pdf) for handle in handles]
+
+
+def render_all_images(
+    images: List[Dict], pdf: pdfplumber.PDF, pdf_path: str, n_workers: int = 1
+) -> List[Dict]:
+    """Replace the render handles of a list of image records by their pixels, in place"""
+    if n_workers > 1 and len(images) > 1:
+        handles = [image['image'] for image in images]
+        shard_size = math.ceil(len(handles) / n_workers)
+        handle_shards = [
+            handles[start : start + shard_size] for start in range(0, len(handles), shard_size)
+        ]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            rendered = executor.map(partial(render_image_handles, pdf_path), handle_shards)
+            rendered = [pil_image for shard in rendered for pil_image in shard]
+    else:
+        rendered = [render_image(image['image'], pdf) for image in images]
+    for image, pil_image in zip(images, rendered):
+        image['image'] = pil_image
+    return images
+
+
+def shard_page_numbers(n_pages: int, n_shards: int) -> List[List[int]]:
+    """Split the (1-indexed) page numbers into at most `n_shards` contiguous ranges of similar size."""
+    n_shards = max(1, min(n_shards, n_pages))
+    shard_size, remainder = divmod(n_pages, n_shards)
+    shards = []
+    start = 1
+    for ii in range(n_shards):
+        end = start + shard_size + (1 if ii < remainder else 0)
+        shards.append(list(range(start, end)))
+        start = end
+    return [shard for shard in shards if shard]
+
+
+def splice_images(image_list: List) -> List:
+    """Identifies sets of images to vertically splice and then splices them, then does the same horizontally.
+
+    For cases where images are split into N pieces, adjacent pieces are linked into chains using an index of
+    image edges per page, and each chain is composited in a single pass. Candidate images are on the same
+    page, have the same width (height), and the top (left) of one is the bottom (right) of the other."""
+    vertical_chains = find_splice_chains(
+        image_list,
+        tail_edge='bottom',
+        head_edge='top',
+        size_key='width',
+        offset_key='x0',
+    )
+    new_image_list = [vertically_splice_images(chain) for chain in vertical_chains]
+
+    horizontal_chains = find_splice_chains(
+        new_image_list,
+        tail_edge='x1',
+        head_edge='x0',
+        size_key='height',
+        offset_key='top',
+    )
+    return [horizontally_splice_images(chain) for chain in horizontal_chains]
+
+
+def find_splice_chains(
+    image_list: List[Dict], tail_edge: str, head_edge: str, size_key: str, offset_key: str
+) -> List[List[Dict]]:
+    """Group images into chains of pieces to splice, in order (top to bottom or left to right).
+
+    Image B follows image A when they are on the same page, their `size_key` differs by less than 1, and B's
+    `head_edge` is within 1 of A's `tail_edge`. Images are bucketed by (page, edge) so that each lookup only
+    looks at the few images sharing an edge. When several images could follow, the one best aligned on
+    `offset_key` is used. Images that are not part of any chain come back as single-image chains, and so do
+    images that follow each other in a cycle (e.g. zero-height strips at the same position), which have no
+    first piece to splice from.
+    """
+    tail_index = {}
+    for ii, image in enumerate(image_list):
+        key = (image['page_number'], math.floor(image[tail_edge]))
+        tail_index.setdefault(key, []).append(ii)
+
+    next_image = {}
+    previous_image = {}
+    for jj, image in enumerate(image_list):
+        head_bucket = math.floor(image[head_edge])
+        candidates = [
+            ii
+            for bucket in (head_bucket - 1, head_bucket, head_bucket + 1)
+            for ii in tail_index.get((image['page_number'], bucket), [])
+            if ii != jj
+            and ii not in next_image
+            and abs(image_list[ii][tail_edge] - image[head_edge]) < 1
+            and abs(image_list[ii][size_key] - image[size_key]) < 1
+        ]
+        if candidates:
+            ii = min(candidates, key=lambda ii: abs(image_list[ii][offset_key] - image[offset_key]))
+            next_image[ii] = jj
+            previous_image[jj] = ii
+
+    # walk the chains from their first piece. Each image has at most one predecessor and successor, so the
+    # images that can't be reached from a first piece are exactly those in cycles
+    chain_of = {}
+    for head in range(len(image_list)):
+        if head in previous_image:
+            continue
+        ii = head
+        while ii is not None:
+            chain_of[ii] = head
+            ii = next_image.get(ii)
+
+    chains = []
+    for ii in range(len(image_list)):
+        if ii not in chain_of:
+            chains.append([image_list[ii]])
+        elif chain_of[ii] == ii:
+            chain = []
+            jj = ii
+            while jj is not None:
+                chain.append(image_list[jj])
+                jj = next_image.get(jj)
+            chains.append(chain)
+    return chains
+
+
+def vertically_splice_images(chain: List[Dict]) -> Dict:
+    """Vertically splices a top-to-bottom chain of images in one pass. Returns a single dictionary for the new image"""
+    if len(chain) == 1:
+        return chain[0]
+    top_image = chain[0]
+    bottom_image = chain[-1]
     new_image = top_image.copy()
     new_image['y0'] = bottom_image['y0']
     new_image['y1'] = top_image['y1']
-    new_image['height'] = new_image['height'] + new_image['height']
+    new_image['height'] = sum(image['height'] for image in chain)
     new_image['top'] = top_image['top']
     new_image['bottom'] = bottom_image['bottom']
     new_image['doctop'] = bottom_image['doctop']
 
-    # get height and width from images directly since the values in the dictionary are in a different coordinate frame
-    top_image_height = top_image['image'].height
-    top_image_width = top_image['image'].width
-    bottom_image_height = bottom_image['image'].height
-
-    # create new image and paste the images
-    new_image['image'] = Image.new('RGB', (top_image_width, top_image_height + bottom_image_height))
-    new_image['image'].paste(top_image['image'], (0, 0))
-    new_image['image'].paste(bottom_image['image'], (0, top_image_height))
-
+    new_image['image'] = splice_parts([image['image'] for image in chain], 'vertical')
     return new_image
 
 
-def horizontally_splice_image_pair(left_image: dict, right_image: dict) -> dict:
-    """Horizontally splices two images. Returns a single dictionary for the new image"""
+def horizontally_splice_images(chain: List[Dict]) -> Dict:
+    """Horizontally splices a left-to-right chain of images in one pass. Returns a single dictionary for the new image"""
+    if len(chain) == 1:
+        return chain[0]
+    left_image = chain[0]
+    right_image = chain[-1]
     new_image = left_image.copy()
     new_image['x0'] = left_image['x0']
     new_image['x1'] = right_image['x1']
-    new_image['width'] = left_image['width'] + right_image['width']
+    new_image['width'] = sum(image['width'] for image in chain)
 
-    # get height and width from images directly since the values in the dictionary are in a different coordinate frame
-    left_image_height = left_image['image'].height
-    left_image_width = left_image['image'].width
-    right_image_height = right_image['image'].height
-    right_image_width = right_image['image'].width
+    new_image['image'] = splice_parts([image['image'] for image in chain], 'horizontal')
+    return new_image
 
-    # create new image and paste the images
-    new_image['image'] = Image.new('RGB', (left_image_width + right_image_width, left_image_height))
-    new_image['image'].paste(left_image['image'], (0, 0))
-    new_image['image'].paste(right_image['image'], (left_image_width, 0))
 
-    return new_image
+def splice_parts(parts: List, direction: str):
+    """Composite PIL images right away, or defer the splice if any of the parts is a render handle"""
+    if all(isinstance(part, Image.Image) for part in parts):
+        return composite_images(parts, direction)
+    return SplicedImage(parts, direction)
 
 
-def splice_images(image_list: List) -> List:
-    """Identifies sets of images to vertically splice and then splices them.
-    For cases where images are split into N pieces, it iteratively merges them until there is one image"""
-    new_image_list = image_list.copy()
-    candidates = identify_images_to_vertically_splice(new_image_list)
-    while len(candidates) > 0:
-        candidate = candidates[0]
-        new_image = vertically_splice_image_pair(candidate[0], candidate[1])
-        new_image_list.append(new_image)
-        if candidate[0] in new_image_list:
-            new_image_list.remove(candidate[0])
-        if candidate[1] in new_image_list:
-            new_image_list.remove(candidate[1])
-        candidates = identify_images_to_vertically_splice(new_image_list)
-
-    candidates = identify_images_to_horizontally_splice(new_image_list)
-    while len(candidates) > 0:
-        candidate = candidates[0]
-        new_image = horizontally_splice_image_pair(candidate[0], candidate[1])
-        new_image_list.append(new_image)
-        if candidate[0] in new_image_list:
-            new_image_list.remove(candidate[0])
-        if candidate[1] in new_image_list:
-            new_image_list.remove(candidate[1])
-        candidates = identify_images_to_horizontally_splice(new_image_list)
-    return new_image_list
+def composite_images(parts: List[Image.Image], direction: str) -> Image.Image:
+    """Paste images top to bottom ('vertical') or left to right ('horizontal') onto a single new image"""
+    # get height and width from images directly since the values in the dictionaries are in a different coordinate frame
+    if direction == 'vertical':
+        size = (parts[0].width, sum(part.height for part in parts))
+    else:
+        size = (sum(part.width for part in parts), parts[0].height)
+    new_image = Image.new('RGB', size)
+    offset = 0
+    for part in parts:
+        if direction == 'vertical':
+            new_image.paste(part, (0, offset))
+            offset += part.height
+        else:
+            new_image.paste(part, (offset, 0))
+            offset += part.width
+    return new_image
 
 
 def identify_line_numbers(word_df: pd.DataFrame) -> pd.DataFrame:
@@ -235,6 +586,18 @@ def identify_line_numbers(word_df: pd.DataFrame) -> pd.DataFrame:
     return word_df
 
 
+# per-line attributes taken from the words of each line
+LINE_METADATA_COLUMNS = [
+    'top',
+    'bottom',
+    'upright',
+    'direction',
+    'page_height',
+    'doctop',
+    'page_number',
+]
+
+
 def word_df_to_line_df(word_df: pd.DataFrame) -> pd.DataFrame:
     """Convert a dataframe of words to a dataframe of lines.
 
@@ -263,45 +626,23 @@ def word_df_to_line_df(word_df: pd.DataFrame) -> pd.DataFrame:
         a pandas dataframe containing the line data
     """
 
-    line_df = (
-        word_df[~word_df['is_line_number']]
-        .groupby(['top_abs', 'bottom_abs'], group_keys=True)
-        .apply(lambda x: x.sort_values('x0'))
-        .reset_index(drop=True)
-        .groupby(['top_abs', 'bottom_abs'], group_keys=True)
-        .apply(lambda x: ' '.join(x['text']))
-        .rename('text')
-        .reset_index()
-        .reset_index()
-        .rename(columns={'index': 'line_number'})
-        .merge(
-            word_df[
-                [
-                    'top_abs',
-                    'bottom_abs',
-                    'top',
-                    'bottom',
-                    'upright',
-                    'direction',
-                    'page_height',
-                    'doctop',
-                    'page_number',
-                ]
-            ],
-            on=['top_abs', 'bottom_abs'],
-            how='left',
-        )
-        .drop_duplicates()
-        .reset_index(drop=True)
+    # one sort puts the words of each line together, left to right, with lines in (top_abs, bottom_abs) order
+    line_keys = ['top_abs', 'bottom_abs']
+    words = word_df.loc[~word_df['is_line_number']].sort_values(
+        line_keys + ['x0'], kind='mergesort'
     )
+    grouped = words.groupby(line_keys, sort=False)
+
+    line_df = grouped[LINE_METADATA_COLUMNS].first()
+    line_df.insert(0, 'text', grouped['text'].agg(' '.join))
+    line_df = line_df.reset_index()
+    line_df.insert(0, 'line_number', np.arange(len(line_df)))
 
     # add number of words in each line
     line_df['num_words'] = line_df['text'].str.split().str.len()
 
     # add line number on a per-page basis
-    line_df['line_number_by_page'] = (
-        line_df.groupby('page_number')['line_number'].rank(method='first').astype(int)
-    )
+    line_df['line_number_by_page'] = line_df.groupby('page_number').cumcount() + 1
 
     # add distance to next line
     line_df['dist_to_next_line'] = (line_df['top_abs'].shift(-1) - line_df['bottom_abs']).round(2)
@@ -374,6 +715,112 @@ def get_distance_from_line_to_image(line, image):
 
 
 FIGURE_INDICATORS = ['figure', 'fig', 'fig.']
+# a line may mention a figure if its lowercase text contains any of the indicators (as a regex, like str.contains)
+FIGURE_INDICATOR_REGEX = re.compile('|'.join(FIGURE_INDICATORS))
+NON_ALPHANUMERIC_REGEX = re.compile(r'[\W_]+')
+
+CANDIDATE_LABEL_COLUMNS = [
+    'image_number',
+    'page_number',
+    'line_number',
+    'word_number',
+    'distance',
+    'label',
+]
+
+
+def find_figure_label_mentions(lines: pd.DataFrame) -> pd.DataFrame:
+    """Find every figure indicator word followed by a label, in one pass over all the lines of a document.
+
+    Lines that may mention a figure are found with a single compiled regex. Their words are then exploded into
+    one row each, stripped of non-alphanumeric characters, and every indicator word (see `FIGURE_INDICATORS`)
+    that is followed by another word yields a mention whose label is the first 2 characters of that word.
+
+    Args:
+        lines: a pandas dataframe containing line data, with 'page_number', 'line_number', 'top', 'bottom'
+            and 'text' columns
+
+    Returns:
+        a pandas dataframe with the columns 'page_number', 'line_number', 'top', 'bottom', 'word_number' and
+        'label', with one row per mention in document order
+    """
+    text = lines['text'].str.lower()
+    figure_lines = lines.loc[text.str.contains(FIGURE_INDICATOR_REGEX, na=False)]
+
+    words = text.loc[figure_lines.index].str.split().explode().dropna()
+    words = words.str.replace(NON_ALPHANUMERIC_REGEX, '', regex=True)
+    word_number = words.groupby(level=0).cumcount()
+    next_word = words.groupby(level=0).shift(-1)
+    is_mention = (words.isin(FIGURE_INDICATORS) & next_word.notna()).to_numpy()
+
+    mentions = figure_lines.loc[
+        words.index[is_mention], ['page_number', 'line_number', 'top', 'bottom']
+    ].reset_index(drop=True)
+    mentions['word_number'] = word_number.to_numpy()[is_mention]
+    mentions['label'] = next_word[is_mention].str[:2].to_numpy()
+    return mentions
+
+
+def find_candidate_labels(images: List[Dict[str, Any]], lines: pd.DataFrame) -> pd.DataFrame:
+    """Find the candidate figure labels for all images at once.
+
+    Mentions of figures (see `find_figure_label_mentions`) on the page of an image and on the next page are
+    candidates for that image. Lines on the next page are shifted down by the height of the image's page, taken
+    as the lowest line bottom on that page. The distance from each candidate line to each image on a page is
+    computed as one NumPy array, with the same definition as `get_distance_from_line_to_image`.
+
+    Args:
+        images: a list of dictionaries with 'page_number', 'top' and 'bottom' keys, and optionally 'image_number'
+            (the position in the list is used otherwise)
+        lines: a pandas dataframe containing line data
+
+    Returns:
+        a pandas dataframe with the columns in `CANDIDATE_LABEL_COLUMNS`, with one row per image and candidate
+    """
+    mentions = find_figure_label_mentions(lines)
+    mentions_by_page = dict(list(mentions.groupby('page_number', sort=False)))
+    page_heights = lines.groupby('page_number')['bottom'].max()
+
+    images_by_page = {}
+    for position, image in enumerate(images):
+        image_number = image.get('image_number', position)
+        images_by_page.setdefault(image['page_number'], []).append((image_number, image))
+
+    frames = []
+    for page_number, page_images in images_by_page.items():
+        next_page_mentions = mentions_by_page.get(page_number + 1, mentions.iloc[:0]).copy()
+        page_height = page_heights.get(page_number, np.nan)
+        next_page_mentions['top'] = next_page_mentions['top'] + page_height
+        next_page_mentions['bottom'] = next_page_mentions['bottom'] + page_height
+        nearby = pd.concat(
+            [mentions_by_page.get(page_number, mentions.iloc[:0]), next_page_mentions]
+        )
+        if nearby.empty:
+            continue
+
+        # (images, lines) arrays
+        image_tops = np.array([image['top'] for _, image in page_images], dtype=float)[:, None]
+        image_bottoms = np.array([image['bottom'] for _, image in page_images], dtype=float)[
+            :, None
+        ]
+        line_centers = ((nearby['top'] + nearby['bottom']) / 2).to_numpy(dtype=float)[None, :]
+        inside = (line_centers > image_tops) & (line_centers < image_bottoms)
+        distance = np.where(
+            inside,
+            0.0,
+            np.minimum(np.abs(line_centers - image_tops), np.abs(line_centers - image_bottoms)),
+        )
+
+        frame = nearby.iloc[np.tile(np.arange(len(nearby)), len(page_images))].reset_index(
+            drop=True
+        )
+        frame['image_number'] = np.repeat([number for number, _ in page_images], len(nearby))
+        frame['distance'] = distance.ravel()
+        frames.append(frame[CANDIDATE_LABEL_COLUMNS])
+
+    if not frames:
+        return pd.DataFrame(columns=CANDIDATE_LABEL_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
 
 
 def extract_figure_labels(image: Dict[str, Any], lines: pd.DataFrame) -> List[Dict[str, Any]]:
@@ -388,10 +835,11 @@ def extract_figure_labels(image: Dict[str, Any], lines: pd.DataFrame) -> List[Di
         - bottom: a float representing the bottom position of the line on the page (in some unit of measurement)
         - text: a string representing the text of the line
 
-    This function extracts lines from the input 'lines' dataframe that are on the same page as the 'image' and within
-    a certain distance of the image. It then searches for figure labels in these lines, using the list of figure
-    indicators stored in the global variable `FIGURE_INDICATORS`. If a figure label is found, a dictionary containing
-    the page number, line number, word number, distance from the image, and label is added to the output list of labels.
+    This function extracts lines from the input 'lines' dataframe that are on the same page as the 'image' or on
+    the next page. It then searches for figure labels in these lines, using the list of figure indicators stored
+    in the global variable `FIGURE_INDICATORS`. If a figure label is found, a dictionary containing the page
+    number, line number, word number, distance from the image, and label is added to the output list of labels.
+    To label many images, use `find_candidate_labels` which handles all of them in one pass.
 
     Args:
         image: a dictionary representing an image
@@ -400,47 +848,8 @@ def extract_figure_labels(image: Dict[str, Any], lines: pd.DataFrame) -> List[Di
     Returns:
         a list of dictionaries containing figure labels and their positions
     """
-    page_lines = lines[lines['page_number'] == image['page_number']].copy()
-    page_lines['distance'] = page_lines.apply(
-        lambda x: get_distance_from_line_to_image(x, image), axis=1
-    )
-
-    # add lines from next page if they are close enough. adjust distance to account for page height
-    next_page_lines = lines[lines['page_number'] == image['page_number'] + 1].copy()
-    page_height = page_lines['bottom'].max()
-    next_page_lines['top'] = next_page_lines['top'] + page_height
-    next_page_lines['bottom'] = next_page_lines['bottom'] + page_height
-    next_page_lines['distance'] = next_page_lines.apply(
-        lambda x: get_distance_from_line_to_image(x, image), axis=1
-    )
-    page_lines = pd.concat([page_lines, next_page_lines])
-
-    figure_lines = page_lines[
-        page_lines['text'].str.lower().str.contains('|'.join(FIGURE_INDICATORS))
-    ]
-
-    labels = []
-    for _, row in figure_lines.iterrows():
-        words = row['text'].lower().split()
-        for ii, word in enumerate(words):
-            word = ''.join([c for c in word if c.isalnum()])
-            if word in FIGURE_INDICATORS:
-                if ii < len(words) - 1:
-                    label = words[ii + 1]
-                    # remove any non-alphanumeric characters
-                    label = ''.join([c for c in label if c.isalnum()])
-                    if len(label) > 2:
-                        label = label[:2]
-                    labels.append(
-                        {
-                            'page_number': row['page_number'],
-                            'line_number': row['line_number'],
-                            'word_number': ii,
-                            'distance': row['distance'],
-                            'label': label,
-                        }
-                    )
-    return labels
+    labels = find_candidate_labels([dict(image, image_number=0)], lines)
+    return labels.drop(columns='image_number').to_dict('records')
 
 
 def find_candidate_labels_for_figures(
@@ -458,6 +867,13 @@ def find_candidate_labels_for_figures(
       A list of dictionaries, where each dictionary contains the image name, the image dataframe, and
     the candidate labels dataframe.
     """
-    for image in images:
-        image['candidate_labels'] = pd.DataFrame(extract_figure_labels(image, lines))
+    candidate_labels = find_candidate_labels(images, lines)
+    labels_by_image = dict(list(candidate_labels.groupby('image_number', sort=False)))
+    empty_labels = candidate_labels.iloc[:0].drop(columns='image_number')
+    for position, image in enumerate(images):
+        labels = labels_by_image.get(image.get('image_number', position))
+        if labels is None:
+            image['candidate_labels'] = empty_labels.copy()
+        else:
+            image['candidate_labels'] = labels.drop(columns='image_number').reset_index(drop=True)
     return images
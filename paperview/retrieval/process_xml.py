@@ -141,7 +141,7 @@ def get_keywords(someroot):
     return result
 
 
-def get_multiple_texts_from_xpath(someroot, somepath, withErrorOnNoValue):
+def get_multiple_texts_from_xpath(ctx, someroot, somepath, withErrorOnNoValue):
     result = ''
     x = someroot.xpath(somepath)
     for el in x:
@@ -149,20 +149,20 @@ def get_multiple_texts_from_xpath(someroot, somepath, withErrorOnNoValue):
     if len(result) >= 1:
         result = clean_string(result)
     elif withErrorOnNoValue:
-        file_status_add_error("ERROR, no text for element: " + somepath)
+        ctx.add_error("ERROR, no text for element: " + somepath)
     return result
 
 
-def get_text_from_xpath(someroot, somepath, withWarningOnMultipleValues, withErrorOnNoValue):
+def get_text_from_xpath(ctx, someroot, somepath, withWarningOnMultipleValues, withErrorOnNoValue):
     result = ''
     x = someroot.xpath(somepath)
     if len(x) >= 1:
         result = get_clean_text(x[0])
         # result = x[0].text
         if len(x) > 1 and withWarningOnMultipleValues is True:
-            file_status_add_error('WARNING: multiple elements found: ' + somepath)
+            ctx.add_error('WARNING: multiple elements found: ' + somepath)
     elif withErrorOnNoValue is True:
-        file_status_add_error("ERROR, no text for element: " + somepath)
+        ctx.add_error("ERROR, no text for element: " + somepath)
     return result
 
 
@@ -225,7 +225,7 @@ def get_first_pub_date(someroot, format):
 # we assume pmc-release and epub are complete dates (with month and day)
 # we then try ppub and add month = 1 and day = 1 it they are tmissing
 # algo decided in accordance with Julien
-def get_pub_date(someroot, format):
+def get_pub_date(ctx, someroot, format):
     selector = '/article/front/article-meta/pub-date'
     dt = get_pub_date_by_type(someroot, selector, 'pmc-release', format)
     if dt['status'] is not 'ok':
@@ -237,7 +237,7 @@ def get_pub_date(someroot, format):
     if dt['status'] is not 'ok':
         dt = get_pub_date_by_type(someroot, selector, None, format)
     if dt['status'] is not 'ok':
-        file_status_add_error('ERROR, element not found: ' + selector)
+        ctx.add_error('ERROR, element not found: ' + selector)
     return dt
 
 
@@ -277,7 +277,7 @@ def get_affiliations(someroot):
     return result
 
 
-def get_authors(someroot):
+def get_authors(ctx, someroot):
     authors = someroot.xpath(
         '/article/front/article-meta/contrib-group/contrib[@contrib-type="author"]'
     )
@@ -310,7 +310,7 @@ def get_authors(someroot):
         author['initials'] = get_initials(givennames)
         result.append(author)
     if len(result) == 0:
-        file_status_add_error("WARNING: no authors")
+        ctx.add_error("WARNING: no authors")
     return result
 
 
@@ -362,7 +362,7 @@ def coalesce(*arg):
 # they are not in the body text flow (illustrative prurpose)
 # this is a temp simple solution
 # rare case: less than 1 < 10'000 publication
-def handle_boxed_text_elements(someroot):
+def handle_boxed_text_elements(ctx, someroot):
     bt_list = someroot.xpath('//boxed-text')
     if bt_list is None:
         return
@@ -370,7 +370,7 @@ def handle_boxed_text_elements(someroot):
         return
     for bt in bt_list:
         bt.getparent().remove(bt)
-    file_status_add_error('WARNING: removed some <boxed-text> element(s)')
+    ctx.add_error('WARNING: removed some <boxed-text> element(s)')
 
 
 def remove_alternative_title_if_redundant(someroot):
@@ -657,7 +657,9 @@ def handle_paragraph_old(pmcid, el):
 # on encountering a section <sec> or <app> or <boxed-text> element, the function calls itself
 # on encountering <p>, <fig>, <list> and <table-wrap> elements, dedicated handlers are called
 # on encountering another element, a default handler is used
-def handle_section_flat(pmcid, sec, level, implicit, block_id):
+def handle_section_flat(pmcid, sec, level, implicit, ctx):
+
+    block_id = ctx.block_id
 
     sectionList = []
     id = ''.join(sec.xpath('@id'))
@@ -700,7 +702,7 @@ def handle_section_flat(pmcid, sec, level, implicit, block_id):
         if el.tag == 'sec' or el.tag == 'app' or el.tag == 'boxed-text':
             block_id[-1] = block_id[-1] + 1
             terminalContentShouldBeWrapped = True
-            sectionList.extend(handle_section_flat(pmcid, el, level + 1, False, block_id))
+            sectionList.extend(handle_section_flat(pmcid, el, level + 1, False, ctx))
             continue
 
         contentsToBeAdded = []
@@ -722,7 +724,7 @@ def handle_section_flat(pmcid, sec, level, implicit, block_id):
                 contentsToBeAdded = [{'tag': el.tag, 'text': sometext}]
 
         addContentsOrWrappedContents(
-            sectionList, mainSection, contentsToBeAdded, level, terminalContentShouldBeWrapped
+            sectionList, mainSection, contentsToBeAdded, level, terminalContentShouldBeWrapped, ctx
         )
 
     block_id.pop()
@@ -745,10 +747,11 @@ def handle_section_flat(pmcid, sec, level, implicit, block_id):
 # sub_sec : [p2]
 # wrap_sec: [p3]
 def addContentsOrWrappedContents(
-    sectionList, currentSection, contentsToBeAdded, level, shouldBeWrapped
+    sectionList, currentSection, contentsToBeAdded, level, shouldBeWrapped, ctx
 ):
     if contentsToBeAdded == []:
         return
+    block_id = ctx.block_id
     targetContents = currentSection['contents']
     if shouldBeWrapped:
         block_id[-1] = block_id[-1] + 1
@@ -776,7 +779,7 @@ def addContentsOrWrappedContents(
 def build_id(a):
     # print(a)
     id = ''
-    for num in block_id:
+    for num in a:
         id += str(num) + '.'
     return id[0:-1]
 
@@ -784,29 +787,31 @@ def build_id(a):
 # ------------------------------------------
 
 
-def file_status_reset():
-    file_status['name'] = ''
-    file_status['errors'].clear()
-
-
-def file_status_set_name(n):
-    file_status['name'] = n
-
+# per-call parse state, so that several documents can be parsed concurrently:
+# - block_id: the running section / block id, e.g. [2, 3, 1] -> '2.3.1'
+# - file_status: the name of the parsed file and the errors / warnings met while parsing it
+class ParserContext(object):
+    def __init__(self, name=''):
+        self.block_id = []
+        self.file_status = {'name': name, 'errors': []}
 
-def file_status_add_error(r):
-    file_status['errors'].append(r)
+    def reset(self, name=''):
+        self.block_id.clear()
+        self.file_status['name'] = name
+        self.file_status['errors'].clear()
 
+    def add_error(self, r):
+        self.file_status['errors'].append(r)
 
-def file_status_ok():
-    return len(file_status['errors']) == 0
+    def ok(self):
+        return len(self.file_status['errors']) == 0
 
-
-def file_status_print():
-    msg = file_status['name'] + '\t'
-    msg += str(len(file_status['errors'])) + '\t'
-    for r in file_status['errors']:
-        msg += r + '\t'
-    print(msg)
+    def print_status(self):
+        msg = self.file_status['name'] + '\t'
+        msg += str(len(self.file_status['errors'])) + '\t'
+        for r in self.file_status['errors']:
+            msg += r + '\t'
+        print(msg)
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - -
@@ -836,22 +841,21 @@ def getPmcFtpUrl(xmlstr):
 # - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def parse_PMC_XML_core(xmlstr, root, input_file):
-
-    xmlstr = cleanup_input_xml(xmlstr)
+# note: when root is given it must already be parsed from the cleaned up xmlstr (see xmlstr_to_root)
+# and it is modified in place by the preprocessing steps below
+def parse_PMC_XML_core(xmlstr, root, input_file, ctx=None):
 
     if root is None:
-        root = etree.fromstring(xmlstr)
+        root = xmlstr_to_root(xmlstr)
 
     if input_file is None:
         input_file = '(unknown file name)'
 
-    # (re)init stats variable
-    file_status_reset()
-    file_status_set_name(input_file)
-
-    # (re)init global variable block_id used for building section / block ids
-    block_id.clear()
+    # (re)init parse state: stats and block_id used for building section / block ids
+    if ctx is None:
+        ctx = ParserContext()
+    ctx.reset(input_file)
+    block_id = ctx.block_id
     # (re)init output variable
     dict_doc = {}
 
@@ -884,7 +888,7 @@ def parse_PMC_XML_core(xmlstr, root, input_file):
 
     # Now retrieve data from refactored XML
     dict_doc['affiliations'] = get_affiliations(root)
-    dict_doc['authors'] = get_authors(root)
+    dict_doc['authors'] = get_authors(ctx, root)
 
     # note: we use xref to retrieve author affiliations above this line
     etree.strip_tags(root, 'xref')
@@ -899,44 +903,44 @@ def parse_PMC_XML_core(xmlstr, root, input_file):
 
     # note: we can get multiple journal-id elements with different journal-id-type attributes
     dict_doc['medline_ta'] = get_text_from_xpath(
-        root, '/article/front/journal-meta/journal-id', False, True
+        ctx, root, '/article/front/journal-meta/journal-id', False, True
     )
 
     dict_doc['journal'] = get_multiple_texts_from_xpath(
-        root, '/article/front/journal-meta//journal-title', True
+        ctx, root, '/article/front/journal-meta//journal-title', True
     )
 
     # note: I did not see any multiple <article-title> elements but we retrieve each element of the hypothetical list just in case
     # dict_doc['title'] = get_multiple_texts_from_xpath(root, '/article/front/article-meta/title-group/article-title', True)
     dict_doc['title'] = get_multiple_texts_from_xpath(
-        root, '/article/front/article-meta/title-group', True
+        ctx, root, '/article/front/article-meta/title-group', True
     )
     dict_doc['pmid'] = get_text_from_xpath(
-        root, '/article/front/article-meta/article-id[@pub-id-type="pmid"]', True, False
+        ctx, root, '/article/front/article-meta/article-id[@pub-id-type="pmid"]', True, False
     )
     dict_doc['doi'] = get_text_from_xpath(
-        root, '/article/front/article-meta/article-id[@pub-id-type="doi"]', True, False
+        ctx, root, '/article/front/article-meta/article-id[@pub-id-type="doi"]', True, False
     )
     # the archive and manuscript types are used for preprints
     dict_doc['archive_id'] = get_text_from_xpath(
-        root, '/article/front/article-meta/article-id[@pub-id-type="archive"]', True, False
+        ctx, root, '/article/front/article-meta/article-id[@pub-id-type="archive"]', True, False
     )
     dict_doc['manuscript_id'] = get_text_from_xpath(
-        root, '/article/front/article-meta/article-id[@pub-id-type="manuscript"]', True, False
+        ctx, root, '/article/front/article-meta/article-id[@pub-id-type="manuscript"]', True, False
     )
 
     # we might find at least one of these:
     pmc1 = get_text_from_xpath(
-        root, '/article/front/article-meta/article-id[@pub-id-type="pmc-uid"]', True, False
+        ctx, root, '/article/front/article-meta/article-id[@pub-id-type="pmc-uid"]', True, False
     )
     pmc2 = get_text_from_xpath(
-        root, '/article/front/article-meta/article-id[@pub-id-type="pmc"]', True, False
+        ctx, root, '/article/front/article-meta/article-id[@pub-id-type="pmc"]', True, False
     )
     pmc = pmc1
     if pmc == '':
         pmc = pmc2
     if pmc == '' and dict_doc['archive_id'] == '':
-        file_status_add_error("ERROR, no value for article id in types pmc-uid, pmc, or archive")
+        ctx.add_error("ERROR, no value for article id in types pmc-uid, pmc, or archive")
     dict_doc['pmcid'] = pmc
     dict_doc['_id'] = pmc
     # if we have no pmc id then use the archive id (for preprints)
@@ -944,17 +948,20 @@ def parse_PMC_XML_core(xmlstr, root, input_file):
         dict_doc['_id'] = dict_doc['archive_id']
 
     # ok with Julien, see precedence rules in def get_pub_date()
-    dict_doc['publication_date'] = get_pub_date(root, 'd-M-yyyy')['date']
-    dict_doc['publication_date_alt'] = get_pub_date(root, 'default format')['date']  # 'yyyy MMM d'
-    dict_doc['pubyear'] = get_pub_date(root, 'yyyy')['date']
-    dict_doc['publication_date_status'] = get_pub_date(root, 'yyyy')['status']
-
-    dict_doc['issue'] = get_text_from_xpath(root, '/article/front/article-meta/issue', True, False)
+    dict_doc['publication_date'] = get_pub_date(ctx, root, 'd-M-yyyy')['date']
+    # 'yyyy MMM d'
+    dict_doc['publication_date_alt'] = get_pub_date(ctx, root, 'default format')['date']
+    dict_doc['pubyear'] = get_pub_date(ctx, root, 'yyyy')['date']
+    dict_doc['publication_date_status'] = get_pub_date(ctx, root, 'yyyy')['status']
+
+    dict_doc['issue'] = get_text_from_xpath(
+        ctx, root, '/article/front/article-meta/issue', True, False
+    )
     dict_doc['volume'] = get_text_from_xpath(
-        root, '/article/front/article-meta/volume', True, False
+        ctx, root, '/article/front/article-meta/volume', True, False
     )
-    fp = get_text_from_xpath(root, '/article/front/article-meta/fpage', False, False)
-    lp = get_text_from_xpath(root, '/article/front/article-meta/lpage', False, False)
+    fp = get_text_from_xpath(ctx, root, '/article/front/article-meta/fpage', False, False)
+    lp = get_text_from_xpath(ctx, root, '/article/front/article-meta/lpage', False, False)
     dict_doc['start_page'] = fp
     dict_doc['end_page'] = lp
     dict_doc['medline_pgn'] = build_medlinePgn(fp, lp)
@@ -983,13 +990,13 @@ def parse_PMC_XML_core(xmlstr, root, input_file):
         abs_node = root.find('./front/article-meta/abstract')
         abs_title = etree.SubElement(abs_node, "title")
         abs_title.text = 'Abstract'
-        sectionList = handle_section_flat(dict_doc['_id'], abs_node, 1, False, block_id)
+        sectionList = handle_section_flat(dict_doc['_id'], abs_node, 1, False, ctx)
         dict_doc['body_sections'].extend(sectionList)
         block_id[-1] = block_id[-1] + 1
 
-    dict_doc['body_sections'].extend(get_sections(dict_doc['pmcid'], root.find('body')))
-    dict_doc['float_sections'] = get_sections(dict_doc['pmcid'], root.find('floats-group'))
-    dict_doc['back_sections'] = get_sections(dict_doc['pmcid'], root.find('back'))
+    dict_doc['body_sections'].extend(get_sections(dict_doc['pmcid'], root.find('body'), ctx))
+    dict_doc['float_sections'] = get_sections(dict_doc['pmcid'], root.find('floats-group'), ctx)
+    dict_doc['back_sections'] = get_sections(dict_doc['pmcid'], root.find('back'), ctx)
 
     # for stats and debugging, can be commented
     dict_doc['figures_in_body'] = len(root.xpath('/article/body//fig'))
@@ -1015,11 +1022,11 @@ def parse_PMC_XML_core(xmlstr, root, input_file):
     return dict_doc
 
 
-def get_sections(pmcid, node):
+def get_sections(pmcid, node, ctx):
     if node is None:
         return []
-    sections = handle_section_flat(pmcid, node, 1, True, block_id)
-    block_id[-1] = block_id[-1] + 1
+    sections = handle_section_flat(pmcid, node, 1, True, ctx)
+    ctx.block_id[-1] = ctx.block_id[-1] + 1
     return sections
 
 
@@ -1043,22 +1050,24 @@ def simplify_node(el, kept_tags, starting=True):
         el.getparent().remove(el)
 
 
-def xmlstr_to_dict(xmlstr):
-    xmlstr = cleanup_input_xml(xmlstr)
-    root = etree.fromstring(xmlstr)
+def xmlstr_to_root(xmlstr):
+    return etree.fromstring(cleanup_input_xml(xmlstr))
+
+
+def xmlstr_to_dict(xmlstr, root=None):
+    if root is None:
+        root = xmlstr_to_root(xmlstr)
     dict_doc = parse_PMC_XML_core(xmlstr, root, input_file=None)
     return dict_doc
 
 
 def main(input: str, output_file: str):
 
-    file_status_reset()
-    file_status_set_name(input)
+    ctx = ParserContext(input)
     xmlstr = get_file_content(input)
-    xmlstr = cleanup_input_xml(xmlstr)
-    root = etree.fromstring(xmlstr)
+    root = xmlstr_to_root(xmlstr)
 
-    dict_doc = parse_PMC_XML_core(xmlstr, root, input)
+    dict_doc = parse_PMC_XML_core(xmlstr, root, input, ctx)
     out_file = codecs.open(output_file, 'w', 'utf-8')
     out_file.write(json.dumps(dict_doc, sort_keys=True, indent=2))
     out_file.close()
@@ -1120,8 +1129,9 @@ def test3():
     xmlstr = '<root><p>p1</p><p>p2</p><sec><title>s2</title><p>p5</p><p>p6</p></sec><p>petit dernier</p></root>'
     xmlstr = '<root><p>p1</p><p>p2</p><p>petit dernier</p></root>'
     root = etree.fromstring(xmlstr)
-    block_id.append(0)
-    stuff = get_sections('111', root)
+    ctx = ParserContext()
+    ctx.block_id.append(0)
+    stuff = get_sections('111', root, ctx)
     print(json.dumps(stuff, sort_keys=True, indent=2))
     # parse_PMC_XML()
 
@@ -1238,31 +1248,39 @@ def test():
     print(x)
 
 
-# - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-# globals
-# - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-file_status = {'name': '', 'errors': []}
-block_id = []
-
 if __name__ == '__main__':
     # test()
     main()
 
 
-def get_fig_slug(label: str, root):
-    try:
-        element = root.xpath(f"//*[local-name()='label' and text()='{label}']/..")[0]
+def get_slug_index(root) -> dict:
+    """Maps the clean label of every <fig> and <table-wrap> to its hwp slug (e.g. 'Figure 1.' -> 'F1').
+
+    Built in a single traversal of the tree, so that all figures and tables can be looked up without
+    rescanning the document. Labels are cleaned up the same way as in handle_fig / handle_table_wrap.
+    Elements without a label are left out, they can't be told apart by label.
+    """
+    index = {}
+    for element in root.iter('fig', 'table-wrap'):
+        label = get_clean_text(element.find('label'))
+        if not label:
+            continue
         #  search children for hwp:sub-type = slug and get text
-        for child in element.getchildren():
+        for child in element.iterchildren():
             if 'slug' in child.attrib.values():
-                slug = child.text
-        return slug
-    except IndexError:
-        return None
+                # keep the first match in document order
+                index.setdefault(label, child.text)
+    return index
+
+
+def get_fig_slug(label: str, root):
+    return get_slug_index(root).get(label)
 
 
 def extract_all(xmlstr: str):
-    text = xmlstr_to_dict(xmlstr)
+    # the document is cleaned up and parsed once; the section parser and the slug lookup share the tree
+    root = xmlstr_to_root(xmlstr)
+    text = xmlstr_to_dict(xmlstr, root)
     df = pd.DataFrame(text['body_sections'])
     sections = df.query('level == 2').set_index('title')['id'].to_dict()
     texts = []
@@ -1304,7 +1322,8 @@ def extract_all(xmlstr: str):
     figures = pd.DataFrame(figures)
     tables = pd.DataFrame(tables)
 
-    root = etree.fromstring(xmlstr)
-    figures['slug'] = figures.label.apply(lambda x: get_fig_slug(x, root))
+    slug_index = get_slug_index(root)
+    figures['slug'] = [slug_index.get(label) for label in figures.get('label', [])]
+    tables['slug'] = [slug_index.get(label) for label in tables.get('label', [])]
 
     return {'xml_text': texts, 'figure_captions': figures, 'table_captions': tables, 'all_text': df}
@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence
+
+from PIL import Image, features
+
+from paperview.retrieval import pdf_extraction
+from paperview.retrieval.encoded_image import EncodedImage
+
+DEFAULT_THUMBNAIL_WIDTHS = (320, 640, 1280)  # pixels, candidates for the srcset of each figure
+DEFAULT_THUMBNAIL_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+DEFAULT_THUMBNAIL_QUALITY = 80
+
+
+def srcset_widths(image_width: int, widths: Sequence[int] = DEFAULT_THUMBNAIL_WIDTHS) -> List[int]:
+    """The thumbnail widths that are narrower than the image, i.e. worth generating"""
+    return sorted(width for width in set(widths) if width < image_width)
+
+
+def make_thumbnails(
+    image,
+    widths: Sequence[int] = DEFAULT_THUMBNAIL_WIDTHS,
+    format: str = DEFAULT_THUMBNAIL_FORMAT,
+    quality: int = DEFAULT_THUMBNAIL_QUALITY,
+) -> Dict[int, EncodedImage]:
+    """
+    Downscale an image to each of `widths` that is narrower than it, keeping the aspect ratio
+
+    Args:
+      image: an EncodedImage, PIL image or render handle
+      widths (Sequence[int]): widths of the thumbnails in pixels
+      format (str): 'WEBP' or 'JPEG'
+      quality (int): encoder quality, from 1 to 100
+
+    Returns:
+      A dictionary of thumbnails by width, decoded from the image only once
+    """
+    pil_image = pdf_extraction.render_image(image)
+    if format == 'JPEG' and pil_image.mode not in ('RGB', 'L'):
+        pil_image = pil_image.convert('RGB')
+
+    thumbnails = {}
+    for width in srcset_widths(pil_image.width, widths):
+        height = max(1, round(pil_image.height * width / pil_image.width))
+        thumbnail = pil_image.resize((width, height), Image.LANCZOS)
+        thumbnails[width] = EncodedImage.from_pil(thumbnail, format=format, quality=quality)
+    return thumbnails
+
+
+def make_all_thumbnails(
+    images: List,
+    widths: Sequence[int] = DEFAULT_THUMBNAIL_WIDTHS,
+    format: str = DEFAULT_THUMBNAIL_FORMAT,
+    quality: int = DEFAULT_THUMBNAIL_QUALITY,
+    max_workers: int = 8,
+) -> List[Dict[int, EncodedImage]]:
+    """
+    Make the thumbnails of several images in a thread pool (PIL releases the GIL while resizing and
+    encoding)
+
+    Returns:
+      A list with the thumbnails of each image, in the same order as `images`
+    """
+
+    def _make_thumbnails(image):
+        return make_thumbnails(image, widths=widths, format=format, quality=quality)
+
+    if max_workers <= 1 or len(images) <= 1:
+        return [_make_thumbnails(image) for image in images]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(images))) as executor:
+        return list(executor.map(_make_thumbnails, images))
@@ -0,0 +1,126 @@
+import logging
+import time
+from typing import Optional, Tuple
+
+import diskcache as dc
+
+from paperview.retrieval import artifact_cache
+from paperview.retrieval.artifact_cache import ArtifactCache
+from paperview.retrieval.biorxiv_api import (
+    ArticleDetail,
+    get_content_detail_by_doi,
+    normalize_doi,
+)
+from paperview.retrieval.http_client import HttpClient
+
+# seconds the latest version of a DOI is trusted before asking the API again, like the metadata itself
+DEFAULT_MAX_AGE = artifact_cache.DEFAULT_TTLS[artifact_cache.METADATA]
+
+logger = logging.getLogger(__name__)
+
+
+def article_key(article_detail: ArticleDetail) -> Tuple[str, str, str]:
+    """
+    Cache key of a version of an article, the same however its DOI was entered or found
+
+    Returns:
+      A (server, normalized DOI, version) tuple, e.g. ('biorxiv', '10.1101/339747', '2')
+    """
+    return (
+        article_detail.server.lower(),
+        normalize_doi(article_detail.doi),
+        str(article_detail.version),
+    )
+
+
+class LatestVersionIndex(object):
+    """Index of the latest version of each article, by server and normalized DOI.
+
+    Each entry holds the `ArticleDetail` of the latest version and when it was checked. Until it is
+    `max_age` seconds old, `get_latest` answers from the index, without a request, so a cached version
+    can be served right away. Then it is refreshed from `get_content_detail_by_doi` (whose metadata is
+    revalidated with a conditional request through the artifact cache), which is how new versions are
+    detected. The index is a `diskcache.Cache`, so it can be shared by processes on a shared volume.
+
+    Args:
+        directory: directory to keep the index in.
+        max_age: seconds an entry is used before it is refreshed.
+    """
+
+    def __init__(self, directory: str, max_age: float = DEFAULT_MAX_AGE):
+        self.cache = dc.Cache(directory)
+        self.max_age = max_age
+
+    @staticmethod
+    def key(doi: str, server: str = "biorxiv") -> Tuple[str, str]:
+        return (server.lower(), normalize_doi(doi))
+
+    def get(self, doi: str, server: str = "biorxiv") -> Optional[ArticleDetail]:
+        """Return the latest known version of an article, however old, or None"""
+        entry = self.cache.get(self.key(doi, server))
+        return None if entry is None else ArticleDetail(**entry['article_detail'])
+
+    def set(self, article_detail: ArticleDetail, server: str = None):
+        """Record a version of an article as checked now, keeping the version in the index if it is
+        later (e.g. the metadata was stale)"""
+        key = self.key(article_detail.doi, server or article_detail.server)
+        entry = {'article_detail': article_detail.dict(), 'checked_at': time.time()}
+        with self.cache.transact():
+            known = self.cache.get(key)
+            if known is not None and int(known['article_detail']['version']) > int(
+                article_detail.version
+            ):
+                entry['article_detail'] = known['article_detail']
+            self.cache.set(key, entry)
+
+    def is_fresh(self, doi: str, server: str = "biorxiv") -> bool:
+        entry = self.cache.get(self.key(doi, server))
+        return entry is not None and time.time() - entry['checked_at'] < self.max_age
+
+    def get_latest(
+        self,
+        doi: str,
+        server: str = "biorxiv",
+        client: HttpClient = None,
+        cache: ArtifactCache = None,
+    ) -> ArticleDetail:
+        """
+        Return the latest version of an article, refreshing the index if its entry is missing or
+        older than `max_age`
+
+        If the refresh fails but the article is in the index, the version in the index is returned.
+
+        Args:
+          doi (str): DOI of the article, in any form `normalize_doi` accepts
+          server (str): biorxiv or medrxiv
+          client (HttpClient): client to send the request with. Defaults to the shared client
+          cache (ArtifactCache): cache for the metadata. Defaults to the shared cache, if there is one
+
+        Returns:
+          ArticleDetail of the latest version
+        """
+        if self.is_fresh(doi, server):
+            return self.get(doi, server)
+        try:
+            article_detail = get_content_detail_by_doi(
+                normalize_doi(doi), server=server, client=client, cache=cache
+            )
+        except Exception as e:
+            known = self.get(doi, server)
+            if known is None:
+                raise
+            logger.warning(
+                f"Failed to refresh the latest version of {doi}, using v{known.version}: {e}"
+            )
+            return known
+        self.set(article_detail, server=server)
+        return self.get(doi, server)
+
+    def close(self):
+        self.cache.close()
+
+    def __enter__(self) -> 'LatestVersionIndex':
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('fastapi')
+httpx = pytest.importorskip('httpx')
+
+from paperview.api import api  # noqa: E402
+from paperview.api.job_backends import LocalJobBackend  # noqa: E402
+
+JOB_SECONDS = 1.0
+# more than the 40 threads of anyio's default limiter, which waiting requests must not hold
+N_REQUESTS = 60
+
+
+def slow_job(ii: int) -> str:
+    time.sleep(JOB_SECONDS)
+    return f'<html>{ii}</html>'
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=N_REQUESTS + 2)
+    backend = LocalJobBackend({'slow': slow_job}, executor=executor)
+    monkeypatch.setattr(api, 'get_job_backend', lambda: backend)
+    yield backend
+    backend.shutdown()
+
+
+async def get_all(paths):
+    async with httpx.AsyncClient(app=api.web_app, base_url='http://test') as client:
+        return await asyncio.gather(*[client.get(path) for path in paths])
+
+
+def test_slow_jobs_do_not_serialize_requests(backend):
+    job_ids = [backend.spawn('slow', ii=ii) for ii in range(N_REQUESTS)]
+    start = time.monotonic()
+    responses = asyncio.run(get_all([f'/overview_result/{job_id}' for job_id in job_ids]))
+    elapsed = time.monotonic() - start
+
+    assert [response.text for response in responses] == [
+        f'<html>{ii}</html>' for ii in range(N_REQUESTS)
+    ]
+    # blocking on the event loop would take N_REQUESTS * JOB_SECONDS
+    assert elapsed < N_REQUESTS * JOB_SECONDS / 2
+
+
+def test_app_responds_while_jobs_wait(backend, tmp_path, monkeypatch):
+    job_ids = [backend.spawn('slow', ii=ii) for ii in range(N_REQUESTS)]
+    other_job_id = backend.spawn('slow', ii=-1)
+    # a sync route, served from the threadpool
+    monkeypatch.setattr(api, 'ARTICLE_STORE_DIR', str(tmp_path))
+
+    async def run():
+        async with httpx.AsyncClient(app=api.web_app, base_url='http://test') as client:
+            waiting = [
+                asyncio.ensure_future(client.get(f'/overview_result/{job_id}'))
+                for job_id in job_ids
+            ]
+            await asyncio.sleep(0.1)
+            start = time.monotonic()
+            status = await client.get(f'/overview_result_status/{other_job_id}')
+            image = await client.get('/images/10.1101/000000/v1/F1')
+            latency = time.monotonic() - start
+            await asyncio.gather(*waiting)
+            return status, image, latency
+
+    status, image, latency = asyncio.run(run())
+    assert status.json() == {'status': 'pending'}
+    assert image.status_code == 404
+    assert latency < JOB_SECONDS / 2
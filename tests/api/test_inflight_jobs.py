@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from paperview.api.inflight_jobs import InflightJobs
+
+
+def _spawn_in_process(directory: str, ii: int) -> str:
+    def spawn():
+        time.sleep(0.2)  # spawning takes a while, other requests arrive meanwhile
+        return f'call-{ii}'
+
+    with InflightJobs(directory) as jobs:
+        return jobs.get_or_spawn(('10.1101/000000', '2'), spawn)
+
+
+def test_identical_requests_share_one_job(tmp_path):
+    directory = str(tmp_path / 'inflight')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        call_ids = set(executor.map(_spawn_in_process, [directory] * 8, range(8)))
+    assert len(call_ids) == 1
+
+
+def test_replicas_share_the_registry(tmp_path):
+    directory = str(tmp_path / 'inflight')
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        call_ids = set(executor.map(_spawn_in_process, [directory] * 4, range(4)))
+    assert len(call_ids) == 1
+    with InflightJobs(directory) as jobs:
+        assert jobs.get(('10.1101/000000', '2')) in call_ids
+
+
+def test_other_versions_and_failed_jobs_get_new_jobs(tmp_path):
+    spawned = []
+
+    def spawn():
+        spawned.append(f'call-{len(spawned)}')
+        return spawned[-1]
+
+    with InflightJobs(str(tmp_path / 'inflight')) as jobs:
+        assert jobs.get_or_spawn(('10.1101/000000', '1'), spawn) == 'call-0'
+        assert jobs.get_or_spawn(('10.1101/000000', '1'), spawn) == 'call-0'
+        assert jobs.get_or_spawn(('10.1101/000000', '2'), spawn) == 'call-1'
+        failed = jobs.get_or_spawn(('10.1101/000000', '2'), spawn, is_alive=lambda call_id: False)
+        assert failed == 'call-2'
+
+
+def test_registered_jobs_expire(tmp_path):
+    with InflightJobs(str(tmp_path / 'inflight'), expire=0.1) as jobs:
+        assert jobs.get_or_spawn('key', lambda: 'first') == 'first'
+        time.sleep(0.2)
+        assert jobs.get_or_spawn('key', lambda: 'second') == 'second'
@@ -0,0 +1,109 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from paperview.api import overview_jobs
+from paperview.api.job_backends import LocalJobBackend, ModalJobBackend
+
+
+def add(a: int, b: int) -> int:
+    return a + b
+
+
+def wait(seconds: float) -> float:
+    time.sleep(seconds)
+    return seconds
+
+
+def fail():
+    raise ValueError("failed")
+
+
+@pytest.fixture
+def backend():
+    backend = LocalJobBackend({'add': add, 'wait': wait, 'fail': fail}, max_workers=2)
+    yield backend
+    backend.shutdown()
+
+
+def test_local_jobs_run_in_worker_processes(backend):
+    job_id = backend.spawn('add', a=1, b=2)
+    assert backend.get(job_id) == 3
+    assert backend.status(job_id) == 'completed'
+    assert backend.call('add', a=2, b=2) == 4
+
+
+def test_local_jobs_time_out_with_the_builtin_error(backend):
+    job_id = backend.spawn('wait', seconds=0.5)
+    with pytest.raises(TimeoutError):
+        backend.get(job_id, timeout=0)
+    assert backend.status(job_id) == 'pending'
+    assert backend.get(job_id) == 0.5
+
+
+def test_local_job_failures_are_reraised(backend):
+    job_id = backend.spawn('fail')
+    with pytest.raises(ValueError):
+        backend.get(job_id)
+    assert backend.status(job_id) == 'failed'
+    assert backend.status('unknown') == 'failed'
+    with pytest.raises(KeyError):
+        backend.get('unknown')
+
+
+def test_only_the_latest_finished_jobs_are_kept(backend):
+    backend.max_finished_jobs = 2
+    job_ids = [backend.spawn('add', a=ii, b=0) for ii in range(4)]
+    for job_id in job_ids:
+        backend.get(job_id)
+    backend.spawn('add', a=0, b=0)
+    assert job_ids[0] not in backend.futures and job_ids[1] not in backend.futures
+    assert backend.get(job_ids[3]) == 3
+
+
+@pytest.mark.parametrize(
+    'statuses,expected',
+    [
+        ([], 'pending'),
+        (['PENDING'], 'pending'),
+        (['SUCCESS'], 'completed'),
+        (['SUCCESS', 'FAILURE'], 'failed'),
+        (['TIMEOUT'], 'failed'),
+    ],
+)
+def test_modal_job_status_does_not_fetch_the_result(monkeypatch, statuses, expected):
+    backend = ModalJobBackend(overview_jobs.APP_NAME)
+    call_graph = [SimpleNamespace(status=SimpleNamespace(name=status)) for status in statuses]
+    monkeypatch.setattr(backend, 'get_call_graph', lambda job_id: call_graph)
+    monkeypatch.setattr(backend, 'get', None)  # fails the test if the result is fetched
+    assert backend.status('fc-123') == expected
+
+
+def test_job_backend_follows_environment(monkeypatch):
+    monkeypatch.setenv(overview_jobs.JOB_BACKEND_ENV_VAR, 'modal')
+    overview_jobs.get_job_backend.cache_clear()
+    assert isinstance(overview_jobs.get_job_backend(), ModalJobBackend)
+
+    monkeypatch.setenv(overview_jobs.JOB_BACKEND_ENV_VAR, 'local')
+    overview_jobs.get_job_backend.cache_clear()
+    backend = overview_jobs.get_job_backend()
+    assert isinstance(backend, LocalJobBackend)
+    assert set(backend.functions) == {'retrieve_article', 'get_overview'}
+    backend.shutdown()
+    overview_jobs.get_job_backend.cache_clear()
+
+
+def test_caches_are_opened_once_per_process(monkeypatch, tmp_path):
+    for name in ['ARTIFACT_CACHE_DIR', 'LATEST_VERSIONS_DIR', 'OVERVIEW_CACHE_DIR']:
+        monkeypatch.setattr(overview_jobs, name, str(tmp_path / name))
+    overview_jobs._open_caches.cache_clear()
+
+    caches = overview_jobs.get_caches()
+    assert overview_jobs.get_caches() is caches
+    forked_caches = overview_jobs._open_caches(-1)
+    assert all(a is not b for a, b in zip(caches, forked_caches))
+
+    for cache in caches + forked_caches:
+        cache.close()
+    overview_jobs._open_caches.cache_clear()
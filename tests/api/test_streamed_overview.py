@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+pytest.importorskip('fastapi')
+httpx = pytest.importorskip('httpx')
+
+from paperview.api import api  # noqa: E402
+from paperview.api.inflight_jobs import InflightJobs  # noqa: E402
+from paperview.api.job_backends import LocalJobBackend  # noqa: E402
+from paperview.retrieval.biorxiv_api import ArticleDetail  # noqa: E402
+
+
+def get(path: str):
+    async def run():
+        async with httpx.AsyncClient(app=api.web_app, base_url='http://test') as client:
+            return await client.get(path)
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    'error, status_code',
+    [
+        (ValueError('no posts found'), 404),
+        (AttributeError('no DOI on the page'), 404),
+        (requests.ConnectionError(), 502),
+    ],
+)
+def test_failed_lookups_get_an_error_status(monkeypatch, error, status_code):
+    def get_latest_article_detail(doi=None, page=None):
+        raise error
+
+    monkeypatch.setattr(api, 'get_latest_article_detail', get_latest_article_detail)
+    assert get('/request-overview/?doi=10.1101/000000').status_code == status_code
+
+    async def post_form():
+        async with httpx.AsyncClient(app=api.web_app, base_url='http://test') as client:
+            return await client.post('/form-start-overview/', data={'doi': 'not a doi'})
+
+    assert asyncio.run(post_form()).status_code == status_code
+
+
+def test_identical_streamed_requests_share_one_job(monkeypatch, tmp_path):
+    article_detail = ArticleDetail(
+        title='A test article',
+        authors=['Doe, J.'],
+        date='2020-02-01',
+        category='neuroscience',
+        doi='10.1101/000000',
+        author_corresponding='Jane Doe',
+        author_corresponding_institution='Nowhere',
+        version='2',
+        type='new results',
+        license='cc_by',
+        abstract='The abstract.',
+        published='NA',
+        server='biorxiv',
+        jatsxml='https://www.biorxiv.org/content/early/2020/02/01/000000.source.xml',
+    )
+    calls = []
+    lock = threading.Lock()
+
+    def retrieve_article(doi=None):
+        with lock:
+            calls.append(doi)
+        time.sleep(0.5)
+
+    backend = LocalJobBackend(
+        {'retrieve_article': retrieve_article}, executor=ThreadPoolExecutor(max_workers=4)
+    )
+    inflight_jobs = InflightJobs(str(tmp_path / 'inflight'))
+    monkeypatch.setattr(
+        api, 'get_latest_article_detail', lambda doi=None, page=None: article_detail
+    )
+    monkeypatch.setattr(api, 'get_job_backend', lambda: backend)
+    monkeypatch.setattr(api, 'get_inflight_jobs', lambda: inflight_jobs)
+    monkeypatch.setattr(api, 'ARTICLE_STORE_DIR', str(tmp_path / 'store'))
+
+    async def run():
+        async with httpx.AsyncClient(app=api.web_app, base_url='http://test') as client:
+            path = '/request-overview/?doi=10.1101/000000'
+            return await asyncio.gather(*[client.get(path) for _ in range(5)])
+
+    responses = asyncio.run(run())
+    backend.shutdown()
+    inflight_jobs.close()
+    assert calls == ['10.1101/000000']
+    for response in responses:
+        assert response.status_code == 200
+        assert 'A test article' in response.text
+
+
+def fail():
+    raise RuntimeError("processing failed")
+
+
+def test_failed_jobs_get_a_status_and_an_error_page(monkeypatch):
+    backend = LocalJobBackend({'fail': fail}, executor=ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(api, 'get_job_backend', lambda: backend)
+    job_id = backend.spawn('fail')
+    with pytest.raises(RuntimeError):
+        backend.get(job_id)
+
+    assert get(f'/overview_result_status/{job_id}').json() == {'status': 'failed'}
+    response = get(f'/overview_result/{job_id}')
+    assert response.status_code == 500
+    assert 'could not be generated' in response.text
+    backend.shutdown()
@@ -0,0 +1,209 @@
+import json
+import os
+from io import BytesIO
+
+import pandas as pd
+import pytest
+from PIL import Image
+
+from paperview.retrieval import article_store, pdf_extraction
+from paperview.retrieval.article_store import ArticleStore, StoredArticle, save_article
+from paperview.retrieval.biorxiv_api import Article, ArticleDetail
+
+
+def make_jpeg(width: int, height: int) -> Image.Image:
+    buffered = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffered, format='JPEG', quality=70)
+    image = Image.open(BytesIO(buffered.getvalue()))
+    image.load()
+    return image
+
+
+@pytest.fixture
+def article():
+    article = Article.__new__(Article)
+    article.article_detail = ArticleDetail(
+        title='A test article',
+        authors=['Doe, J.', 'Roe, R.'],
+        date='2020-02-01',
+        category='neuroscience',
+        doi='10.1101/000000',
+        author_corresponding='Jane Doe',
+        author_corresponding_institution='Nowhere',
+        version='2',
+        type='new results',
+        license='cc_by',
+        abstract='The abstract.',
+        published='NA',
+        server='biorxiv',
+        jatsxml='https://www.biorxiv.org/content/early/2020/02/01/000000.source.xml',
+    )
+    article.full_xml_retrieved = False
+    article.data = {
+        'xml_text': pd.DataFrame({'section': ['Results'] * 2, 'text': ['first', 'second']}),
+        'all_text': pd.DataFrame({'title': ['Results'], 'contents': [[{'tag': 'p', 'text': 'a'}]]}),
+        'text': ['l', 'i', 'n', 'e'],
+        'images': [
+            {
+                'image': make_jpeg(40, 20),
+                'page_number': 1,
+                'image_number': 1,
+                'width': 40.0,
+                'stream': object(),  # not serializable, e.g. a pdfminer stream
+                'candidate_labels': pd.DataFrame({'label': ['Figure 1'], 'distance': [3.0]}),
+            },
+            {
+                'image': Image.new('RGB', (10, 30), 'blue'),
+                'page_number': 2,
+                'image_number': 2,
+                'width': 10.0,
+            },
+        ],
+    }
+    return article
+
+
+def test_saved_article_round_trips(article, tmp_path):
+    stored = StoredArticle(save_article(article, str(tmp_path / 'article')))
+    assert stored.article_detail == article.article_detail
+    assert set(stored.data) == set(article.data)
+    for key in ['xml_text', 'all_text']:
+        pd.testing.assert_frame_equal(stored.data[key], article.data[key])
+    assert stored.data['text'] == article.data['text']
+
+    first, second = stored.data['images']
+    assert first['page_number'] == 1 and 'stream' not in first
+    pd.testing.assert_frame_equal(
+        first['candidate_labels'], article.data['images'][0]['candidate_labels']
+    )
+    assert first['image'].format == 'JPEG' and first['image'].size == (40, 20)
+    assert second['image'].decode().tobytes() == article.data['images'][1]['image'].tobytes()
+    assert stored.get_image_media_type(1) == 'image/png'
+
+
+def test_tables_are_written_as_parquet(article, tmp_path):
+    article.data['xml_text']['n_words'] = [1, 2]
+    stored = StoredArticle(save_article(article, str(tmp_path / 'article')))
+    xml_text = stored.manifest['parts']['xml_text']
+    assert xml_text['path'] == 'xml_text.parquet' and 'pickled_columns' not in xml_text
+    assert pd.read_parquet(os.path.join(stored.path, 'xml_text.parquet')).n_words.tolist() == [1, 2]
+    pd.testing.assert_frame_equal(stored.data['xml_text'], article.data['xml_text'])
+
+    # only the nested contents are pickled, the titles stay in Parquet
+    all_text = stored.manifest['parts']['all_text']
+    assert all_text['path'] == 'all_text.parquet'
+    assert all_text['pickled_columns']['columns'] == ['contents']
+    assert list(pd.read_parquet(os.path.join(stored.path, 'all_text.parquet'))) == ['title']
+    pd.testing.assert_frame_equal(stored.data['all_text'], article.data['all_text'])
+
+
+def test_parts_are_loaded_lazily(article, tmp_path, monkeypatch):
+    stored = StoredArticle(save_article(article, str(tmp_path / 'article')))
+    loaded = []
+    load_part = stored.load_part
+    monkeypatch.setattr(stored, 'load_part', lambda key: loaded.append(key) or load_part(key))
+
+    stored.data['images']
+    stored.data['images']
+    assert loaded == ['images']
+    assert 'xml_text' not in stored.data.loaded
+
+
+def test_jpeg_figures_keep_their_quantization(article, tmp_path):
+    stored = StoredArticle(save_article(article, str(tmp_path / 'article')))
+    original = article.data['images'][0]['image']
+    saved = Image.open(BytesIO(stored.get_image_bytes(0)))
+    assert saved.quantization == original.quantization
+
+
+def test_deferred_figures_are_rendered_under_a_single_open_pdf(article, tmp_path, monkeypatch):
+    pdf_path = str(tmp_path / 'article.pdf')
+    Image.new('RGB', (200, 100), 'red').save(pdf_path)
+    for image in article.data['images']:
+        image['image'] = pdf_extraction.DeferredImage(pdf_path, 1, (0, 0, 20, 10), resolution=72)
+
+    opened, rendered_with = [], []
+    pdfplumber_open = article_store.pdfplumber.open
+
+    def counting_open(*args, **kwargs):
+        opened.append(args)
+        return pdfplumber_open(*args, **kwargs)
+
+    def render(handle, pdf=None):
+        rendered_with.append(pdf)
+        return Image.new('RGB', (handle.width, handle.height), 'red')
+
+    monkeypatch.setattr(article_store.pdfplumber, 'open', counting_open)
+    monkeypatch.setattr(pdf_extraction.DeferredImage, 'render', render)
+    stored = StoredArticle(save_article(article, str(tmp_path / 'article')))
+
+    assert len(opened) == 1
+    assert len(rendered_with) == 2 and rendered_with[0] is not None
+    assert rendered_with[0] is rendered_with[1]
+    assert [image['image'].size for image in stored.data['images']] == [(20, 10)] * 2
+
+
+def test_other_schema_versions_are_not_loaded(article, tmp_path):
+    store = ArticleStore(str(tmp_path / 'store'))
+    path = store.save(article).path
+    assert path == store.path_for('10.1101/000000', '2')
+    assert store.load('10.1101/000000', '2') is not None
+    assert store.load('10.1101/000000', '1') is None
+
+    manifest_path = os.path.join(path, article_store.MANIFEST_FILE_NAME)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['schema_version'] = article_store.SCHEMA_VERSION - 1
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    assert store.load('10.1101/000000', '2') is None
+    with pytest.raises(ValueError):
+        StoredArticle(path)
+
+
+def test_saving_again_replaces_the_article(article, tmp_path):
+    path = str(tmp_path / 'article')
+    save_article(article, path)
+    article.data['text'] = ['new']
+    save_article(article, path)
+    assert StoredArticle(path).data['text'] == ['new']
+    assert os.listdir(tmp_path) == ['article']
+
+
+def test_previous_article_is_deleted_only_after_the_new_one_is_in_place(
+    article, tmp_path, monkeypatch
+):
+    path = str(tmp_path / 'article')
+    save_article(article, path)
+    rmtree = article_store.shutil.rmtree
+    manifest_exists_after_deleting = []
+
+    def checked_rmtree(directory, **kwargs):
+        rmtree(directory, **kwargs)
+        manifest_path = os.path.join(path, article_store.MANIFEST_FILE_NAME)
+        manifest_exists_after_deleting.append(os.path.exists(manifest_path))
+
+    monkeypatch.setattr(article_store.shutil, 'rmtree', checked_rmtree)
+    article.data['text'] = ['new']
+    save_article(article, path)
+    assert manifest_exists_after_deleting and all(manifest_exists_after_deleting)
+    assert StoredArticle(path).data['text'] == ['new']
+    assert os.listdir(tmp_path) == ['article']
+
+
+def test_thumbnails_are_saved_next_to_the_images(article, tmp_path):
+    article.data['images'][0]['slug'] = 'F1'
+    article.data['images'][0]['image'] = make_jpeg(1000, 500)
+    stored = StoredArticle(save_article(article, str(tmp_path / 'article')))
+    assert stored.get_image_file('F1', 320) is None
+
+    stored.save_thumbnails(widths=(320, 640), format='JPEG', quality=50)
+    path, media_type = stored.get_image_file('F1', 320)
+    assert media_type == 'image/jpeg'
+    assert Image.open(path).size == (320, 160)
+    assert stored.get_image_file('image2')[1] == 'image/png'
+    assert stored.get_image_file('image2', 320) is None  # narrower than the thumbnail
+
+    reopened = StoredArticle(stored.path)
+    assert reopened.get_image_file('F1', 640)[0].endswith('images/0-640.jpg')
+    assert reopened.get_image_file('F9') is None
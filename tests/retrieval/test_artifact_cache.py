@@ -0,0 +1,169 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pytest
+import requests
+
+from paperview.retrieval import artifact_cache
+from paperview.retrieval.artifact_cache import ArtifactCache, cached_get
+from paperview.retrieval.pdf_extraction import NamedTemporaryPDF
+
+
+class CountingClient:
+    """Serves `content` for every URL (or a 404 for `missing` URLs) and counts the requests"""
+
+    def __init__(self, content: bytes = b'<article/>', missing=()):
+        self.content = content
+        self.missing = missing
+        self.urls = []
+
+    def get(self, url, stream=False):
+        self.urls.append(url)
+        response = requests.models.Response()
+        response.url = url
+        response.status_code = 404 if url in self.missing else 200
+        response.raw = BytesIO(self.content)
+        return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with ArtifactCache(str(tmp_path / 'artifacts')) as cache:
+        yield cache
+
+
+def test_set_and_get_are_keyed_by_url_doi_and_version(cache):
+    cache.set('xml', 'https://x/a.xml', b'v1', doi='10.1101/1', version='1')
+    assert cache.get('xml', 'https://x/a.xml', doi='10.1101/1', version=1) == b'v1'
+    assert cache.get('xml', 'https://x/a.xml', doi='10.1101/1', version='2') is None
+    assert cache.get('figure', 'https://x/a.xml', doi='10.1101/1', version='1') is None
+
+
+def test_identical_content_is_stored_once(cache):
+    first = cache.set('figure', 'https://x/F1.large.jpg', b'same bytes')
+    second = cache.set('figure', 'https://x/F1.jpg', b'same bytes')
+    assert first == second
+    assert len([key for key in cache.cache if key[0] == 'content']) == 1
+
+
+def test_least_recently_used_artifacts_are_evicted(tmp_path):
+    with ArtifactCache(str(tmp_path / 'small'), size_limit=300_000, cull_limit=2) as cache:
+        cache.set('pdf', 'https://x/old.pdf', os.urandom(100_000))
+        cache.set('pdf', 'https://x/used.pdf', os.urandom(100_000))
+        for ii in range(4):
+            assert cache.get('pdf', 'https://x/used.pdf') is not None
+            cache.set('pdf', f'https://x/new{ii}.pdf', os.urandom(100_000))
+        assert cache.get('pdf', 'https://x/old.pdf') is None
+        assert cache.get('pdf', 'https://x/used.pdf') is not None
+
+
+def test_files_round_trip_without_loading(cache, tmp_path):
+    source, target = tmp_path / 'source.pdf', tmp_path / 'target.pdf'
+    source.write_bytes(os.urandom(200_000))
+    cache.set_file('pdf', 'https://x/a.pdf', str(source))
+    assert cache.get_file('pdf', 'https://x/a.pdf', str(target))
+    assert target.read_bytes() == source.read_bytes()
+    assert not cache.get_file('pdf', 'https://x/b.pdf', str(target))
+
+
+def test_cached_get_hits_the_network_once(cache):
+    client = CountingClient()
+    for _ in range(3):
+        assert cached_get('https://x/a.xml', 'xml', client=client, cache=cache) == b'<article/>'
+    assert client.urls == ['https://x/a.xml']
+
+
+def test_cached_get_does_not_cache_errors(cache):
+    client = CountingClient(missing=('https://x/F9.large.jpg',))
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            cached_get('https://x/F9.large.jpg', 'figure', client=client, cache=cache)
+    assert len(client.urls) == 2
+
+
+def test_named_temporary_pdf_reuses_cached_download(cache):
+    client = CountingClient(content=b'%PDF-1.4 not really a pdf')
+    for _ in range(2):
+        with NamedTemporaryPDF('https://x/a.pdf', client=client, cache=cache, doi='d') as path:
+            with open(path, 'rb') as f:
+                assert f.read() == b'%PDF-1.4 not really a pdf'
+    assert client.urls == ['https://x/a.pdf']
+
+
+def _set_in_process(directory: str, ii: int) -> bytes:
+    with ArtifactCache(directory) as cache:
+        cache.set('figure', f'https://x/F{ii}.large.jpg', bytes([ii]) * 1000)
+        return cache.get('figure', f'https://x/F{ii % 2}.large.jpg')
+
+
+def test_cache_is_shared_between_processes(tmp_path):
+    directory = str(tmp_path / 'shared')
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_set_in_process, [directory] * 8, range(8)))
+    with ArtifactCache(directory) as cache:
+        for ii in range(8):
+            assert cache.get('figure', f'https://x/F{ii}.large.jpg') == bytes([ii]) * 1000
+
+
+def test_default_cache_follows_environment(monkeypatch, tmp_path):
+    monkeypatch.setattr(artifact_cache, '_default_cache', None)
+    monkeypatch.delenv(artifact_cache.CACHE_DIR_ENV_VAR, raising=False)
+    assert artifact_cache.get_default_cache() is None
+
+    monkeypatch.setenv(artifact_cache.CACHE_DIR_ENV_VAR, str(tmp_path / 'default'))
+    cache = artifact_cache.get_default_cache()
+    assert cache.directory == str(tmp_path / 'default')
+    assert artifact_cache.get_default_cache() is cache
+    cache.close()
+
+
+class RevalidatingClient:
+    """Serves `content` with an ETag, answering conditional requests with 304 while `etag` matches"""
+
+    def __init__(self, content: bytes = b'{}', etag: str = '"v1"'):
+        self.content = content
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append(headers or {})
+        response = requests.models.Response()
+        response.url = url
+        response.headers['ETag'] = self.etag
+        response.headers['Last-Modified'] = 'Wed, 01 Feb 2023 00:00:00 GMT'
+        if headers and headers.get('If-None-Match') == self.etag:
+            response.status_code = 304
+            response._content = b''
+        else:
+            response.status_code = 200
+            response._content = self.content
+        return response
+
+
+def test_fresh_artifacts_are_not_revalidated(tmp_path):
+    client = RevalidatingClient()
+    with ArtifactCache(str(tmp_path / 'ttl'), ttls={'metadata': 60}) as cache:
+        for _ in range(3):
+            cached_get('https://x/details', 'metadata', client=client, cache=cache)
+    assert client.requests == [{}]
+
+
+def test_stale_artifacts_are_revalidated(tmp_path):
+    client = RevalidatingClient(content=b'{"version": 1}')
+    with ArtifactCache(str(tmp_path / 'ttl'), ttls={'metadata': 0}) as cache:
+        assert cached_get('https://x/details', 'metadata', client=client, cache=cache)
+        assert cached_get('https://x/details', 'metadata', client=client, cache=cache) == (
+            b'{"version": 1}'
+        )
+        assert client.requests[1] == {
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Wed, 01 Feb 2023 00:00:00 GMT',
+        }
+
+        # a changed artifact is downloaded and replaces the cached one
+        client.content, client.etag = b'{"version": 2}', '"v2"'
+        assert cached_get('https://x/details', 'metadata', client=client, cache=cache) == (
+            b'{"version": 2}'
+        )
+        assert cache.get_reference('metadata', 'https://x/details')['etag'] == '"v2"'
@@ -1,9 +1,17 @@
+import base64
 import datetime
+import os
+import random
+import time
+import urllib
+from io import BytesIO
 from typing import List
 
 import pytest
 import requests
+from PIL import Image
 
+from paperview.retrieval import biorxiv_api, pdf_extraction
 from paperview.retrieval.biorxiv_api import (
     Article,
     ArticleDetail,
@@ -11,9 +19,12 @@ from paperview.retrieval.biorxiv_api import (
     _query_content_detail_by_doi,
     get_all_content_details_by_interval,
     get_content_detail_for_page,
+    iter_content_details_by_interval,
+    normalize_doi,
     query_content_detail_by_interval,
     validate_interval,
 )
+from paperview.retrieval.encoded_image import EncodedImage
 
 
 @pytest.fixture
@@ -95,6 +106,49 @@ def test_get_all_content_details_by_interval():
     assert len(result) >= 0
 
 
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_get_all_content_details_by_interval_merges_pages_in_cursor_order(monkeypatch, max_workers):
+    total = 345
+
+    def fake_query(interval, cursor=0, server="biorxiv", format="JSON", client=None):
+        time.sleep(random.uniform(0, 0.01))
+        message = Message(status="ok", interval=interval, cursor=str(cursor), total=total)
+        collections = list(range(cursor, min(cursor + 100, total)))
+        return {"messages": [message], "collections": collections}
+
+    monkeypatch.setattr(biorxiv_api, "query_content_detail_by_interval", fake_query)
+    result = get_all_content_details_by_interval("2018-08-21/2018-08-28", max_workers=max_workers)
+    assert result == list(range(total))
+
+
+def test_iter_content_details_by_interval_resumes_from_checkpoint(monkeypatch, tmp_path):
+    total = 345
+    interval = "2018-08-21/2018-08-28"
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+
+    def fake_query(interval, cursor=0, server="biorxiv", format="JSON", client=None):
+        return {"messages": [], "collections": list(range(cursor, min(cursor + 100, total)))}
+
+    monkeypatch.setattr(biorxiv_api, "query_content_detail_by_interval", fake_query)
+
+    # simulate a crash part way through the second page
+    consumed = []
+    for record in iter_content_details_by_interval(interval, checkpoint_path=checkpoint_path):
+        consumed.append(record)
+        if len(consumed) == 150:
+            break
+    assert consumed == list(range(150))
+
+    resumed = list(iter_content_details_by_interval(interval, checkpoint_path=checkpoint_path))
+    assert resumed == list(range(100, total))
+    assert not (tmp_path / "checkpoint.json").exists()
+
+    # a checkpoint of another interval is not resumed from
+    biorxiv_api.save_cursor_checkpoint(checkpoint_path, interval, "bioRxiv", 100)
+    with pytest.raises(ValueError):
+        list(iter_content_details_by_interval("7d", checkpoint_path=checkpoint_path))
+
+
 def test_query_recent_content():
     # Test content from 8 days ago through yesterday
     yesterday = datetime.date.today() - datetime.timedelta(days=1)
@@ -108,6 +162,170 @@ def test_detection_of_full_jats_xml():
     pass
 
 
+class FakeImageClient:
+    """Serves a tiny JPEG whose width encodes the figure number, failing for `missing` slugs"""
+
+    def __init__(self, missing=()):
+        self.missing = missing
+
+    def get(self, url):
+        slug = url.split('/')[-1].split('.')[0]
+        time.sleep(random.uniform(0, 0.02))
+        response = requests.models.Response()
+        if slug in self.missing:
+            response.status_code = 404
+            response.url = url
+            return response
+        buffered = BytesIO()
+        Image.new('RGB', (int(slug[1:]), 1)).save(buffered, format='JPEG')
+        response.status_code = 200
+        response._content = buffered.getvalue()
+        return response
+
+
+@pytest.mark.parametrize(
+    "doi",
+    [
+        "10.1101/2020.01.01.123456",
+        " https://doi.org/10.1101/2020.01.01.123456\n",
+        "DOI:10.1101/2020.01.01.123456",
+    ],
+)
+def test_normalize_doi(doi):
+    assert normalize_doi(doi) == "10.1101/2020.01.01.123456"
+
+
+def test_get_images_preserves_order_and_skips_failures(example_article_detail):
+    article_detail = ArticleDetail.from_collection_dict(dict(example_article_detail))
+    slugs = [f'F{ii}' for ii in range(1, 13)]
+    images = article_detail.get_images(
+        slugs, client=FakeImageClient(missing=('F5',)), max_workers=4
+    )
+    assert len(images) == len(slugs)
+    assert images[4] is None
+    assert [image.width for image in images if image is not None] == [
+        ii for ii in range(1, 13) if ii != 5
+    ]
+
+
+class FileClient:
+    """Serves the content of `files` by URL"""
+
+    def __init__(self, files: dict):
+        self.files = files
+
+    def get(self, url, **kwargs):
+        response = requests.models.Response()
+        response.url = url
+        response.status_code = 200
+        response.raw = BytesIO(self.files[url])
+        return response
+
+
+def test_pdf_figures_are_rendered_lazily_while_the_article_is_open(
+    example_article_detail, tmp_path
+):
+    article_detail = ArticleDetail.from_collection_dict(dict(example_article_detail))
+    front_matter = (
+        '<article><front><article-meta><title-group><article-title>Title</article-title>'
+        '</title-group><abstract><p>Abstract.</p></abstract></article-meta></front></article>'
+    )
+    # a figure page and a page holding only a small decorative glyph
+    pdf_path = str(tmp_path / 'article.pdf')
+    figure, logo = Image.new('RGB', (200, 100), 'red'), Image.new('RGB', (10, 10), 'blue')
+    figure.save(pdf_path, save_all=True, append_images=[logo])
+    with open(pdf_path, 'rb') as f:
+        client = FileClient(
+            {article_detail.jatsxml: front_matter.encode(), article_detail.pdf_url: f.read()}
+        )
+
+    kwargs = dict(extract_text_from_pdf=False, extract_words_from_pdf=False)
+    min_image_area = pdf_extraction.MIN_FIGURE_AREA
+    with Article(article_detail, client=client, min_image_area=min_image_area, **kwargs) as article:
+        assert not article.full_xml_retrieved
+        (image,) = article.data['images']
+        assert isinstance(image['image'], pdf_extraction.DeferredImage)
+        assert os.path.exists(image['image'].pdf_path)
+    assert not os.path.exists(image['image'].pdf_path)
+
+
+def test_figures_are_kept_and_embedded_as_downloaded(example_article_detail):
+    article_detail = ArticleDetail.from_collection_dict(dict(example_article_detail))
+    client = FakeImageClient()
+    figure = article_detail.get_image('F7', client=client)
+    assert isinstance(figure, EncodedImage)
+    assert (figure.format, figure.size) == ('JPEG', (7, 1))
+    assert figure.decode().size == (7, 1)
+
+    image = {'image': figure, 'image_number': 1, 'caption': 'Figure 7.'}
+    html = biorxiv_api.generate_image_html(image, save_images_to_tempfiles=False)['html']
+    original = base64.b64encode(client.get(article_detail.get_image_url('F7')).content)
+    assert f'data:image/jpeg;base64,{urllib.parse.quote(original)}' in html
+    assert 'width="7" height="1"' in html
+
+
+def test_figures_can_be_referenced_by_url_with_a_srcset():
+    image = {
+        'image': EncodedImage.from_pil(Image.new('RGB', (1000, 400)), format='JPEG'),
+        'slug': 'F2',
+        'image_number': 2,
+        'caption': 'Figure 2.',
+    }
+
+    def image_url(image, width):
+        return f"/images/{biorxiv_api.image_slug(image)}" + (f"?width={width}" if width else '')
+
+    output = biorxiv_api.generate_image_html(
+        image,
+        save_images_to_tempfiles=False,
+        image_url=image_url,
+        thumbnail_widths=(320, 640, 1280),
+    )
+    assert output['temp_file_name'] is None
+    html = output['html']
+    assert 'base64' not in html
+    assert 'src="/images/F2?width=320"' in html
+    assert 'srcset="/images/F2?width=320 320w, /images/F2?width=640 640w"' in html
+    assert 'loading="lazy"' in html
+    # the full image is only the click-through link
+    assert '<a href="/images/F2" target="_blank">' in html
+    assert html.count('"/images/F2"') == 1
+
+    image['image'] = EncodedImage.from_pil(Image.new('RGB', (200, 100)), format='JPEG')
+    html = biorxiv_api.generate_image_html(image, False, image_url=image_url)['html']
+    assert 'src="/images/F2"' in html and 'srcset' not in html
+    assert biorxiv_api.image_slug({'slug': None, 'image_number': 3}) == 'image3'
+
+
+def test_overview_html_is_streamed_metadata_first(example_article_detail):
+    article_detail = ArticleDetail.from_collection_dict(dict(example_article_detail))
+    images = [
+        {
+            'image': EncodedImage.from_pil(Image.new('RGB', (10 + ii, 10)), format='JPEG'),
+            'image_number': ii + 1,
+            'caption': f'Figure {ii + 1}.',
+        }
+        for ii in range(6)
+    ]
+
+    # the metadata block is ready before any figure is touched
+    pieces = biorxiv_api.iter_overview_html([{}], article_detail, save_images_to_tempfiles=False)
+    assert article_detail.title in next(pieces)
+    with pytest.raises(KeyError):
+        next(pieces)
+
+    pieces = list(
+        biorxiv_api.iter_overview_html(
+            images, article_detail, save_images_to_tempfiles=False, max_workers=3
+        )
+    )
+    assert len(pieces) == len(images) + 2
+    for ii, piece in enumerate(pieces[1:-1]):
+        assert f'Figure {ii + 1}.' in piece
+    overview = biorxiv_api.OverviewHtml(images, article_detail, save_images_to_tempfiles=False)
+    assert overview.html == ''.join(pieces)
+
+
 # def test_create_Article_from_ArticleDetail(example_article_detail):
 #     article_detail = ArticleDetail(**example_article_detail)
 #     article = Article(article_detail)
@@ -0,0 +1,48 @@
+import requests
+
+from paperview.retrieval.http_client import (
+    HttpClient,
+    get_default_client,
+    set_default_client,
+)
+
+
+class RecordingSession(requests.Session):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        return None
+
+
+def test_adapter_is_pooled_per_host():
+    client = HttpClient(pool_connections=4, pool_maxsize=8)
+    adapter = client.session.get_adapter('https://api.biorxiv.org')
+    assert adapter._pool_connections == 4
+    assert adapter._pool_maxsize == 8
+    assert client.session.get_adapter('https://www.biorxiv.org') is adapter
+
+
+def test_default_timeout_is_applied():
+    session = RecordingSession()
+    client = HttpClient(timeout=(1, 2), session=session)
+    client.get('https://api.biorxiv.org/a')
+    client.get('https://api.biorxiv.org/b', timeout=10)
+    assert session.calls == [
+        ('https://api.biorxiv.org/a', {'timeout': (1, 2)}),
+        ('https://api.biorxiv.org/b', {'timeout': 10}),
+    ]
+
+
+def test_default_client_is_shared_and_replaceable():
+    original = get_default_client()
+    assert get_default_client() is original
+
+    replacement = HttpClient()
+    set_default_client(replacement)
+    try:
+        assert get_default_client() is replacement
+    finally:
+        set_default_client(original)
@@ -1,6 +1,36 @@
+import mmap
+import os
+import pickle
+
 import pandas as pd
+import pytest
+from PIL import Image
+
+from paperview.retrieval.pdf_extraction import (
+    MIN_FIGURE_AREA,
+    DeferredImage,
+    NamedTemporaryPDF,
+    SplicedImage,
+    extract_all,
+    extract_figure_labels,
+    find_candidate_labels,
+    find_candidate_labels_for_figures,
+    identify_line_numbers,
+    order_images,
+    render_image,
+    shard_page_numbers,
+    splice_images,
+    word_df_to_line_df,
+)
+
+try:
+    import wand.image  # noqa: F401 -- pdfplumber renders page crops with ImageMagick
+
+    has_imagemagick = True
+except ImportError:
+    has_imagemagick = False
 
-from paperview.retrieval.pdf_extraction import extract_figure_labels, order_images
+requires_imagemagick = pytest.mark.skipif(not has_imagemagick, reason="ImageMagick not installed")
 
 
 def test_order_images():
@@ -110,3 +140,278 @@ def test_next_page_extraction():
     ]
     print(extract_figure_labels(image, lines))
     assert extract_figure_labels(image, lines) == expected_output
+
+
+@pytest.fixture
+def image_pdf_path(tmp_path):
+    """A 5-page PDF with one differently coloured image per page"""
+    pages = [Image.new('RGB', (200, 100), (40 * ii, 0, 0)) for ii in range(5)]
+    path = str(tmp_path / 'images.pdf')
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+    return path
+
+
+def test_shard_page_numbers():
+    assert shard_page_numbers(5, 2) == [[1, 2, 3], [4, 5]]
+    assert shard_page_numbers(2, 8) == [[1], [2]]
+    assert shard_page_numbers(0, 4) == []
+
+
+def test_parallel_extraction_without_images_matches_serial(image_pdf_path):
+    kwargs = dict(extract_images=False, extract_words=False, extract_tables=True)
+    serial = extract_all(image_pdf_path, **kwargs)
+    parallel = extract_all(image_pdf_path, n_workers=2, **kwargs)
+    assert parallel == serial
+
+
+@requires_imagemagick
+def test_parallel_extraction_matches_serial(image_pdf_path):
+    kwargs = dict(extract_words=False, extract_tables=True, resolution=36)
+    serial = extract_all(image_pdf_path, **kwargs)
+    parallel = extract_all(image_pdf_path, n_workers=2, **kwargs)
+
+    assert parallel['text'] == serial['text']
+    assert parallel['tables'] == serial['tables']
+    assert [image['page_number'] for image in parallel['images']] == [1, 2, 3, 4, 5]
+    for serial_image, parallel_image in zip(serial['images'], parallel['images']):
+        assert parallel_image['top'] == serial_image['top']
+        assert parallel_image['doctop'] == serial_image['doctop']
+        assert parallel_image['image'].tobytes() == serial_image['image'].tobytes()
+
+
+def make_tiled_figure(n_rows: int, n_cols: int, page_number: int = 1) -> list:
+    """Cut a figure into a grid of strips laid out like pdfplumber image records (10 pt = 10 px)"""
+    strips = []
+    for row in range(n_rows):
+        for col in range(n_cols):
+            top, x0 = 100 + 10 * row, 50 + 20 * col
+            strips.append(
+                {
+                    'page_number': page_number,
+                    'x0': x0,
+                    'x1': x0 + 20,
+                    'top': top,
+                    'bottom': top + 10,
+                    'y0': 800 - top - 10,
+                    'y1': 800 - top,
+                    'doctop': top,
+                    'width': 20,
+                    'height': 10,
+                    'image': Image.new('RGB', (20, 10), (10 * row, 10 * col, 0)),
+                }
+            )
+    return strips
+
+
+def test_splice_images_merges_grid_into_one_image():
+    strips = make_tiled_figure(n_rows=6, n_cols=3)
+    other = make_tiled_figure(n_rows=1, n_cols=1, page_number=2)
+    spliced = splice_images(strips[::-1] + other)
+
+    assert len(spliced) == 2
+    figure = next(image for image in spliced if image['page_number'] == 1)
+    assert figure['image'].size == (60, 60)
+    assert (figure['x0'], figure['x1'], figure['top'], figure['bottom']) == (50, 110, 100, 160)
+    assert figure['height'] == 60 and figure['width'] == 60
+    for strip in strips:
+        x, y = strip['x0'] - 50, strip['top'] - 100
+        assert figure['image'].getpixel((x + 5, y + 5)) == strip['image'].getpixel((5, 5))
+
+
+def test_splice_images_leaves_unrelated_images_alone():
+    a, b = make_tiled_figure(n_rows=1, n_cols=1) * 2
+    b = dict(b, top=500, bottom=510)
+    assert splice_images([a, b]) == [a, b]
+
+
+def test_splice_images_keeps_images_linked_in_a_cycle():
+    (strip,) = make_tiled_figure(n_rows=1, n_cols=1)
+    # hairline strips at the same position each follow the other, vertically and then horizontally
+    hairlines = [dict(strip, bottom=strip['top'], height=0) for _ in range(2)]
+    assert splice_images(hairlines) == hairlines
+    slivers = [dict(strip, x1=strip['x0'], width=0) for _ in range(2)]
+    assert splice_images(slivers) == slivers
+
+
+def test_word_df_to_line_df():
+    def word(text, x0, top, page_number=1):
+        return {
+            'text': text,
+            'x0': x0,
+            'top': top,
+            'bottom': top + 10,
+            'doctop': top + 800 * (page_number - 1),
+            'upright': True,
+            'direction': 1,
+            'page_number': page_number,
+            'page_height': 800,
+            'top_abs': top + 800 * (page_number - 1),
+            'bottom_abs': top + 10 + 800 * (page_number - 1),
+        }
+
+    words = pd.DataFrame(
+        [
+            word('world', 100, 20),
+            word('1', 10, 20),
+            word('hello', 60, 20),
+            word('second', 60, 100),
+            word('next', 80, 30, page_number=2),
+            word('page', 120, 30, page_number=2),
+        ]
+    )
+    line_df = word_df_to_line_df(identify_line_numbers(words))
+
+    assert list(line_df.columns) == [
+        'line_number',
+        'top_abs',
+        'bottom_abs',
+        'text',
+        'top',
+        'bottom',
+        'upright',
+        'direction',
+        'page_height',
+        'doctop',
+        'page_number',
+        'num_words',
+        'line_number_by_page',
+        'dist_to_next_line',
+        'is_biorxiv_watermark_line',
+    ]
+    assert line_df['text'].tolist() == ['hello world', 'second', 'next page']
+    assert line_df['line_number'].tolist() == [0, 1, 2]
+    assert line_df['line_number_by_page'].tolist() == [1, 2, 1]
+    assert line_df['num_words'].tolist() == [2, 1, 2]
+    assert line_df['dist_to_next_line'].tolist()[:2] == [70, 720]
+    assert line_df['is_biorxiv_watermark_line'].tolist() == [True, False, True]
+
+
+def test_find_candidate_labels_batches_all_images():
+    lines = pd.DataFrame(
+        [
+            {'page_number': 1, 'top': 20, 'bottom': 30, 'text': 'Figure 1: a', 'line_number': 1},
+            {'page_number': 1, 'top': 300, 'bottom': 310, 'text': 'see fig 2b', 'line_number': 2},
+            {'page_number': 2, 'top': 40, 'bottom': 50, 'text': 'Fig. 3', 'line_number': 3},
+            {'page_number': 3, 'top': 40, 'bottom': 50, 'text': 'no label', 'line_number': 4},
+        ]
+    )
+    images = [
+        {'image_number': 1, 'page_number': 1, 'top': 0, 'bottom': 100},
+        {'image_number': 2, 'page_number': 1, 'top': 200, 'bottom': 290},
+        {'image_number': 3, 'page_number': 3, 'top': 0, 'bottom': 100},
+    ]
+    labels = find_candidate_labels(images, lines)
+
+    assert labels['image_number'].tolist() == [1, 1, 1, 2, 2, 2]
+    assert labels['label'].tolist() == ['1', '2b', '3'] * 2
+    assert labels['distance'].tolist() == [0, 205, 255, 175, 15, 65]
+
+    images = find_candidate_labels_for_figures(images, lines)
+    assert images[1]['candidate_labels']['label'].tolist() == ['1', '2b', '3']
+    assert images[2]['candidate_labels'].empty
+
+
+def test_images_are_deferred_and_filtered_by_area(tmp_path):
+    # a figure page and a page holding only a small decorative glyph
+    path = str(tmp_path / 'figure_and_logo.pdf')
+    figure, logo = Image.new('RGB', (200, 100), 'red'), Image.new('RGB', (10, 10), 'blue')
+    figure.save(path, save_all=True, append_images=[logo])
+
+    kwargs = dict(extract_words=False, extract_text=False, extract_tables=False)
+    data = extract_all(path, render_images=False, resolution=144, **kwargs)
+    handles = [image['image'] for image in data['images']]
+    assert all(isinstance(handle, DeferredImage) for handle in handles)
+    assert [handle.page_number for handle in handles] == [1, 2]
+    assert (handles[0].width, handles[0].height) == (400, 200)
+    assert pickle.loads(pickle.dumps(handles[0])).bbox == handles[0].bbox
+
+    data = extract_all(path, render_images=False, min_image_area=MIN_FIGURE_AREA, **kwargs)
+    assert [image['page_number'] for image in data['images']] == [1]
+
+
+def test_splicing_deferred_images_is_deferred():
+    strips = make_tiled_figure(n_rows=3, n_cols=1)
+    for strip in strips:
+        bbox = (strip['x0'], strip['top'], strip['x1'], strip['bottom'])
+        strip['image'] = DeferredImage('unused.pdf', strip['page_number'], bbox, resolution=72)
+    (figure,) = splice_images(strips)
+    assert isinstance(figure['image'], SplicedImage)
+    assert (figure['image'].width, figure['image'].height) == (20, 30)
+
+
+@requires_imagemagick
+def test_deferred_images_render_on_demand(image_pdf_path):
+    kwargs = dict(extract_words=False, extract_text=False, extract_tables=False, resolution=36)
+    eager = extract_all(image_pdf_path, **kwargs)
+    lazy = extract_all(image_pdf_path, render_images=False, **kwargs)
+    for eager_image, lazy_image in zip(eager['images'], lazy['images']):
+        assert render_image(lazy_image['image']).tobytes() == eager_image['image'].tobytes()
+
+
+class FakeStreamingResponse(object):
+    def __init__(self, content: bytes, headers: dict = None):
+        self.status_code = 200
+        self.headers = headers or {}
+        self.content = content
+        self.chunk_sizes = []
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            self.chunk_sizes.append(chunk_size)
+            yield self.content[start : start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeStreamingClient(object):
+    def __init__(self, response):
+        self.response = response
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        return self.response
+
+
+def test_named_temporary_pdf_streams_to_disk(image_pdf_path):
+    with open(image_pdf_path, 'rb') as f:
+        content = f.read()
+    response = FakeStreamingResponse(content)
+    client = FakeStreamingClient(response)
+
+    with NamedTemporaryPDF('https://example.org/a.pdf', client=client, chunk_size=1024) as path:
+        with open(path, 'rb') as f:
+            assert f.read() == content
+    assert client.calls == [('https://example.org/a.pdf', {'stream': True})]
+    assert len(response.chunk_sizes) == -(-len(content) // 1024)
+    assert response.closed
+    assert not os.path.exists(path)
+
+
+def test_named_temporary_pdf_memory_map_extracts_like_path(image_pdf_path):
+    with open(image_pdf_path, 'rb') as f:
+        client = FakeStreamingClient(FakeStreamingResponse(f.read()))
+
+    kwargs = dict(extract_images=False, extract_words=False, n_workers=2)
+    with NamedTemporaryPDF('https://example.org/a.pdf', client=client, memory_map=True) as pdf:
+        assert isinstance(pdf, mmap.mmap)
+        assert extract_all(pdf, **kwargs) == extract_all(image_pdf_path, **kwargs)
+    assert pdf.closed
+
+
+@pytest.mark.parametrize('headers', [{'Content-Length': '5000'}, {}])
+def test_named_temporary_pdf_enforces_max_size(headers):
+    response = FakeStreamingResponse(b'%PDF' + b'0' * 4996, headers=headers)
+    pdf = NamedTemporaryPDF(
+        'https://example.org/a.pdf',
+        client=FakeStreamingClient(response),
+        chunk_size=1024,
+        max_size=4096,
+    )
+    with pytest.raises(ValueError):
+        with pdf:
+            pass
+    assert pdf.temp_file_name is None
+    assert response.closed
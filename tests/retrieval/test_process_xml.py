@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from paperview.retrieval import process_xml
+
+
+def make_jats_xml(n_figures: int = 3, n_sections: int = 3) -> str:
+    """Builds a small bioRxiv-style JATS document with nested sections, figures and a table"""
+    results = ''
+    for ii in range(1, n_sections + 1):
+        results += f"""
+            <sec id="sec-{ii}"><title>Result {ii}</title>
+                <p>First paragraph of result {ii}.</p>
+                <sec><title>Detail {ii}</title><p>Nested paragraph {ii}.</p></sec>
+                <p>Paragraph after the nested section {ii}.</p>
+            </sec>"""
+    figures = ''
+    for ii in range(1, n_figures + 1):
+        figures += f"""
+            <fig id="F{ii}" position="float" fig-type="figure">
+                <object-id pub-id-type="other" hwp:sub-type="slug">F{ii}</object-id>
+                <label>Figure {ii}.</label>
+                <caption><title>Figure {ii} title.</title><p>Caption of figure {ii}.</p></caption>
+                <graphic xlink:href="000000v1_fig{ii}.tif"/>
+            </fig>"""
+    return f"""<article xmlns:xlink="http://www.w3.org/1999/xlink" xmlns:hwp="http://schema.highwire.org/Journal" article-type="article">
+    <front>
+        <journal-meta>
+            <journal-id journal-id-type="hwp">biorxiv</journal-id>
+            <journal-title-group><journal-title>bioRxiv</journal-title></journal-title-group>
+        </journal-meta>
+        <article-meta>
+            <article-id pub-id-type="doi">10.1101/000000</article-id>
+            <title-group><article-title>A <italic>test</italic> article</article-title></title-group>
+            <contrib-group>
+                <contrib contrib-type="author"><name><surname>Doe</surname><given-names>Jane</given-names></name></contrib>
+            </contrib-group>
+            <pub-date pub-type="epub"><day>1</day><month>2</month><year>2020</year></pub-date>
+            <abstract><p>The abstract.</p></abstract>
+        </article-meta>
+    </front>
+    <body>
+        <sec id="intro"><title>Introduction</title><p>The introduction.</p></sec>
+        <sec id="results"><title>Results</title>
+            <p>Results overview.</p>{results}{figures}
+            <table-wrap id="T1" orientation="portrait" position="float">
+                <object-id pub-id-type="other" hwp:sub-type="slug">T1</object-id>
+                <label>Table 1.</label>
+                <caption><p>Caption of table 1.</p></caption>
+                <table><thead><tr><th>a</th><th>b</th></tr></thead><tbody><tr><td>1</td><td>2</td></tr></tbody></table>
+            </table-wrap>
+        </sec>
+        <sec id="methods"><title>Methods</title><p>The methods.</p></sec>
+    </body>
+</article>"""
+
+
+@pytest.fixture
+def jats_xml():
+    return make_jats_xml()
+
+
+def test_xmlstr_to_dict_builds_section_ids(jats_xml):
+    doc = process_xml.xmlstr_to_dict(jats_xml)
+    titles = [section['title'] for section in doc['body_sections']]
+    assert titles[:2] == ['Title', 'Abstract']
+    assert 'Results' in titles
+    ids = [section['id'] for section in doc['body_sections']]
+    assert len(ids) == len(set(ids))
+
+
+def test_parse_reports_errors_on_its_own_context(jats_xml):
+    ctx = process_xml.ParserContext()
+    process_xml.parse_PMC_XML_core(jats_xml, None, 'test.xml', ctx)
+    assert ctx.file_status['name'] == 'test.xml'
+    assert not ctx.ok()  # no pmc or archive id in the test document
+
+
+def test_extract_all_is_thread_safe():
+    documents = [make_jats_xml(n_figures=ii % 4 + 1, n_sections=ii % 5 + 1) for ii in range(16)]
+    expected = [process_xml.extract_all(xmlstr)['all_text'] for xmlstr in documents]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(process_xml.extract_all, documents * 4))
+
+    for ii, result in enumerate(results):
+        assert result['all_text'].equals(expected[ii % len(documents)])
+
+
+def test_extract_all_finds_figure_slugs(jats_xml):
+    data = process_xml.extract_all(jats_xml)
+    assert data['figure_captions']['slug'].tolist() == ['F1', 'F2', 'F3']
+    assert data['figure_captions']['label'].tolist() == ['Figure 1.', 'Figure 2.', 'Figure 3.']
+
+
+def test_slug_index_covers_figures_and_tables(jats_xml):
+    data = process_xml.extract_all(jats_xml)
+    assert data['table_captions']['slug'].tolist() == ['T1']
+
+    root = process_xml.xmlstr_to_root(
+        '<article><body><fig><object-id hwp:sub-type="slug" xmlns:hwp="hwp">F9</object-id>'
+        '<label>Figure "9"</label></fig></body></article>'
+    )
+    assert process_xml.get_slug_index(root) == {'Figure "9"': 'F9'}
+    assert process_xml.get_fig_slug('Figure "9"', root) == 'F9'
+    assert process_xml.get_fig_slug('Figure 10', root) is None
+
+
+def test_unlabeled_figures_do_not_share_a_slug():
+    root = process_xml.xmlstr_to_root(
+        '<article xmlns:hwp="hwp"><body>'
+        '<fig><object-id hwp:sub-type="slug">F1</object-id></fig>'
+        '<fig><object-id hwp:sub-type="slug">F2</object-id><label></label></fig>'
+        '<fig><object-id hwp:sub-type="slug">F3</object-id><label>Figure 3</label></fig>'
+        '</body></article>'
+    )
+    assert process_xml.get_slug_index(root) == {'Figure 3': 'F3'}
+    assert process_xml.get_fig_slug('', root) is None
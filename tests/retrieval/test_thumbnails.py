@@ -0,0 +1,36 @@
+from PIL import Image
+
+from paperview.retrieval.encoded_image import EncodedImage
+from paperview.retrieval.thumbnails import (
+    make_all_thumbnails,
+    make_thumbnails,
+    srcset_widths,
+)
+
+
+def test_srcset_widths_only_downscale():
+    assert srcset_widths(1000, (1280, 320, 640)) == [320, 640]
+    assert srcset_widths(300, (320, 640)) == []
+
+
+def test_thumbnails_keep_the_aspect_ratio():
+    image = EncodedImage.from_pil(Image.new('RGB', (1000, 500), 'red'), format='JPEG')
+    thumbnails = make_thumbnails(image, widths=(320, 640, 1280), format='WEBP', quality=60)
+    assert sorted(thumbnails) == [320, 640]
+    assert thumbnails[320].size == (320, 160)
+    assert thumbnails[640].media_type == 'image/webp'
+    assert len(thumbnails[320].content) < len(thumbnails[640].content) < len(image.content)
+
+
+def test_jpeg_thumbnails_of_images_with_transparency():
+    image = Image.new('RGBA', (800, 800), (0, 0, 255, 128))
+    (thumbnail,) = make_thumbnails(image, widths=(400,), format='JPEG').values()
+    assert (thumbnail.format, thumbnail.size) == ('JPEG', (400, 400))
+
+
+def test_make_all_thumbnails_preserves_order():
+    images = [Image.new('RGB', (400 + 100 * ii, 100)) for ii in range(6)]
+    all_thumbnails = make_all_thumbnails(images, widths=(300,), max_workers=3)
+    assert [thumbnails[300].height for thumbnails in all_thumbnails] == [
+        round(100 * 300 / (400 + 100 * ii)) for ii in range(6)
+    ]
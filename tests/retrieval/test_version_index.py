@@ -0,0 +1,92 @@
+import json
+
+import pytest
+import requests
+
+from paperview.retrieval.artifact_cache import ArtifactCache
+from paperview.retrieval.biorxiv_api import ArticleDetail
+from paperview.retrieval.version_index import LatestVersionIndex, article_key
+
+
+def collection_item(version: int) -> dict:
+    return {
+        'doi': '10.1101/456574',
+        'title': f'Version {version}',
+        'authors': 'Doe, J.; Roe, R.',
+        'author_corresponding': 'Jane Doe',
+        'author_corresponding_institution': 'Nowhere',
+        'date': '2018-10-30',
+        'version': str(version),
+        'type': 'new results',
+        'license': 'cc_by',
+        'category': 'neuroscience',
+        'jatsxml': f'https://www.biorxiv.org/content/early/2018/10/30/456574v{version}.source.xml',
+        'abstract': 'The abstract.',
+        'published': 'NA',
+        'server': 'bioRxiv',
+    }
+
+
+class DetailsClient:
+    """Serves the details of `n_versions` versions of an article, or fails if `n_versions` is None"""
+
+    def __init__(self, n_versions: int = 1):
+        self.n_versions = n_versions
+        self.urls = []
+
+    def get(self, url, headers=None):
+        self.urls.append(url)
+        if self.n_versions is None:
+            raise requests.ConnectionError()
+        response = requests.models.Response()
+        response.url = url
+        response.status_code = 200
+        collection = [collection_item(version) for version in range(1, self.n_versions + 1)]
+        response._content = json.dumps({'collection': collection}).encode()
+        return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with ArtifactCache(str(tmp_path / 'artifacts'), ttls={'metadata': 0}) as cache:
+        yield cache
+
+
+def test_details_are_of_the_latest_version():
+    article_detail = ArticleDetail.from_json(
+        {'collection': [collection_item(1), collection_item(3)]}
+    )
+    assert article_detail.version == '3'
+    assert article_key(article_detail) == ('biorxiv', '10.1101/456574', '3')
+
+
+def test_fresh_entries_are_served_without_requests(tmp_path, cache):
+    client = DetailsClient(n_versions=2)
+    with LatestVersionIndex(str(tmp_path / 'latest'), max_age=60) as index:
+        assert index.get_latest('10.1101/456574', client=client, cache=cache).version == '2'
+        client.n_versions = 3
+        for doi in ['10.1101/456574', ' https://doi.org/10.1101/456574', 'DOI:10.1101/456574']:
+            assert index.get_latest(doi, client=client, cache=cache).version == '2'
+    assert len(client.urls) == 1
+
+
+def test_new_versions_are_detected_once_stale(tmp_path, cache):
+    client = DetailsClient(n_versions=1)
+    with LatestVersionIndex(str(tmp_path / 'latest'), max_age=0) as index:
+        assert index.get_latest('10.1101/456574', client=client, cache=cache).version == '1'
+        client.n_versions = 2
+        assert index.get_latest('10.1101/456574', client=client, cache=cache).version == '2'
+
+        # stale metadata doesn't move the index back to an earlier version
+        index.set(ArticleDetail.from_collection_dict(collection_item(1)))
+        assert index.get('10.1101/456574').version == '2'
+
+
+def test_known_version_is_used_when_the_refresh_fails(tmp_path, cache):
+    client = DetailsClient(n_versions=2)
+    with LatestVersionIndex(str(tmp_path / 'latest'), max_age=0) as index:
+        index.get_latest('10.1101/456574', client=client, cache=cache)
+        client.n_versions = None
+        assert index.get_latest('10.1101/456574', client=client, cache=cache).version == '2'
+        with pytest.raises(requests.ConnectionError):
+            index.get_latest('10.1101/999999', client=client, cache=cache)